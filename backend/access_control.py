@@ -0,0 +1,97 @@
+"""Role-based access control with precompiled permission bitsets.
+
+Each permission is a "category:action" string, named like the admin UI's
+permission editor (``buses:create``, ``payments:refund``). Each one is
+assigned a bit. A user's effective permissions are their role's set OR the
+grants stored in ``users.permissions``, and they are compiled once into a
+single int. That happens when the access token is issued, and the result
+rides in the token as the ``perm`` claim. Older tokens compile it when the
+principal is loaded and cache it with the principal. Endpoint guards are
+then one AND against the required mask.
+
+Because the bitset lives in the token, a permission change applies when the
+user next refreshes, within ACCESS_TOKEN_EXPIRE_MINUTES.
+"""
+import os
+import re
+from typing import Dict, Iterable, List
+
+PERMISSION_CATALOG = {
+    "buses": ["create", "read", "update", "delete", "upload"],
+    "routes": ["create", "read", "update", "delete", "upload"],
+    "bookings": ["create", "read", "update", "delete", "refund"],
+    "users": ["create", "read", "update", "delete", "permissions"],
+    "payments": ["read", "process", "refund", "reports"],
+    "analytics": ["view", "export", "dashboard"],
+    "operations": ["manage"],
+    "system": ["metrics"]
+}
+
+PERMISSION_BITS: Dict[str, int] = {}
+for _category, _actions in PERMISSION_CATALOG.items():
+    for _action in _actions:
+        PERMISSION_BITS[f"{_category}:{_action}"] = 1 << len(PERMISSION_BITS)
+
+ALL_PERMISSIONS = (1 << len(PERMISSION_BITS)) - 1
+
+ROLES = ["passenger", "agent", "operator", "admin"]
+
+
+def permission_mask(names: Iterable[str]) -> int:
+    """Bitset for permission names; unknown names are a programming error"""
+    mask = 0
+    for name in names:
+        mask |= PERMISSION_BITS[name]
+    return mask
+
+
+ROLE_PERMISSIONS: Dict[str, int] = {
+    "passenger": 0,
+    "agent": permission_mask([
+        "routes:read", "buses:read",
+        "bookings:create", "bookings:read", "bookings:update"
+    ]),
+    "operator": permission_mask([
+        "buses:create", "buses:read", "buses:update", "buses:delete", "buses:upload",
+        "routes:create", "routes:read", "routes:update", "routes:delete", "routes:upload",
+        "bookings:read", "payments:read",
+        "analytics:view", "analytics:dashboard",
+        "operations:manage"
+    ]),
+    "admin": ALL_PERMISSIONS
+}
+
+# Emails promoted to admin (at startup, registration and login), so a fresh deployment has someone to grant roles
+ADMIN_EMAILS = [email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()]
+
+
+def is_admin_email(email: str) -> bool:
+    return bool(email) and email.strip().lower() in ADMIN_EMAILS
+
+
+def admin_email_filter() -> dict:
+    """Matches users whose email is in ADMIN_EMAILS, whatever case it was stored in"""
+    return {"$or": [{"email": {"$regex": f"^{re.escape(email)}$", "$options": "i"}} for email in ADMIN_EMAILS]}
+
+
+def granted_mask(permissions) -> int:
+    """Bitset for the stored grants ({"category": ["action", ...]}); unknown entries are ignored"""
+    mask = 0
+    if not isinstance(permissions, dict):
+        return mask
+    for category, actions in permissions.items():
+        for action in actions or []:
+            mask |= PERMISSION_BITS.get(f"{category}:{action}", 0)
+    return mask
+
+
+def compile_permissions(user: dict) -> int:
+    return ROLE_PERMISSIONS.get(user.get("role", "passenger"), 0) | granted_mask(user.get("permissions"))
+
+
+def has_permissions(mask: int, required: int) -> bool:
+    return mask & required == required
+
+
+def permission_names(mask: int) -> List[str]:
+    return [name for name, bit in PERMISSION_BITS.items() if mask & bit]
@@ -0,0 +1,109 @@
+"""Stale-while-revalidate cache for admin analytics widgets.
+
+Each widget has a TTL. A fresh value is served straight from memory. Once
+it goes stale, the last value is still returned immediately while one
+background task recomputes it. Only when nothing usable is cached (a cold
+start, or older than the stale limit) does a caller wait, and concurrent
+callers share that single in-flight load. However many dashboards are
+open, a worker runs each widget's aggregation at most once per TTL.
+
+Results that came back partial are kept only briefly, so a slow query is
+retried soon instead of being pinned for the whole TTL.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a widget stays fresh
+WIDGET_TTLS = {
+    "admin_stats": float(os.getenv("ANALYTICS_TTL_ADMIN_STATS", "30")),
+    "admin_analytics": float(os.getenv("ANALYTICS_TTL_ADMIN_ANALYTICS", "60")),
+    "management_analytics": float(os.getenv("ANALYTICS_TTL_MANAGEMENT", "60"))
+}
+DEFAULT_TTL = 30.0
+# How long past its TTL a value may still be served while refreshing
+MAX_STALE_FACTOR = 10
+PARTIAL_TTL = 5.0
+
+
+def _is_partial(value) -> bool:
+    partial = value.get("partial") if isinstance(value, dict) else getattr(value, "partial", None)
+    return bool(partial)
+
+
+class AnalyticsCache:
+    def __init__(self, ttls: Dict[str, float] = WIDGET_TTLS):
+        self.ttls = ttls
+        self._entries: Dict[str, tuple] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def ttl(self, key: str) -> float:
+        return self.ttls.get(key, DEFAULT_TTL)
+
+    async def get(self, key: str, loader: Callable[[], Awaitable]):
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            stored_at, ttl, value = entry
+            age = now - stored_at
+            if age < ttl:
+                self.hits += 1
+                return value
+            if age < ttl * MAX_STALE_FACTOR:
+                self.stale_hits += 1
+                self._refresh(key, loader)
+                return value
+
+        self.misses += 1
+        return await asyncio.shield(self._refresh(key, loader))
+
+    def _refresh(self, key: str, loader: Callable[[], Awaitable]) -> asyncio.Task:
+        """Start a load for key unless one is already running (single-flight)"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, loader))
+            # Background refreshes may have no awaiter; _load already logged any failure
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return task
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable]):
+        try:
+            self.loads += 1
+            value = await loader()
+            ttl = min(self.ttl(key), PARTIAL_TTL) if _is_partial(value) else self.ttl(key)
+            self._entries[key] = (time.monotonic(), ttl, value)
+            return value
+        except Exception as e:
+            logger.error(f"Refreshing analytics widget {key} failed: {e}")
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, key: Optional[str] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "refreshing": list(self._inflight),
+            "widgets": {
+                key: {"age_seconds": round(now - stored_at, 1), "ttl_seconds": ttl}
+                for key, (stored_at, ttl, _) in self._entries.items()
+            }
+        }
@@ -0,0 +1,269 @@
+"""Refresh tokens and session revocation.
+
+Login starts a session (``sid``). Access tokens are short-lived and carry
+the sid. Refresh tokens are opaque, single-use and stored hashed in
+``refresh_tokens``. Each refresh rotates them within the session. The
+replacement is an HMAC of the spent token, so concurrent refreshes with the
+same token (several tabs, a retried request) within REFRESH_REUSE_GRACE
+all get the same replacement. If a refresh token that was already used is
+presented again after that, it has leaked, so the whole session is revoked.
+
+Logging out writes the sid to ``revoked_sessions`` until the last access
+token for that session can have expired. Each worker mirrors that
+collection into an in-memory Bloom filter, kept in sync by polling. A check
+that misses the filter needs no database round trip. Only a filter hit,
+which is rare, is confirmed against Mongo.
+"""
+import os
+import hmac
+import math
+import uuid
+import base64
+import asyncio
+import hashlib
+import logging
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REFRESH_REUSE_GRACE = timedelta(seconds=float(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "10")))
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "5"))
+REVOCATION_FILTER_CAPACITY = int(os.getenv("REVOCATION_FILTER_CAPACITY", "100000"))
+REVOCATION_FILTER_ERROR_RATE = float(os.getenv("REVOCATION_FILTER_ERROR_RATE", "0.001"))
+
+# Revocations written by other workers are re-read with this much overlap to absorb clock skew
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class InvalidRefreshToken(Exception):
+    pass
+
+
+class RefreshTokenReused(InvalidRefreshToken):
+    """A rotated refresh token was presented again"""
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (no false negatives)"""
+
+    def __init__(self, capacity: int = REVOCATION_FILTER_CAPACITY, error_rate: float = REVOCATION_FILTER_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionStore:
+    def __init__(self, db, access_token_ttl: timedelta, secret: str,
+                 refresh_token_ttl: timedelta = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+                 sync_interval: float = REVOCATION_SYNC_SECONDS, reuse_grace: timedelta = REFRESH_REUSE_GRACE):
+        self.db = db
+        self.secret = secret.encode()
+        self.reuse_grace = reuse_grace
+        self.access_token_ttl = access_token_ttl
+        self.refresh_token_ttl = refresh_token_ttl
+        self.sync_interval = sync_interval
+        self.revoked = BloomFilter()
+        self._synced_until: Optional[datetime] = None
+        self._rebuilt_at: Optional[datetime] = None
+        self._rebuilding: Optional[BloomFilter] = None
+        self.filter_hits = 0
+        self.false_positives = 0
+        self._task = None
+
+    async def ensure_indexes(self):
+        await self.db.refresh_tokens.create_index("sid")
+        await self.db.refresh_tokens.create_index("user_id")
+        await self.db.refresh_tokens.create_index("expires_at", expireAfterSeconds=0)
+        await self.db.revoked_sessions.create_index("created_at")
+        await self.db.revoked_sessions.create_index("expires_at", expireAfterSeconds=0)
+
+    def _token_doc(self, user_id: str, sid: str, now: datetime) -> dict:
+        return {
+            "user_id": user_id,
+            "sid": sid,
+            "used_at": None,
+            "created_at": now,
+            "expires_at": now + self.refresh_token_ttl
+        }
+
+    async def _insert_refresh_token(self, user_id: str, sid: str, now: datetime) -> str:
+        token = secrets.token_urlsafe(32)
+        await self.db.refresh_tokens.insert_one({"_id": hash_refresh_token(token), **self._token_doc(user_id, sid, now)})
+        return token
+
+    def replacement_token(self, refresh_token: str) -> str:
+        """The token a refresh token rotates into, the same for every concurrent rotation"""
+        digest = hmac.new(self.secret, refresh_token.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    async def start_session(self, user_id: str) -> Tuple[str, str]:
+        """New session id and its first refresh token"""
+        sid = uuid.uuid4().hex
+        token = await self._insert_refresh_token(str(user_id), sid, datetime.utcnow())
+        return sid, token
+
+    async def rotate(self, refresh_token: str) -> Tuple[str, str, str]:
+        """Spend a refresh token; returns (user_id, sid, replacement refresh token)"""
+        now = datetime.utcnow()
+        token_hash = hash_refresh_token(refresh_token)
+        current = await self.db.refresh_tokens.find_one_and_update(
+            {"_id": token_hash, "used_at": None, "expires_at": {"$gt": now}},
+            {"$set": {"used_at": now}},
+            return_document=ReturnDocument.BEFORE
+        )
+        if current is None:
+            spent = await self.db.refresh_tokens.find_one({"_id": token_hash})
+            if not (spent and spent.get("used_at")):
+                raise InvalidRefreshToken("Unknown or expired refresh token")
+            if now - spent["used_at"] > self.reuse_grace:
+                await self._reused(spent)
+            # Spent moments ago by a concurrent refresh; hand out the same replacement
+            current = spent
+
+        sid = current["sid"]
+        replacement = self.replacement_token(refresh_token)
+        stored = await self.db.refresh_tokens.find_one_and_update(
+            {"_id": hash_refresh_token(replacement)},
+            {"$setOnInsert": self._token_doc(current["user_id"], sid, now)},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if stored.get("used_at"):
+            # The replacement has already been rotated onward
+            await self._reused(current)
+        # A logout racing this rotation must not leave a live replacement behind
+        if await self.db.revoked_sessions.find_one({"_id": sid}, {"_id": 1}):
+            await self.db.refresh_tokens.delete_many({"sid": sid})
+            raise InvalidRefreshToken("Session revoked")
+        return current["user_id"], sid, replacement
+
+    async def _reused(self, spent: dict):
+        logger.warning(f"Refresh token reuse for session {spent['sid']}, revoking it")
+        await self.revoke_sessions([spent["sid"]], spent["user_id"])
+        raise RefreshTokenReused("Refresh token already used")
+
+    async def session_for_refresh_token(self, refresh_token: str) -> Optional[dict]:
+        return await self.db.refresh_tokens.find_one({"_id": hash_refresh_token(refresh_token)})
+
+    async def revoke_sessions(self, sids, user_id: str) -> int:
+        sids = list(set(sids))
+        if not sids:
+            return 0
+
+        now = datetime.utcnow()
+        await self.db.revoked_sessions.bulk_write([
+            UpdateOne(
+                {"_id": sid},
+                {"$setOnInsert": {
+                    "user_id": str(user_id),
+                    "created_at": now,
+                    # Access tokens for the session are all expired by then
+                    "expires_at": now + self.access_token_ttl
+                }},
+                upsert=True
+            )
+            for sid in sids
+        ], ordered=False)
+        await self.db.refresh_tokens.delete_many({"sid": {"$in": sids}})
+        for sid in sids:
+            self.revoked.add(sid)
+            if self._rebuilding is not None:
+                self._rebuilding.add(sid)
+        return len(sids)
+
+    async def revoke_user(self, user_id: str, extra_sids=()) -> int:
+        """Revoke every session with a live refresh token for this user, plus extra_sids"""
+        sids = await self.db.refresh_tokens.distinct("sid", {"user_id": str(user_id)})
+        return await self.revoke_sessions(list(sids) + [sid for sid in extra_sids if sid], user_id)
+
+    async def is_revoked(self, sid: str) -> bool:
+        if sid not in self.revoked:
+            return False
+        self.filter_hits += 1
+        if await self.db.revoked_sessions.find_one({"_id": sid}, {"_id": 1}):
+            return True
+        self.false_positives += 1
+        return False
+
+    async def sync(self):
+        """Pull revocations written by other workers into the local filter"""
+        now = datetime.utcnow()
+        if self._rebuilt_at is None or now - self._rebuilt_at >= self.access_token_ttl:
+            # Start over periodically so expired revocations stop occupying the filter
+            rebuilt = BloomFilter(self.revoked.capacity, self.revoked.error_rate)
+            query = {"expires_at": {"$gt": now}}
+        else:
+            rebuilt = None
+            query = {"created_at": {"$gte": self._synced_until - SYNC_OVERLAP}}
+
+        self._rebuilding = rebuilt
+        try:
+            target = rebuilt or self.revoked
+            async for doc in self.db.revoked_sessions.find(query, {"_id": 1}):
+                target.add(doc["_id"])
+        finally:
+            self._rebuilding = None
+
+        if rebuilt is not None:
+            self._rebuilt_at = now
+            if rebuilt.count > rebuilt.capacity:
+                logger.warning(f"Revocation filter over capacity ({rebuilt.count} > {rebuilt.capacity})")
+            self.revoked = rebuilt
+        self._synced_until = now
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Revocation filter sync failed: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    def stats(self) -> dict:
+        return {
+            "filter_entries": self.revoked.count,
+            "filter_capacity": self.revoked.capacity,
+            "filter_bytes": len(self.revoked.bits),
+            "filter_hits": self.filter_hits,
+            "false_positives": self.false_positives,
+            "synced_until": self._synced_until
+        }
@@ -0,0 +1,157 @@
+"""Ordered booking event log (transactional outbox).
+
+Every booking/payment state change appends an event to ``booking_events`` in
+the same transaction as the change itself. Events get a gap-free sequence
+number from a counter document. That counter increment rolls back with an
+aborted transaction, so consumers can read in strict order with a resumable
+checkpoint instead of re-querying ``bookings``.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+BOOKING_CREATED = "booking.created"
+BOOKING_PAID = "booking.paid"
+BOOKING_CANCELLED = "booking.cancelled"
+BOOKING_EXPIRED = "booking.expired"
+BOOKING_REFUNDED = "booking.refunded"
+
+
+def booking_snapshot(booking: dict) -> dict:
+    """Fields downstream consumers need without going back to the booking"""
+    return {
+        "user_id": booking.get("user_id"),
+        "booking_reference": booking.get("booking_reference"),
+        "route_id": booking.get("route_id"),
+        "operator": booking.get("operator"),
+        "date": booking.get("date"),
+        "departure_at": booking.get("departure_at"),
+        "departure_time": booking.get("departure_time"),
+        "seat_count": len(booking.get("seats", [])),
+        "total_price": booking.get("total_price", 0),
+        "status": booking.get("status")
+    }
+
+
+async def ensure_event_indexes(db):
+    await db.booking_events.create_index("seq", unique=True)
+    await db.booking_events.create_index([("booking_id", 1), ("seq", 1)])
+
+
+async def append_events(db, events: List[dict], session=None) -> List[int]:
+    """Append (type, booking_id, data) dicts with consecutive sequence numbers"""
+    if not events:
+        return []
+
+    counter = await db.counters.find_one_and_update(
+        {"_id": "booking_events"},
+        {"$inc": {"seq": len(events)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    first_seq = counter["seq"] - len(events) + 1
+    now = datetime.utcnow()
+
+    docs = []
+    for offset, event in enumerate(events):
+        docs.append({
+            "seq": first_seq + offset,
+            "type": event["type"],
+            "booking_id": str(event["booking_id"]),
+            "data": event.get("data", {}),
+            "created_at": now
+        })
+    await db.booking_events.insert_many(docs, session=session)
+    return [doc["seq"] for doc in docs]
+
+
+async def append_event(db, event_type: str, booking_id, data: Optional[dict] = None, session=None) -> int:
+    seqs = await append_events(db, [{"type": event_type, "booking_id": booking_id, "data": data or {}}], session=session)
+    return seqs[0]
+
+
+class EventConsumer:
+    """Resumable in-order reader of booking_events.
+
+    ``poll`` returns the next contiguous run of events after the stored
+    checkpoint; ``commit`` advances it. Processing is at-least-once, so
+    consumers should apply events idempotently or commit after each batch.
+    A sequence gap means a transaction is still committing; the consumer
+    waits for it and only skips the gap once it is older than gap_timeout
+    (possible only when writes fall back to non-transactional mode).
+    """
+
+    def __init__(self, db, name: str, batch_size: int = 500, gap_timeout: float = 30.0):
+        self.db = db
+        self.name = name
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self.position: Optional[int] = None
+        self._gap_seen_at: Optional[datetime] = None
+
+    async def load(self) -> int:
+        if self.position is None:
+            state = await self.db.event_consumers.find_one({"_id": self.name})
+            self.position = state["position"] if state else 0
+        return self.position
+
+    async def poll(self) -> List[dict]:
+        position = await self.load()
+        events = await self.db.booking_events.find(
+            {"seq": {"$gt": position}}
+        ).sort("seq", 1).limit(self.batch_size).to_list(length=self.batch_size)
+
+        expected = position + 1
+        contiguous = []
+        for event in events:
+            if event["seq"] != expected:
+                break
+            contiguous.append(event)
+            expected += 1
+
+        if contiguous or not events:
+            self._gap_seen_at = None
+            return contiguous
+
+        # Next event is past a gap
+        now = datetime.utcnow()
+        if self._gap_seen_at is None:
+            self._gap_seen_at = now
+        if (now - self._gap_seen_at).total_seconds() < self.gap_timeout:
+            return []
+
+        logger.warning(f"Consumer {self.name} skipping events {expected}..{events[0]['seq'] - 1} that never committed")
+        self._gap_seen_at = None
+        self.position = events[0]["seq"] - 1
+        return await self.poll()
+
+    async def commit(self, events: List[dict]):
+        if not events:
+            return
+        self.position = events[-1]["seq"]
+        await self.db.event_consumers.update_one(
+            {"_id": self.name},
+            {"$set": {"position": self.position, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def run(self, handler, idle_interval: float = 1.0):
+        """Feed batches to handler(events) forever, committing after each"""
+        while True:
+            try:
+                events = await self.poll()
+                if events:
+                    await handler(events)
+                    await self.commit(events)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event consumer {self.name} failed: {e}")
+            await asyncio.sleep(idle_interval)
@@ -0,0 +1,138 @@
+"""Seat holds for unpaid bookings.
+
+A pending booking holds its seats until ``expires_at``. Seat availability
+counts confirmed/paid bookings plus unexpired holds. The sweeper flips
+expired holds to ``expired`` in indexed batches. Inventory is derived from
+booking status, so that single-document status change is what releases the
+seats.
+"""
+import os
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from booking_events import BOOKING_EXPIRED, append_events, booking_snapshot
+from transactions import run_in_transaction
+
+logger = logging.getLogger(__name__)
+
+BOOKING_HOLD_MINUTES = int(os.getenv("BOOKING_HOLD_MINUTES", "15"))
+BOOKING_SWEEP_SECONDS = float(os.getenv("BOOKING_SWEEP_SECONDS", "10"))
+
+SEAT_BLOCKING_STATUSES = ["confirmed", "paid"]
+
+# Distinguishes this process's sweeps from other workers sweeping the same batch
+SWEEPER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def hold_expiry(now: Optional[datetime] = None) -> datetime:
+    """Expiry for a hold created now"""
+    return (now or datetime.utcnow()) + timedelta(minutes=BOOKING_HOLD_MINUTES)
+
+
+def seats_taken_filter(now: Optional[datetime] = None) -> dict:
+    """Match bookings whose seats are unavailable to other customers"""
+    return {"$or": [
+        {"status": {"$in": SEAT_BLOCKING_STATUSES}},
+        {"status": "pending", "expires_at": {"$gt": now or datetime.utcnow()}}
+    ]}
+
+
+def hold_expired(booking: dict, now: Optional[datetime] = None) -> bool:
+    expires_at = booking.get("expires_at")
+    return booking.get("status") == "pending" and expires_at is not None and expires_at <= (now or datetime.utcnow())
+
+
+async def ensure_hold_indexes(db):
+    # Partial index: only pending bookings are ever swept
+    await db.bookings.create_index(
+        [("status", 1), ("expires_at", 1)],
+        name="pending_expiry",
+        partialFilterExpression={"status": "pending"}
+    )
+    # Holds created before expiry existed get the default window from created_at
+    await db.bookings.update_many(
+        {"status": "pending", "expires_at": {"$exists": False}},
+        [{"$set": {"expires_at": {"$add": [{"$ifNull": ["$created_at", "$$NOW"]}, BOOKING_HOLD_MINUTES * 60 * 1000]}}}]
+    )
+
+
+async def expire_pending_bookings(db, batch_size: int = 1000, now: Optional[datetime] = None) -> List:
+    """Expire every pending booking past its hold; returns the expired ids"""
+    now = now or datetime.utcnow()
+    expired = []
+    while True:
+        batch = await db.bookings.find(
+            {"status": "pending", "expires_at": {"$lte": now}},
+            {"user_id": 1, "booking_reference": 1, "route_id": 1, "date": 1,
+             "departure_at": 1, "seats": 1, "total_price": 1, "status": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        ids = [doc["_id"] for doc in batch]
+
+        async def write(session):
+            # Re-check status so concurrent sweepers never expire the same booking twice
+            result = await db.bookings.update_many(
+                {"_id": {"$in": ids}, "status": "pending"},
+                {"$set": {"status": "expired", "expired_at": now, "expired_by": SWEEPER_ID}},
+                session=session
+            )
+            if result.modified_count == len(ids):
+                mine = ids
+            elif result.modified_count:
+                docs = await db.bookings.find(
+                    {"_id": {"$in": ids}, "status": "expired", "expired_at": now, "expired_by": SWEEPER_ID},
+                    {"_id": 1},
+                    session=session
+                ).to_list(length=batch_size)
+                mine = [doc["_id"] for doc in docs]
+            else:
+                mine = []
+
+            mine_set = set(mine)
+            await append_events(db, [
+                {"type": BOOKING_EXPIRED, "booking_id": doc["_id"], "data": {**booking_snapshot(doc), "status": "expired"}}
+                for doc in batch if doc["_id"] in mine_set
+            ], session=session)
+            return mine
+
+        expired.extend(await run_in_transaction(db, write))
+        if len(batch) < batch_size:
+            break
+
+    if expired:
+        logger.info(f"Expired {len(expired)} unpaid bookings")
+    return expired
+
+
+class HoldSweeper:
+    """Periodically releases expired holds on the running event loop"""
+
+    def __init__(self, db, interval: float = BOOKING_SWEEP_SECONDS):
+        self.db = db
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await expire_pending_bookings(self.db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Booking hold sweep failed: {e}")
+            await asyncio.sleep(self.interval)
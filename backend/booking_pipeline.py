@@ -0,0 +1,92 @@
+"""Post-booking side effects run by the background job queue.
+
+create_booking and process_payment enqueue these jobs in the same
+transaction that persists the booking/payment; ticket generation and
+confirmation sends happen off the request path. Both handlers write
+conditionally (tickets only if absent, one ticket_sends doc per booking and
+event), so a retried or re-leased job never duplicates its effect. Booking
+and revenue stats are maintained from the event log by daily_rollups.
+"""
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+
+
+logger = logging.getLogger(__name__)
+
+
+def booking_created_jobs(booking_id: str) -> list:
+    return [
+        ("generate_tickets", {"booking_id": booking_id}),
+        ("send_booking_notification", {"booking_id": booking_id, "event": "booking_created"})
+    ]
+
+
+def payment_completed_jobs(booking_id: str) -> list:
+    return [
+        ("send_booking_notification", {"booking_id": booking_id, "event": "payment_completed"})
+    ]
+
+
+def build_tickets(booking: dict) -> list:
+    """One ticket per seat/passenger pair"""
+    tickets = []
+    price_per_seat = booking.get("total_price", 0) / max(len(booking.get("seats", [])), 1)
+    for i, (seat, passenger) in enumerate(zip(booking.get("seats", []), booking.get("passenger_details", []))):
+        ticket_numbers = booking.get("ticket_numbers", [])
+        ticket_number = ticket_numbers[i] if i < len(ticket_numbers) else f"{booking['booking_reference']}-{i+1}"
+        tickets.append({
+            "ticket_number": ticket_number,
+            "seat_number": seat,
+            "passenger_name": f"{passenger.get('firstName', '')} {passenger.get('lastName', '')}".strip(),
+            "passenger_email": passenger.get('email', ''),
+            "passenger_phone": passenger.get('phone', ''),
+            "ticket_price": price_per_seat,
+            "qr_code": f"BMB-{booking['booking_reference']}-{ticket_number}-{seat}"
+        })
+    return tickets
+
+
+def register_booking_jobs(queue, db):
+    """Attach the post-booking handlers to a JobQueue"""
+
+    @queue.handler("generate_tickets")
+    async def generate_tickets(payload: dict):
+        booking = await db.bookings.find_one({"_id": ObjectId(payload["booking_id"])})
+        if not booking:
+            logger.warning(f"Ticket generation skipped, booking {payload['booking_id']} not found")
+            return
+        if booking.get("tickets"):
+            return
+
+        await db.bookings.update_one(
+            {"_id": booking["_id"], "tickets": {"$exists": False}},
+            {"$set": {"tickets": build_tickets(booking), "tickets_generated_at": datetime.utcnow()}}
+        )
+
+    @queue.handler("send_booking_notification")
+    async def send_booking_notification(payload: dict):
+        booking = await db.bookings.find_one(
+            {"_id": ObjectId(payload["booking_id"])},
+            {"booking_reference": 1, "user_id": 1, "passenger_details": 1}
+        )
+        if not booking:
+            return
+
+        recipients = [p.get("email") for p in booking.get("passenger_details", []) if p.get("email")]
+        # Upsert keyed by (booking, event) so a retried job never sends twice
+        await db.ticket_sends.update_one(
+            {"booking_id": payload["booking_id"], "event": payload["event"]},
+            {"$setOnInsert": {
+                "booking_id": payload["booking_id"],
+                "event": payload["event"],
+                "booking_reference": booking.get("booking_reference"),
+                "recipients": recipients,
+                "method": "email",
+                "status": "sent",
+                "sent_at": datetime.utcnow(),
+                "sent_by": "system"
+            }},
+            upsert=True
+        )
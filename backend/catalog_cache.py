@@ -0,0 +1,84 @@
+"""In-process cache of route catalog entries for analytics.
+
+Leaderboards and trends carry bare route ids. ``CatalogCache.routes``
+resolves a whole page of them at once: ids already cached are served from
+memory, and all the rest are fetched with a single ``$in`` query, never one
+lookup per row. Entries expire after CATALOG_CACHE_TTL. Route edits
+invalidate their entry in this process, and other workers pick the change
+up on expiry.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "5000"))
+
+ROUTE_PROJECTION = {"origin": 1, "destination": 1, "transport_type": 1, "operator_name": 1, "price_base": 1}
+
+
+def route_label(route: dict) -> str:
+    return f"{route.get('origin', '?')} → {route.get('destination', '?')}"
+
+
+class CatalogCache:
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL, max_size: int = CATALOG_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._routes: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+
+    async def routes(self, db, route_ids: Iterable[str]) -> Dict[str, dict]:
+        """Route docs by id string; unknown or malformed ids are left out"""
+        now = time.monotonic()
+        found, missing = {}, []
+        for route_id in set(route_ids):
+            entry = self._routes.get(route_id)
+            if entry is not None and entry[0] > now:
+                self._routes.move_to_end(route_id)
+                found[route_id] = entry[1]
+                self.hits += 1
+                continue
+            self.misses += 1
+            try:
+                missing.append(ObjectId(route_id))
+            except (InvalidId, TypeError):
+                continue
+
+        if missing:
+            self.lookups += 1
+            async for route in db.routes.find({"_id": {"$in": missing}}, ROUTE_PROJECTION):
+                route_id = str(route.pop("_id"))
+                found[route_id] = route
+                self._set(route_id, route, now)
+        return found
+
+    def _set(self, route_id: str, route: dict, now: float):
+        self._routes[route_id] = (now + self.ttl, route)
+        self._routes.move_to_end(route_id)
+        while len(self._routes) > self.max_size:
+            self._routes.popitem(last=False)
+
+    def invalidate_route(self, route_id: str):
+        self._routes.pop(str(route_id), None)
+
+    def clear(self):
+        self._routes.clear()
+
+    def stats(self) -> dict:
+        requests = max(self.hits + self.misses, 1)
+        return {
+            "size": len(self._routes),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bulk_lookups": self.lookups,
+            "hit_rate": round(self.hits / requests, 4)
+        }
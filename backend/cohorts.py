@@ -0,0 +1,281 @@
+"""Monthly signup cohorts and repeat-booking rates.
+
+Users are grouped by the local month they signed up. ``cohort_summaries``
+holds one doc per cohort: its size, how many members have booked, how
+many booked more than once, and per-month activity by months since signup.
+A booking counts once it holds seats (paid or confirmed).
+
+The summaries are folded one closed month at a time. Folding month M
+streams M's bookings grouped per user, in chunks of COHORT_CHUNK_SIZE
+users. For each chunk it looks up the members' signup month and their
+booking count before M, and turns them into per-cohort deltas (first-time
+bookers, users crossing into repeat bookers, activity at offset M -
+cohort). Memory is bounded by the chunk size plus one small delta per
+cohort, never the user base.
+
+The count before M comes from ``cohort_members`` (one doc per user who has
+booked: first booking month and running booking count as folded), never
+from live booking statuses. A booking cancelled after its month was folded
+therefore cannot turn its user back into a first-time booker, so bookers
+never exceed the cohort size. Member and cohort docs both record the last
+month applied to them, so a refold or a second worker changes nothing. A
+full rebuild is the same fold replayed from the first month:
+
+    python cohorts.py --rebuild
+"""
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from booking_holds import SEAT_BLOCKING_STATUSES
+from departures import LOCAL_TIMEZONE, to_local, to_utc
+
+logger = logging.getLogger(__name__)
+
+COHORT_CHUNK_SIZE = int(os.getenv("COHORT_CHUNK_SIZE", "1000"))
+COHORT_REFRESH_SECONDS = float(os.getenv("COHORT_REFRESH_SECONDS", "3600"))
+STATE_ID = "cohorts"
+
+
+def month_key(dt: datetime) -> str:
+    return dt.strftime("%Y-%m")
+
+
+def month_bounds(month: str) -> Tuple[datetime, datetime]:
+    """UTC [start, end) of a local calendar month"""
+    start = datetime.strptime(month, "%Y-%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return to_utc(start), to_utc(end)
+
+
+def next_month(month: str) -> str:
+    year, number = map(int, month.split("-"))
+    return f"{year + 1}-01" if number == 12 else f"{year}-{number + 1:02d}"
+
+
+def months_between(first: str, second: str) -> int:
+    (y1, m1), (y2, m2) = (map(int, first.split("-")), map(int, second.split("-")))
+    return (y2 - y1) * 12 + (m2 - m1)
+
+
+def signed_up_at(user: dict) -> datetime:
+    return user.get("created_at") or user["_id"].generation_time.replace(tzinfo=None)
+
+
+def _counted(extra: Optional[dict] = None) -> dict:
+    return {"status": {"$in": SEAT_BLOCKING_STATUSES}, **(extra or {})}
+
+
+async def _cohort_size(db, month: str) -> int:
+    start, end = month_bounds(month)
+    return await db.users.count_documents({"$or": [
+        {"created_at": {"$gte": start, "$lt": end}},
+        {"created_at": None, "_id": {"$gte": ObjectId.from_datetime(start), "$lt": ObjectId.from_datetime(end)}}
+    ]})
+
+
+async def _fold_chunk(db, month: str, chunk: List[dict], deltas: Dict[str, dict]):
+    """Add one chunk of (user_id, bookings in month) rows to the per-cohort deltas"""
+    object_ids = []
+    for row in chunk:
+        try:
+            object_ids.append(ObjectId(row["_id"]))
+        except (InvalidId, TypeError):
+            continue
+    cohorts = {
+        str(user["_id"]): month_key(to_local(signed_up_at(user)))
+        async for user in db.users.find({"_id": {"$in": object_ids}}, {"created_at": 1})
+    }
+    earlier = {}
+    async for member in db.cohort_members.find({"_id": {"$in": list(cohorts)}}):
+        # A member already carrying this month (an interrupted fold) counts as before it
+        applied = member.get("month_bookings", 0) if member.get("applied_through") == month else 0
+        earlier[member["_id"]] = member.get("bookings", 0) - applied
+
+    members = []
+    for row in chunk:
+        cohort = cohorts.get(row["_id"])
+        if cohort is None:
+            continue
+        before = earlier.get(row["_id"], 0)
+        members.append(UpdateOne(
+            {"_id": row["_id"], "$or": [{"applied_through": {"$lt": month}}, {"applied_through": None}]},
+            {
+                "$inc": {"bookings": row["bookings"]},
+                "$set": {"cohort": cohort, "applied_through": month, "month_bookings": row["bookings"]},
+                "$setOnInsert": {"first_booked": month}
+            },
+            upsert=True
+        ))
+        offset = str(max(months_between(cohort, month), 0))
+        delta = deltas[cohort]
+        delta[f"months.{offset}.active"] = delta.get(f"months.{offset}.active", 0) + 1
+        delta[f"months.{offset}.bookings"] = delta.get(f"months.{offset}.bookings", 0) + row["bookings"]
+        delta["bookings"] = delta.get("bookings", 0) + row["bookings"]
+        if before == 0:
+            delta["bookers"] = delta.get("bookers", 0) + 1
+        if before < 2 <= before + row["bookings"]:
+            delta["repeat_bookers"] = delta.get("repeat_bookers", 0) + 1
+
+    if members:
+        try:
+            await db.cohort_members.bulk_write(members, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys are members that already carry this month
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+
+async def fold_month(db, month: str, chunk_size: int = COHORT_CHUNK_SIZE) -> int:
+    """Apply one closed month to cohort_summaries; returns the number of cohorts touched"""
+    start, end = month_bounds(month)
+    deltas: Dict[str, dict] = defaultdict(dict)
+    size = await _cohort_size(db, month)
+    if size:
+        deltas[month]["size"] = size
+
+    cursor = db.bookings.aggregate([
+        {"$match": _counted({"created_at": {"$gte": start, "$lt": end}})},
+        {"$group": {"_id": "$user_id", "bookings": {"$sum": 1}}}
+    ], allowDiskUse=True, batchSize=chunk_size)
+    chunk = []
+    async for row in cursor:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            await _fold_chunk(db, month, chunk, deltas)
+            chunk = []
+    if chunk:
+        await _fold_chunk(db, month, chunk, deltas)
+
+    now = datetime.utcnow()
+    for cohort, inc in deltas.items():
+        # Conditional on applied_through, so each month lands in a doc once
+        try:
+            await db.cohort_summaries.update_one(
+                {"_id": cohort, "$or": [{"applied_through": {"$lt": month}}, {"applied_through": None}]},
+                {"$inc": inc, "$set": {"cohort": cohort, "applied_through": month, "updated_at": now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            logger.debug(f"Cohort {cohort} already has {month}")
+    return len(deltas)
+
+
+async def _first_month(db) -> Optional[str]:
+    user = await db.users.find_one({}, {"created_at": 1}, sort=[("_id", 1)])
+    booking = await db.bookings.find_one(_counted({"created_at": {"$ne": None}}), {"created_at": 1}, sort=[("created_at", 1)])
+    candidates = [month_key(to_local(signed_up_at(user)))] if user else []
+    if booking:
+        candidates.append(month_key(to_local(booking["created_at"])))
+    return min(candidates) if candidates else None
+
+
+async def refresh_cohorts(db) -> List[str]:
+    """Fold every closed month not folded yet; returns the months applied"""
+    state = await db.cohort_state.find_one({"_id": STATE_ID}) or {}
+    if state.get("through") and not state.get("members"):
+        # Folded before cohort_members existed; those counts cannot be continued
+        logger.info("Cohort summaries predate cohort_members, rebuilding")
+        return await rebuild_cohorts(db)
+    current = month_key(to_local(datetime.utcnow()))
+    month = next_month(state["through"]) if state.get("through") else await _first_month(db)
+
+    applied = []
+    while month is not None and month < current:
+        await fold_month(db, month)
+        await db.cohort_state.update_one(
+            {"_id": STATE_ID},
+            {"$set": {"through": month, "members": True, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        applied.append(month)
+        month = next_month(month)
+    return applied
+
+
+async def rebuild_cohorts(db) -> List[str]:
+    await db.cohort_summaries.delete_many({})
+    await db.cohort_members.delete_many({})
+    await db.cohort_state.delete_one({"_id": STATE_ID})
+    return await refresh_cohorts(db)
+
+
+async def read_cohorts(db, limit: int = 24) -> dict:
+    """Most recent cohorts with conversion, repeat and retention rates"""
+    state = await db.cohort_state.find_one({"_id": STATE_ID}) or {}
+    docs = await db.cohort_summaries.find({}).sort("_id", -1).to_list(length=limit)
+    cohorts = []
+    for doc in docs:
+        size = doc.get("size", 0)
+        bookers = doc.get("bookers", 0)
+        months = doc.get("months", {})
+        retention = [
+            round(months.get(str(offset), {}).get("active", 0) / size, 4) if size else 0.0
+            for offset in range(max((int(key) for key in months), default=-1) + 1)
+        ]
+        cohorts.append({
+            "cohort": doc["_id"],
+            "size": size,
+            "bookers": bookers,
+            "repeat_bookers": doc.get("repeat_bookers", 0),
+            "bookings": doc.get("bookings", 0),
+            "conversion_rate": round(bookers / size, 4) if size else 0.0,
+            "repeat_rate": round(doc.get("repeat_bookers", 0) / bookers, 4) if bookers else 0.0,
+            "retention": retention
+        })
+    return {"through": state.get("through"), "timezone": LOCAL_TIMEZONE.key, "cohorts": cohorts}
+
+
+class CohortRefresher:
+    """Folds newly closed months into cohort_summaries on the running event loop"""
+
+    def __init__(self, db, interval: float = COHORT_REFRESH_SECONDS):
+        self.db = db
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                months = await refresh_cohorts(self.db)
+                if months:
+                    logger.info(f"Folded cohort months {', '.join(months)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cohort refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from server import db
+
+    parser = argparse.ArgumentParser(description="Refresh monthly signup cohorts")
+    parser.add_argument("--rebuild", action="store_true", help="drop the summaries and refold every month")
+    args = parser.parse_args()
+
+    async def main():
+        months = await (rebuild_cohorts(db) if args.rebuild else refresh_cohorts(db))
+        print(f"Folded {len(months)} months" + (f" ({months[0]} to {months[-1]})" if months else ""))
+
+    asyncio.run(main())
@@ -0,0 +1,331 @@
+"""Incrementally maintained daily booking and revenue rollups.
+
+``daily_rollups`` holds pre-summed counters per local day, canonical route,
+operator and departure slot, plus hourly sub-buckets. Every day also has a
+total doc (route and operator "*"), and one all-time doc ("*|*|*") is
+kept. Dashboards read those few docs instead of scanning ``bookings`` and
+``payments``, and the route leaderboard sums detail docs over its range.
+
+Counters come from the booking event log: each worker tails it with an
+``EventConsumer``, sums a batch into per-doc deltas and applies them with
+``$inc``. Every doc records the last event seq applied to it. A replayed
+batch, or a second worker processing the same batch, therefore changes
+nothing.
+
+``python daily_rollups.py`` rebuilds everything from bookings history. Run
+it once after upgrading from rollups that had no departure slot.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from booking_events import (
+    BOOKING_CREATED, BOOKING_PAID, BOOKING_CANCELLED, BOOKING_EXPIRED, BOOKING_REFUNDED,
+    EventConsumer
+)
+from catalog_cache import route_label
+from departures import to_local, schedule_slot
+
+logger = logging.getLogger(__name__)
+
+CONSUMER_NAME = "daily_rollups"
+ALL = "*"
+UNKNOWN_OPERATOR = "unknown"
+
+COUNTERS = [
+    "bookings_created", "seats_booked", "booked_value",
+    "bookings_paid", "seats_sold", "revenue",
+    "bookings_cancelled", "bookings_expired",
+    "refunds", "refunded_amount"
+]
+HOURLY_COUNTERS = ["bookings_created", "revenue"]
+
+
+def rollup_id(date: str, route_id: str = ALL, operator: str = ALL, slot: str = ALL) -> str:
+    """Detail docs carry the departure slot; total docs keep the "date|*|*" form"""
+    key = f"{date}|{route_id}|{operator}"
+    return key if slot == ALL else f"{key}|{slot}"
+
+
+def canonical_route_id(route_id: Optional[str]) -> str:
+    """Route part of a "routeId-scheduleId" booking route"""
+    return (route_id or "unknown").split("-")[0]
+
+
+def departure_slot(data: dict) -> str:
+    """Local HH:MM departure of a booking or booking snapshot"""
+    if data.get("departure_time"):
+        return data["departure_time"]
+    if data.get("departure_at"):
+        return to_local(data["departure_at"]).strftime("%H:%M")
+    return schedule_slot(data.get("route_id"))["departure"]
+
+
+def transition_counters(event_type: str, data: dict) -> Dict[str, float]:
+    """Counter increments for one booking transition"""
+    seats = data.get("seat_count", 0)
+    if event_type == BOOKING_CREATED:
+        return {"bookings_created": 1, "seats_booked": seats, "booked_value": data.get("total_price", 0)}
+    if event_type == BOOKING_PAID:
+        return {"bookings_paid": 1, "seats_sold": seats, "revenue": data.get("amount", data.get("total_price", 0))}
+    if event_type == BOOKING_CANCELLED:
+        return {"bookings_cancelled": 1}
+    if event_type == BOOKING_EXPIRED:
+        return {"bookings_expired": 1}
+    if event_type == BOOKING_REFUNDED:
+        return {"refunds": 1, "refunded_amount": data.get("amount", data.get("total_price", 0))}
+    return {}
+
+
+def add_transition(deltas: dict, at: datetime, route_id: str, operator: str, slot: str, counters: Dict[str, float]):
+    """Add one transition's counters to the detail, day-total and all-time docs"""
+    local = to_local(at)
+    date = local.strftime("%Y-%m-%d")
+    hour = local.strftime("%H")
+    for key in (rollup_id(date, route_id, operator, slot), rollup_id(date), rollup_id(ALL)):
+        doc = deltas[key]
+        for name, value in counters.items():
+            doc[name] = doc.get(name, 0) + value
+            if name in HOURLY_COUNTERS and key != rollup_id(ALL):
+                hourly = f"hourly.{hour}.{name}"
+                doc[hourly] = doc.get(hourly, 0) + value
+
+
+def key_fields(key: str) -> dict:
+    date, route_id, operator, *slot = key.split("|")
+    return {"date": date, "route_id": route_id, "operator": operator, "slot": slot[0] if slot else ALL}
+
+
+async def ensure_rollup_indexes(db):
+    await db.daily_rollups.create_index([("date", 1), ("route_id", 1), ("operator", 1)])
+
+
+async def apply_rollup_events(db, events: List[dict]):
+    """Fold a batch of booking events into daily_rollups, skipping events a doc already has"""
+    per_key = defaultdict(list)
+    for event in events:
+        counters = transition_counters(event["type"], event.get("data", {}))
+        if not counters:
+            continue
+        data = event.get("data", {})
+        single = defaultdict(dict)
+        add_transition(
+            single, event["created_at"], canonical_route_id(data.get("route_id")),
+            data.get("operator") or UNKNOWN_OPERATOR, departure_slot(data), counters
+        )
+        for key, inc in single.items():
+            per_key[key].append((event["seq"], inc))
+
+    if not per_key:
+        return
+
+    applied = {
+        doc["_id"]: doc.get("applied_seq", 0)
+        async for doc in db.daily_rollups.find({"_id": {"$in": list(per_key)}}, {"applied_seq": 1})
+    }
+    now = datetime.utcnow()
+    for key, items in per_key.items():
+        last_applied = applied.get(key)
+        inc = defaultdict(int)
+        max_seq = 0
+        for seq, counters in items:
+            if last_applied is not None and seq <= last_applied:
+                continue
+            for name, value in counters.items():
+                inc[name] += value
+            max_seq = max(max_seq, seq)
+        if not inc:
+            continue
+
+        # Conditional on the applied_seq we read, so concurrent consumers apply a batch once
+        try:
+            await db.daily_rollups.update_one(
+                {"_id": key, "applied_seq": last_applied},
+                {
+                    "$inc": dict(inc),
+                    "$set": {**key_fields(key), "applied_seq": max_seq, "updated_at": now}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            logger.debug(f"Rollup {key} advanced by another consumer")
+
+
+class RollupUpdater:
+    """Tails booking_events into daily_rollups on the running event loop"""
+
+    def __init__(self, db, interval: float = 1.0):
+        self.db = db
+        self.interval = interval
+        self.consumer = EventConsumer(db, CONSUMER_NAME)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(
+                self.consumer.run(lambda events: apply_rollup_events(self.db, events), idle_interval=self.interval)
+            )
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+async def read_rollup(db, date: str = ALL) -> dict:
+    """Counters of one day-total doc (or the all-time doc), zero-filled"""
+    doc = await db.daily_rollups.find_one({"_id": rollup_id(date)}) or {}
+    return {name: doc.get(name, 0) for name in COUNTERS}
+
+
+async def read_rollup_at(db, date: str = ALL) -> Tuple[dict, int]:
+    """read_rollup plus the event seq it is complete up to"""
+    # Read the consumer checkpoint first: the doc can only be further along
+    state = await db.event_consumers.find_one({"_id": CONSUMER_NAME}, {"position": 1}) or {}
+    doc = await db.daily_rollups.find_one({"_id": rollup_id(date)}) or {}
+    counters = {name: doc.get(name, 0) for name in COUNTERS}
+    return counters, max(state.get("position", 0), doc.get("applied_seq", 0))
+
+
+def net_revenue(counters: dict) -> float:
+    return round(counters.get("revenue", 0) - counters.get("refunded_amount", 0), 2)
+
+
+async def daily_series(db, start_date: str, end_date: str) -> List[dict]:
+    """Day-total docs for [start_date, end_date], one entry per day with rollups"""
+    docs = await db.daily_rollups.find(
+        {"date": {"$gte": start_date, "$lte": end_date}, "route_id": ALL, "operator": ALL}
+    ).sort("date", 1).to_list(length=None)
+    return [{"date": doc["date"], **{name: doc.get(name, 0) for name in COUNTERS}} for doc in docs]
+
+
+async def rollup_breakdown(db, start_date: str, end_date: str, by="route_id", limit: int = 10) -> List[dict]:
+    """Counters summed per field (or tuple of fields) over a date range, highest revenue first"""
+    group_id = f"${by}" if isinstance(by, str) else {field: f"${field}" for field in by}
+    pipeline = [
+        {"$match": {"date": {"$gte": start_date, "$lte": end_date}, "route_id": {"$ne": ALL}}},
+        {"$group": {"_id": group_id, **{name: {"$sum": f"${name}"} for name in COUNTERS}}},
+        {"$sort": {"revenue": -1, "bookings_created": -1}},
+        {"$limit": limit}
+    ]
+    return await db.daily_rollups.aggregate(pipeline).to_list(length=limit)
+
+
+async def top_routes(db, catalog, start_date: str, end_date: str, by=("route_id", "slot", "operator"),
+                     limit: int = 10) -> List[dict]:
+    """Route leaderboard from detail rollups, with route names resolved in one bulk lookup"""
+    rows = await rollup_breakdown(db, start_date, end_date, by=list(by), limit=limit)
+    routes = await catalog.routes(db, [row["_id"]["route_id"] for row in rows])
+    leaderboard = []
+    for row in rows:
+        keys = row.pop("_id")
+        route = routes.get(keys["route_id"])
+        entry = {
+            "route_id": keys["route_id"],
+            "route_name": route_label(route) if route else keys["route_id"],
+            "origin": route.get("origin") if route else None,
+            "destination": route.get("destination") if route else None
+        }
+        if "slot" in keys:
+            entry["departure_time"] = keys["slot"]
+        if "operator" in keys:
+            entry["operator"] = keys["operator"]
+        entry.update({name: row.get(name, 0) for name in COUNTERS})
+        entry["net_revenue"] = net_revenue(row)
+        leaderboard.append(entry)
+    return leaderboard
+
+
+def window_start(days: int) -> str:
+    return (to_local(datetime.utcnow()) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+
+async def vehicle_operators(db) -> List[str]:
+    """Operator per schedule slot, in the order search assigns vehicles"""
+    vehicles = await db.vehicles.find({}, {"company": 1}).to_list(length=10)
+    return [vehicle.get("company", UNKNOWN_OPERATOR) for vehicle in vehicles]
+
+
+def booking_operator(booking: dict, operators: List[str]) -> str:
+    if booking.get("operator"):
+        return booking["operator"]
+    try:
+        index = int(str(booking.get("route_id", "")).split("-")[1]) - 1
+        return operators[index]
+    except (IndexError, ValueError):
+        return UNKNOWN_OPERATOR
+
+
+async def rebuild_rollups(db, batch_size: int = 1000) -> int:
+    """Recompute daily_rollups from bookings history; run while booking traffic is quiet"""
+    counter = await db.counters.find_one({"_id": "booking_events"})
+    snapshot_seq = counter["seq"] if counter else 0
+    operators = await vehicle_operators(db)
+
+    deltas = defaultdict(dict)
+    cursor = db.bookings.find({}, {
+        "route_id": 1, "seats": 1, "total_price": 1, "status": 1, "operator": 1,
+        "departure_time": 1, "departure_at": 1,
+        "created_at": 1, "paid_at": 1, "cancelled_at": 1, "expired_at": 1, "refunded_at": 1
+    }).batch_size(batch_size)
+    async for booking in cursor:
+        route_id = canonical_route_id(booking.get("route_id"))
+        operator = booking_operator(booking, operators)
+        slot = departure_slot(booking)
+        data = {"seat_count": len(booking.get("seats", [])), "total_price": booking.get("total_price", 0)}
+        created_at = booking.get("created_at") or booking["_id"].generation_time.replace(tzinfo=None)
+
+        transitions = [(BOOKING_CREATED, created_at)]
+        paid_at = booking.get("paid_at")
+        if paid_at is None and booking.get("status") in ("paid", "confirmed"):
+            paid_at = created_at
+        for event_type, at in (
+            (BOOKING_PAID, paid_at),
+            (BOOKING_CANCELLED, booking.get("cancelled_at")),
+            (BOOKING_EXPIRED, booking.get("expired_at")),
+            (BOOKING_REFUNDED, booking.get("refunded_at"))
+        ):
+            if at is not None:
+                transitions.append((event_type, at))
+
+        for event_type, at in transitions:
+            add_transition(deltas, at, route_id, operator, slot, transition_counters(event_type, data))
+
+    now = datetime.utcnow()
+    docs = [
+        {"_id": key, **key_fields(key), **counters, "applied_seq": snapshot_seq, "updated_at": now}
+        for key, counters in deltas.items()
+    ]
+    # Dotted hourly keys become nested sub-documents
+    for doc in docs:
+        for name in [name for name in doc if name.startswith("hourly.")]:
+            _, hour, counter_name = name.split(".")
+            doc.setdefault("hourly", {}).setdefault(hour, {})[counter_name] = doc.pop(name)
+
+    await db.daily_rollups.delete_many({})
+    for i in range(0, len(docs), batch_size):
+        await db.daily_rollups.insert_many(docs[i:i + batch_size])
+
+    # Events up to the snapshot are already reflected in the rebuilt docs
+    await db.event_consumers.update_one(
+        {"_id": CONSUMER_NAME},
+        {"$set": {"position": snapshot_seq, "updated_at": now}},
+        upsert=True
+    )
+    return len(docs)
+
+
+if __name__ == "__main__":
+    from server import db
+
+    async def main():
+        await ensure_rollup_indexes(db)
+        count = await rebuild_rollups(db)
+        print(f"Rebuilt {count} rollup documents")
+
+    asyncio.run(main())
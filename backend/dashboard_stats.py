@@ -0,0 +1,50 @@
+"""Concurrent stat gathering for admin dashboards.
+
+Dashboard endpoints declare their queries as a dict of awaitables.
+``gather_stats`` runs all of them at once, each under its own timeout, so
+latency is bounded by the slowest query rather than their sum. A query
+that times out or fails yields None and is listed in ``partial``, so the
+rest of the dashboard still renders. Collection totals use
+``estimated_document_count``, a metadata read, instead of full-scan counts.
+Filtered counts carry the same limit server-side as ``maxTimeMS``, so a
+query given up on here does not keep running in Mongo.
+"""
+import os
+import asyncio
+import logging
+from typing import Awaitable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+STAT_QUERY_TIMEOUT = float(os.getenv("STAT_QUERY_TIMEOUT", "2.0"))
+
+
+def estimated_count(collection) -> Awaitable[int]:
+    """Collection size from metadata; may lag slightly after unclean shutdowns"""
+    return collection.estimated_document_count()
+
+
+def bounded_count(collection, query: dict, timeout: float = STAT_QUERY_TIMEOUT) -> Awaitable[int]:
+    return collection.count_documents(query, maxTimeMS=int(timeout * 1000))
+
+
+async def gather_stats(queries: Dict[str, Awaitable], timeout: float = STAT_QUERY_TIMEOUT) -> Tuple[dict, List[str]]:
+    """Run named queries concurrently; returns (values, names that timed out or failed)"""
+    names = list(queries)
+    results = await asyncio.gather(
+        *(asyncio.wait_for(queries[name], timeout) for name in names),
+        return_exceptions=True
+    )
+
+    values, partial = {}, []
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.TimeoutError):
+                logger.warning(f"Dashboard stat {name} exceeded {timeout}s")
+            else:
+                logger.error(f"Dashboard stat {name} failed: {result}")
+            values[name] = None
+            partial.append(name)
+        else:
+            values[name] = result
+    return values, partial
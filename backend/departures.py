@@ -0,0 +1,132 @@
+"""Departure time helpers.
+
+Bookings and schedules carry a local travel ``date`` (YYYY-MM-DD) and a
+``departure_time`` (HH:MM), both in Cambodia time. ``departure_at`` is the
+same instant as a naive UTC datetime, which is what Mongo stores and what the
+upcoming/past/manifest range queries run against.
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+LOCAL_TIMEZONE = ZoneInfo(os.getenv("LOCAL_TIMEZONE", "Asia/Phnom_Penh"))
+
+# Daily departure slots offered on every route; schedule_id is the 1-based index
+SCHEDULE_TIMES = [
+    {"departure": "06:00", "arrival": "11:45"},
+    {"departure": "08:30", "arrival": "14:15"},
+    {"departure": "13:00", "arrival": "18:45"},
+    {"departure": "15:30", "arrival": "21:15"},
+    {"departure": "20:00", "arrival": "01:45+1"}
+]
+
+DEFAULT_DEPARTURE_TIME = SCHEDULE_TIMES[0]["departure"]
+
+
+def to_utc(local_dt: datetime) -> datetime:
+    """Convert a naive local (Cambodia) datetime to naive UTC"""
+    return local_dt.replace(tzinfo=LOCAL_TIMEZONE).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_local(utc_dt: datetime) -> datetime:
+    """Convert a naive UTC datetime to naive local (Cambodia) time"""
+    return utc_dt.replace(tzinfo=timezone.utc).astimezone(LOCAL_TIMEZONE).replace(tzinfo=None)
+
+
+def local_today() -> str:
+    """Today's date in Cambodia as YYYY-MM-DD"""
+    return to_local(datetime.utcnow()).strftime("%Y-%m-%d")
+
+
+def to_departure_at(date: Optional[str], departure_time: Optional[str] = None) -> Optional[datetime]:
+    """Combine a local travel date and HH:MM departure time into a UTC datetime.
+
+    Returns None when the date cannot be parsed so callers can decide whether
+    that is an error (new bookings) or just skipped (legacy data).
+    """
+    if not date:
+        return None
+    try:
+        local_dt = datetime.strptime(f"{date} {departure_time or DEFAULT_DEPARTURE_TIME}", "%Y-%m-%d %H:%M")
+    except (TypeError, ValueError):
+        return None
+    return to_utc(local_dt)
+
+
+def schedule_slot(route_schedule_id: Optional[str]) -> dict:
+    """Departure/arrival times for a "routeId-scheduleId" identifier"""
+    try:
+        schedule_id = int(str(route_schedule_id).split("-")[1])
+        if 1 <= schedule_id <= len(SCHEDULE_TIMES):
+            return SCHEDULE_TIMES[schedule_id - 1]
+    except (IndexError, ValueError):
+        pass
+    return SCHEDULE_TIMES[0]
+
+
+def local_day_bounds(date: str) -> Tuple[datetime, datetime]:
+    """UTC [start, end) of a local calendar day, for departure_at range queries"""
+    start = to_utc(datetime.strptime(date, "%Y-%m-%d"))
+    return start, start + timedelta(days=1)
+
+
+async def ensure_departure_indexes(db):
+    """Indexes backing the upcoming/past and manifest range queries"""
+    await db.bookings.create_index([("user_id", 1), ("departure_at", 1)])
+    await db.bookings.create_index([("route_id", 1), ("departure_at", 1)])
+    await db.bookings.create_index("departure_at")
+
+
+async def backfill_departure_times(db, batch_size: int = 500) -> int:
+    """Set departure_at (and departure_time where missing) on existing bookings.
+
+    Safe to run repeatedly; only documents without departure_at are touched.
+    Bookings whose date cannot be parsed are left alone.
+    """
+    updated = 0
+    operations = []
+    cursor = db.bookings.find(
+        {"departure_at": {"$exists": False}},
+        {"date": 1, "departure_time": 1, "route_id": 1}
+    ).batch_size(batch_size)
+
+    async for booking in cursor:
+        departure_time = booking.get("departure_time") or schedule_slot(booking.get("route_id"))["departure"]
+        departure_at = to_departure_at(booking.get("date"), departure_time)
+        if departure_at is None:
+            continue
+
+        operations.append(UpdateOne(
+            {"_id": booking["_id"]},
+            {"$set": {"departure_at": departure_at, "departure_time": departure_time}}
+        ))
+        if len(operations) >= batch_size:
+            result = await db.bookings.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+            operations = []
+
+    if operations:
+        result = await db.bookings.bulk_write(operations, ordered=False)
+        updated += result.modified_count
+
+    if updated:
+        logger.info(f"Backfilled departure_at on {updated} bookings")
+    return updated
+
+
+if __name__ == "__main__":
+    from server import db
+
+    async def main():
+        await ensure_departure_indexes(db)
+        count = await backfill_departure_times(db)
+        print(f"Backfilled departure_at on {count} bookings")
+
+    asyncio.run(main())
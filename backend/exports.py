@@ -0,0 +1,329 @@
+"""Streaming columnar exports for offline analysis.
+
+Exports ``bookings``, ``payments``, ``booking_events`` and
+``daily_rollups`` as Parquet or Arrow IPC streams. The cursor is read in
+batches of EXPORT_BATCH_SIZE docs, and each batch becomes one record batch
+(Parquet row group) that is written out before the next is read. Memory
+stays bounded whatever the collection size.
+
+Each dataset has a monotonic watermark field: the ObjectId for
+bookings/payments, seq for events, updated_at for rollups. An export covers
+(since, until], where until is fixed when the export starts, and it reports
+until so the next export can resume from it. Status changes to existing
+bookings arrive through the booking_events export. The CLI stores
+watermarks in ``export_watermarks`` for ``--incremental`` runs:
+
+    python exports.py bookings --out bookings.parquet --incremental
+    python exports.py payments --out payments.arrow --format arrow --start 2026-01-01 --end 2026-01-31
+"""
+import io
+import sys
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from bson import ObjectId
+
+from daily_rollups import COUNTERS as ROLLUP_COUNTERS
+from departures import local_day_bounds
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # exports are unavailable until pyarrow is installed
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 5000
+FORMATS = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.stream"}
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+def _id_str(doc, field):
+    value = doc.get(field)
+    return str(value) if value is not None else None
+
+
+def _booking_row(doc: dict) -> dict:
+    return {
+        "id": str(doc["_id"]),
+        "booking_reference": doc.get("booking_reference"),
+        "order_id": doc.get("order_id"),
+        "user_id": doc.get("user_id"),
+        "route_schedule_id": doc.get("route_id"),
+        "route_id": (doc.get("route_id") or "").split("-")[0] or None,
+        "operator": doc.get("operator"),
+        "travel_date": doc.get("date"),
+        "departure_at": doc.get("departure_at"),
+        "seat_count": len(doc.get("seats", [])),
+        "total_price": float(doc.get("total_price") or 0),
+        "status": doc.get("status"),
+        "payment_method": doc.get("payment_method"),
+        "transaction_id": doc.get("transaction_id"),
+        "created_at": doc.get("created_at"),
+        "paid_at": doc.get("paid_at"),
+        "cancelled_at": doc.get("cancelled_at"),
+        "expired_at": doc.get("expired_at"),
+        "refunded_at": doc.get("refunded_at")
+    }
+
+
+def _payment_row(doc: dict) -> dict:
+    return {
+        "id": str(doc["_id"]),
+        "booking_id": _id_str(doc, "booking_id"),
+        "user_id": _id_str(doc, "user_id"),
+        "amount": float(doc.get("amount") or 0),
+        "payment_method": doc.get("payment_method"),
+        "status": doc.get("status"),
+        "transaction_id": doc.get("transaction_id"),
+        "provider": doc.get("provider"),
+        "created_at": doc.get("created_at")
+    }
+
+
+def _event_row(doc: dict) -> dict:
+    data = doc.get("data", {})
+    return {
+        "seq": doc["seq"],
+        "type": doc.get("type"),
+        "booking_id": doc.get("booking_id"),
+        "status": data.get("status"),
+        "amount": float(data.get("amount", data.get("total_price")) or 0),
+        "created_at": doc.get("created_at")
+    }
+
+
+def _rollup_row(doc: dict) -> dict:
+    return {
+        "id": doc["_id"],
+        "date": doc.get("date"),
+        "route_id": doc.get("route_id"),
+        "operator": doc.get("operator"),
+        **{name: float(doc.get(name, 0)) for name in ROLLUP_COUNTERS},
+        "updated_at": doc.get("updated_at")
+    }
+
+
+@dataclass(frozen=True)
+class ExportDataset:
+    collection: str
+    columns: List[Tuple[str, str]]
+    row: Callable[[dict], dict]
+    watermark_field: str
+    # Field the start/end date range applies to, and whether it holds YYYY-MM-DD strings
+    date_field: str
+    date_is_string: bool = False
+
+
+DATASETS = {
+    "bookings": ExportDataset(
+        "bookings",
+        [("id", "string"), ("booking_reference", "string"), ("order_id", "string"), ("user_id", "string"),
+         ("route_schedule_id", "string"), ("route_id", "string"), ("operator", "string"), ("travel_date", "string"),
+         ("departure_at", "timestamp"), ("seat_count", "int"), ("total_price", "float"), ("status", "string"),
+         ("payment_method", "string"), ("transaction_id", "string"), ("created_at", "timestamp"),
+         ("paid_at", "timestamp"), ("cancelled_at", "timestamp"), ("expired_at", "timestamp"),
+         ("refunded_at", "timestamp")],
+        _booking_row, "_id", "created_at"
+    ),
+    "payments": ExportDataset(
+        "payments",
+        [("id", "string"), ("booking_id", "string"), ("user_id", "string"), ("amount", "float"),
+         ("payment_method", "string"), ("status", "string"), ("transaction_id", "string"),
+         ("provider", "string"), ("created_at", "timestamp")],
+        _payment_row, "_id", "created_at"
+    ),
+    "booking_events": ExportDataset(
+        "booking_events",
+        [("seq", "int"), ("type", "string"), ("booking_id", "string"), ("status", "string"),
+         ("amount", "float"), ("created_at", "timestamp")],
+        _event_row, "seq", "created_at"
+    ),
+    "daily_rollups": ExportDataset(
+        "daily_rollups",
+        [("id", "string"), ("date", "string"), ("route_id", "string"), ("operator", "string")]
+        + [(name, "float") for name in ROLLUP_COUNTERS] + [("updated_at", "timestamp")],
+        _rollup_row, "updated_at", "date", date_is_string=True
+    )
+}
+
+
+def arrow_schema(dataset: ExportDataset):
+    if pa is None:
+        raise ExportUnavailable("pyarrow is not installed")
+    types = {"string": pa.string(), "int": pa.int64(), "float": pa.float64(), "timestamp": pa.timestamp("ms")}
+    return pa.schema([(name, types[kind]) for name, kind in dataset.columns])
+
+
+def parse_watermark(dataset: ExportDataset, value: Optional[str]):
+    if value is None:
+        return None
+    if dataset.watermark_field == "_id":
+        return ObjectId(value)
+    if dataset.watermark_field == "seq":
+        return int(value)
+    return datetime.fromisoformat(value)
+
+
+def format_watermark(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+async def export_query(db, dataset: ExportDataset, start: Optional[str] = None, end: Optional[str] = None,
+                       since: Optional[str] = None) -> Tuple[dict, Optional[object]]:
+    """Mongo filter for an export and the watermark it runs up to"""
+    query = {}
+    if start or end:
+        bounds = {}
+        if dataset.date_is_string:
+            if start:
+                bounds["$gte"] = start
+            if end:
+                bounds["$lte"] = end
+        else:
+            if start:
+                bounds["$gte"] = local_day_bounds(start)[0]
+            if end:
+                bounds["$lt"] = local_day_bounds(end)[1]
+        query[dataset.date_field] = bounds
+
+    # Fix the upper watermark now so documents written during the export go to the next one
+    latest = await db[dataset.collection].find_one(
+        {dataset.watermark_field: {"$ne": None}}, {dataset.watermark_field: 1}, sort=[(dataset.watermark_field, -1)]
+    )
+    until = latest[dataset.watermark_field] if latest else None
+    watermark = {}
+    since_value = parse_watermark(dataset, since)
+    if since_value is not None:
+        watermark["$gt"] = since_value
+    if until is not None:
+        watermark["$lte"] = until
+    if watermark:
+        query[dataset.watermark_field] = watermark
+    return query, until
+
+
+async def record_batches(db, dataset: ExportDataset, query: dict, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator:
+    schema = arrow_schema(dataset)
+    cursor = db[dataset.collection].find(query).sort(dataset.watermark_field, 1).batch_size(batch_size)
+    rows = []
+    async for doc in cursor:
+        rows.append(dataset.row(doc))
+        if len(rows) >= batch_size:
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+            rows = []
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        return chunk
+
+
+def _open_writer(sink, schema, fmt: str):
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, schema, compression="snappy")
+    return pa.ipc.new_stream(sink, schema)
+
+
+def _write_batch(writer, batch, fmt: str):
+    if fmt == "parquet":
+        writer.write_table(pa.Table.from_batches([batch]))
+    else:
+        writer.write_batch(batch)
+
+
+async def stream_export(db, dataset: ExportDataset, query: dict, fmt: str = "parquet") -> AsyncIterator[bytes]:
+    """Encoded export chunks, one per record batch, for a streaming HTTP response"""
+    sink = _ChunkSink()
+    writer = _open_writer(sink, arrow_schema(dataset), fmt)
+    try:
+        async for batch in record_batches(db, dataset, query):
+            _write_batch(writer, batch, fmt)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+async def export_to_file(db, dataset: ExportDataset, query: dict, path: str, fmt: str = "parquet") -> int:
+    rows = 0
+    with pa.OSFile(path, "wb") as sink:
+        writer = _open_writer(sink, arrow_schema(dataset), fmt)
+        try:
+            async for batch in record_batches(db, dataset, query):
+                _write_batch(writer, batch, fmt)
+                rows += batch.num_rows
+        finally:
+            writer.close()
+    return rows
+
+
+if __name__ == "__main__":
+    from server import db
+
+    parser = argparse.ArgumentParser(description="Export a collection to Parquet/Arrow")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--start", help="first local date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last local date (YYYY-MM-DD)")
+    parser.add_argument("--since", help="export only records after this watermark")
+    parser.add_argument("--incremental", action="store_true", help="resume from and advance the stored watermark")
+    args = parser.parse_args()
+
+    async def main():
+        dataset = DATASETS[args.dataset]
+        since = args.since
+        if args.incremental and since is None:
+            state = await db.export_watermarks.find_one({"_id": args.dataset})
+            since = state["watermark"] if state else None
+
+        query, until = await export_query(db, dataset, args.start, args.end, since)
+        rows = await export_to_file(db, dataset, query, args.out, args.format)
+        print(f"Exported {rows} {args.dataset} rows to {args.out} (watermark {format_watermark(until)})")
+
+        if args.incremental and until is not None:
+            await db.export_watermarks.update_one(
+                {"_id": args.dataset},
+                {"$set": {"watermark": format_watermark(until), "exported_at": datetime.utcnow()}},
+                upsert=True
+            )
+
+    try:
+        asyncio.run(main())
+    except ExportUnavailable as e:
+        sys.exit(str(e))
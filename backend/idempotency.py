@@ -0,0 +1,109 @@
+"""Idempotency-Key support for retry-prone POST endpoints.
+
+The first request with a given key runs normally and its response is stored
+in a TTL-indexed collection. Retries with the same key replay the stored
+response without touching bookings or payments again. A retry that arrives
+while the first request is still running gets 409 instead of running in
+parallel.
+"""
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+
+
+def request_fingerprint(payload) -> str:
+    """Stable hash of a request body, used to reject key reuse with a different body"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, db, collection: str = "idempotency_keys", ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS):
+        self.collection = db[collection]
+        self.ttl_seconds = ttl_seconds
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("user_id", 1), ("scope", 1), ("key", 1)], unique=True)
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    async def run(
+        self,
+        key: Optional[str],
+        user_id: str,
+        scope: str,
+        payload,
+        handler: Callable[[], Awaitable]
+    ):
+        """Run handler once per (user, scope, key) and replay its response afterwards"""
+        if not key:
+            return await handler()
+
+        identity = {"user_id": user_id, "scope": scope, "key": key}
+        fingerprint = request_fingerprint(payload)
+
+        try:
+            await self.collection.insert_one({
+                **identity,
+                "fingerprint": fingerprint,
+                "status": "in_progress",
+                "created_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            return await self._replay(identity, fingerprint)
+
+        try:
+            result = await handler()
+        except HTTPException as e:
+            if e.status_code >= 500:
+                await self.collection.delete_one(identity)
+            else:
+                # Client errors are deterministic, so retries get the same answer
+                await self._store(identity, e.status_code, {"detail": e.detail})
+            raise
+        except Exception:
+            await self.collection.delete_one(identity)
+            raise
+
+        await self._store(identity, 200, jsonable_encoder(result, custom_encoder={ObjectId: str}))
+        return result
+
+    async def _store(self, identity: dict, status_code: int, body):
+        await self.collection.update_one(identity, {"$set": {
+            "status": "completed",
+            "status_code": status_code,
+            "response": body,
+            "completed_at": datetime.utcnow()
+        }})
+
+    async def _replay(self, identity: dict, fingerprint: str):
+        record = await self.collection.find_one(identity)
+        if record is None:
+            # Expired or released between the insert attempt and now
+            raise HTTPException(status_code=409, detail="Idempotency-Key conflict, please retry")
+        if record.get("fingerprint") != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+        if record.get("status") != "completed":
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still being processed",
+                headers={"Retry-After": "1"}
+            )
+
+        logger.info(f"Replaying {identity['scope']} response for Idempotency-Key {identity['key']}")
+        return JSONResponse(
+            content=record["response"],
+            status_code=record["status_code"],
+            headers={"Idempotent-Replayed": "true"}
+        )
@@ -0,0 +1,261 @@
+"""Durable background job queue.
+
+Jobs live in a Mongo collection so they survive restarts; each API process
+runs a small pool of asyncio workers that claim jobs with an atomic
+find_one_and_update, run the registered handler and retry failures with
+exponential backoff. A claim stamps an owner token and a lease that the
+worker renews while the handler runs, so only jobs whose worker died are
+re-queued once their lease expires. Completion and failure updates are
+conditional on the owner token, so a worker that lost its lease can never
+overwrite the state written by the job's current owner.
+"""
+import os
+import uuid
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "50000"))
+
+
+class QueueFullError(Exception):
+    """Raised when the backlog is above the high watermark"""
+
+
+class JobQueue:
+    def __init__(
+        self,
+        db,
+        collection: str = "jobs",
+        concurrency: int = JOB_WORKERS,
+        max_pending: int = JOB_MAX_PENDING,
+        max_attempts: int = 5,
+        lease_seconds: int = 60,
+        poll_interval: float = 1.0,
+        retain_days: int = 7
+    ):
+        self.collection = db[collection]
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retain_days = retain_days
+        self.handlers: Dict[str, Callable[[dict], Awaitable[None]]] = {}
+        self.pending = 0
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._running = False
+
+    def handler(self, kind: str):
+        """Register a coroutine as the handler for a job kind"""
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", 1), ("run_at", 1)])
+        await self.collection.create_index([("status", 1), ("locked_until", 1)])
+        await self.collection.create_index("dedupe_key", unique=True, sparse=True)
+        # Completed jobs are only kept for inspection
+        await self.collection.create_index("finished_at", expireAfterSeconds=self.retain_days * 86400)
+
+    def check_capacity(self):
+        """Reject new work when the backlog is above the high watermark"""
+        if self.pending >= self.max_pending:
+            raise QueueFullError(f"Job backlog at {self.pending}, limit {self.max_pending}")
+
+    async def enqueue(self, kind: str, payload: dict, delay: float = 0, dedupe_key: Optional[str] = None) -> str:
+        """Persist a job and wake a local worker"""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+
+        now = datetime.utcnow()
+        job = {
+            "kind": kind,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "run_at": now + timedelta(seconds=delay),
+            "created_at": now
+        }
+        if dedupe_key:
+            job["dedupe_key"] = dedupe_key
+
+        result = await self.collection.insert_one(job)
+        self.pending += 1
+        self._wakeup.set()
+        return str(result.inserted_id)
+
+    async def enqueue_many(self, jobs: list, session=None):
+        """Enqueue several (kind, payload) pairs in one insert.
+
+        With a session the jobs commit or roll back with the caller's
+        transaction.
+        """
+        now = datetime.utcnow()
+        docs = []
+        for kind, payload in jobs:
+            if kind not in self.handlers:
+                raise ValueError(f"No handler registered for job kind '{kind}'")
+            docs.append({
+                "kind": kind,
+                "payload": payload,
+                "status": "queued",
+                "attempts": 0,
+                "max_attempts": self.max_attempts,
+                "run_at": now,
+                "created_at": now
+            })
+        if docs:
+            await self.collection.insert_many(docs, ordered=False, session=session)
+            self.pending += len(docs)
+            self._wakeup.set()
+
+    def start(self):
+        """Start the worker pool on the running event loop"""
+        if self._running:
+            return
+        self._running = True
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        logger.info(f"Job queue started with {self.concurrency} workers")
+
+    async def stop(self):
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _owned(self, job: dict) -> dict:
+        return {"_id": job["_id"], "owner": job["owner"], "status": "running"}
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"status": "queued", "run_at": {"$lte": now}},
+            {
+                "$set": {
+                    "status": "running",
+                    "owner": uuid.uuid4().hex,
+                    "locked_until": now + timedelta(seconds=self.lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker(self, worker_id: int):
+        while self._running:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} could not claim a job: {e}")
+                job = None
+
+            if job is None:
+                # Idle until something is enqueued locally or the poll interval passes
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _heartbeat(self, job: dict):
+        """Extend the lease while the handler runs"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                result = await self.collection.update_one(
+                    self._owned(job),
+                    {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+                )
+                if result.matched_count == 0:
+                    logger.warning(f"Job {job['_id']} ({job['kind']}) lost its lease")
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Could not renew lease on job {job['_id']}: {e}")
+
+    async def _run(self, job: dict):
+        handler = self.handlers.get(job["kind"])
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind '{job['kind']}'")
+            await handler(job["payload"])
+        except asyncio.CancelledError:
+            # Leave the job running; the lease expiry re-queues it
+            raise
+        except Exception as e:
+            await self._fail(job, e)
+            return
+        finally:
+            heartbeat.cancel()
+
+        result = await self.collection.update_one(
+            self._owned(job),
+            {
+                "$set": {"status": "done", "finished_at": datetime.utcnow()},
+                "$unset": {"locked_until": "", "owner": ""}
+            }
+        )
+        if result.matched_count == 0:
+            logger.warning(f"Job {job['_id']} ({job['kind']}) finished after losing its lease")
+        self.pending = max(self.pending - 1, 0)
+
+    async def _fail(self, job: dict, error: Exception):
+        attempts = job.get("attempts", 1)
+        if attempts >= job.get("max_attempts", self.max_attempts):
+            logger.error(f"Job {job['_id']} ({job['kind']}) failed permanently: {error}")
+            update = {"status": "failed", "failed_at": datetime.utcnow(), "last_error": str(error)}
+            self.pending = max(self.pending - 1, 0)
+        else:
+            backoff = min(2 ** attempts, 300) * (0.5 + random.random())
+            logger.warning(f"Job {job['_id']} ({job['kind']}) attempt {attempts} failed, retrying in {backoff:.1f}s: {error}")
+            update = {
+                "status": "queued",
+                "run_at": datetime.utcnow() + timedelta(seconds=backoff),
+                "last_error": str(error)
+            }
+
+        result = await self.collection.update_one(
+            self._owned(job),
+            {"$set": update, "$unset": {"locked_until": "", "owner": ""}}
+        )
+        if result.matched_count == 0:
+            logger.warning(f"Job {job['_id']} ({job['kind']}) failed after losing its lease")
+
+    async def _maintenance(self):
+        """Re-queue jobs with expired leases and refresh the backlog size"""
+        while self._running:
+            try:
+                result = await self.collection.update_many(
+                    {"status": "running", "locked_until": {"$lte": datetime.utcnow()}},
+                    {"$set": {"status": "queued", "run_at": datetime.utcnow()}, "$unset": {"locked_until": "", "owner": ""}}
+                )
+                if result.modified_count:
+                    logger.warning(f"Re-queued {result.modified_count} jobs with expired leases")
+                self.pending = await self.collection.count_documents({"status": {"$in": ["queued", "running"]}})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job queue maintenance failed: {e}")
+            await asyncio.sleep(self.lease_seconds / 2)
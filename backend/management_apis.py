@@ -1,11 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from datetime import datetime, timedelta
 from bson import ObjectId
 import logging
 
 from management_models import *
-from server import db
+from server import db, analytics_cache, catalog_cache, realtime_feed, pricing_engine
+from departures import LOCAL_TIMEZONE, local_today
+from booking_holds import seats_taken_filter
+from daily_rollups import read_rollup, daily_series, rollup_breakdown, top_routes, window_start, net_revenue
+from dashboard_stats import estimated_count, gather_stats
+from trends import TrendRequestError, compute_trend
+from cohorts import read_cohorts
 
 logger = logging.getLogger(__name__)
 
@@ -244,7 +251,7 @@ async def get_seat_management(route_id: str, date: str, admin: dict = Depends(ch
         bookings = await db.bookings.find({
             "route_id": route_id,
             "date": date,
-            "status": {"$in": ["confirmed", "paid"]}
+            **seats_taken_filter()
         }).to_list(length=1000)
         
         booked_seats = []
@@ -260,11 +267,7 @@ async def get_seat_management(route_id: str, date: str, admin: dict = Depends(ch
         blocked_seats = []
         
         # Dynamic pricing tiers
-        pricing_tiers = {
-            "economy": route["price_base"],
-            "premium": route["price_base"] * 1.25,
-            "vip": route["price_base"] * 1.5
-        }
+        pricing_tiers = pricing_engine.class_prices(route, f"{route_id}-1", date)
         
         return SeatManagementResponse(
             route_id=route_id,
@@ -282,67 +285,87 @@ async def get_seat_management(route_id: str, date: str, admin: dict = Depends(ch
         raise HTTPException(status_code=500, detail="Failed to get seat management data")
 
 # Analytics and Reporting
-@management_router.get("/analytics", response_model=AnalyticsResponse)
-async def get_analytics(admin: dict = Depends(check_admin_access)):
-    """Get comprehensive analytics data"""
+async def load_analytics():
+    """Analytics payload, recomputed by the analytics cache"""
     try:
-        # Basic counts
-        total_bookings = await db.bookings.count_documents({})
-        total_users = await db.users.count_documents({})
-        total_operators = await db.operators.count_documents({})
-        total_vehicles = await db.vehicles.count_documents({})
-        total_routes = await db.routes.count_documents({})
-        
-        # Revenue calculation
-        revenue_pipeline = [
-            {"$match": {"status": "paid"}},
-            {"$group": {"_id": None, "total": {"$sum": "$total_price"}}}
-        ]
-        revenue_result = await db.bookings.aggregate(revenue_pipeline).to_list(length=1)
-        total_revenue = revenue_result[0]["total"] if revenue_result else 0
-        
-        # Top routes
-        top_routes_pipeline = [
-            {"$group": {"_id": "$route_id", "count": {"$sum": 1}, "revenue": {"$sum": "$total_price"}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
+        # Metadata counts and rollup reads run concurrently, each under a timeout
+        all_time = ("0000-00-00", "9999-99-99")
+        stats, partial = await gather_stats({
+            "total_users": estimated_count(db.users),
+            "total_operators": estimated_count(db.operators),
+            "total_vehicles": estimated_count(db.vehicles),
+            "total_routes": estimated_count(db.routes),
+            "totals": read_rollup(db),
+            "top_routes": top_routes(db, catalog_cache, *all_time, by=("route_id",)),
+            "operators": rollup_breakdown(db, *all_time, by="operator"),
+            "days": daily_series(db, window_start(30), local_today())
+        })
+        totals = stats["totals"]
+        
+        route_leaders = [
+            {"_id": row["route_id"], "name": row["route_name"], "count": row["bookings_created"], "revenue": row["revenue"]}
+            for row in stats["top_routes"] or []
         ]
-        top_routes = await db.bookings.aggregate(top_routes_pipeline).to_list(length=10)
-        
-        # Revenue trend (last 30 days)
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        revenue_trend_pipeline = [
-            {"$match": {"created_at": {"$gte": thirty_days_ago}, "status": "paid"}},
-            {"$group": {
-                "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
-                "revenue": {"$sum": "$total_price"},
-                "bookings": {"$sum": 1}
-            }},
-            {"$sort": {"_id": 1}}
+        operator_performance = [
+            {"operator": row["_id"], "bookings": row["bookings_created"], "revenue": row["revenue"]}
+            for row in stats["operators"] or []
         ]
-        revenue_trend = await db.bookings.aggregate(revenue_trend_pipeline).to_list(length=30)
-        
-        booking_trend = revenue_trend
         
-        # Operator performance - simplified
-        operator_performance = []
+        # Revenue and booking trends (last 30 local days)
+        days = stats["days"] or []
+        revenue_trend = [
+            {"_id": day["date"], "revenue": day["revenue"], "bookings": day["bookings_paid"]}
+            for day in days
+        ]
+        booking_trend = [
+            {"_id": day["date"], "bookings": day["bookings_created"], "seats": day["seats_booked"]}
+            for day in days
+        ]
         
         return AnalyticsResponse(
-            total_bookings=total_bookings,
-            total_revenue=total_revenue,
-            total_users=total_users,
-            total_operators=total_operators,
-            total_vehicles=total_vehicles,
-            total_routes=total_routes,
-            top_routes=top_routes,
+            total_bookings=totals["bookings_created"] if totals else None,
+            total_revenue=net_revenue(totals) if totals else None,
+            total_users=stats["total_users"],
+            total_operators=stats["total_operators"],
+            total_vehicles=stats["total_vehicles"],
+            total_routes=stats["total_routes"],
+            top_routes=route_leaders,
             revenue_trend=revenue_trend,
             booking_trend=booking_trend,
-            operator_performance=operator_performance
+            operator_performance=operator_performance,
+            partial=partial
         )
     except Exception as e:
         logger.error(f"Error getting analytics: {e}")
         raise HTTPException(status_code=500, detail="Failed to get analytics")
 
+@management_router.get("/analytics", response_model=AnalyticsResponse)
+async def get_analytics(admin: dict = Depends(check_admin_access)):
+    """Get comprehensive analytics data"""
+    return await analytics_cache.get("management_analytics", load_analytics)
+
+@management_router.get("/analytics/trends")
+async def get_analytics_trends(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    granularity: str = "day",
+    group_by: Optional[str] = None,
+    tz: str = LOCAL_TIMEZONE.key,
+    admin: dict = Depends(check_admin_access)
+):
+    """Bookings and revenue bucketed by hour/day/week/month over any date range"""
+    try:
+        return await compute_trend(
+            db, catalog_cache, start or window_start(30), end or local_today(), granularity, group_by, tz
+        )
+    except TrendRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@management_router.get("/analytics/cohorts")
+async def get_analytics_cohorts(limit: int = 24, admin: dict = Depends(check_admin_access)):
+    """Monthly signup cohorts with conversion, repeat-booking and retention rates"""
+    return await read_cohorts(db, max(1, min(limit, 120)))
+
 # AI Features
 @management_router.post("/ai/optimize-routes")
 async def optimize_routes(admin: dict = Depends(check_admin_access)):
@@ -375,34 +398,28 @@ async def optimize_routes(admin: dict = Depends(check_admin_access)):
 
 @management_router.post("/ai/dynamic-pricing")
 async def calculate_dynamic_pricing(route_id: str, date: str, admin: dict = Depends(check_admin_access)):
-    """AI-powered dynamic pricing"""
+    """Engine fares for each schedule of a route on a date"""
     try:
         # Get route info
         route = await db.routes.find_one({"_id": ObjectId(route_id)})
         if not route:
             raise HTTPException(status_code=404, detail="Route not found")
         
-        base_price = route["price_base"]
-        
-        # Simplified dynamic pricing
-        demand_factor = 1.2  # High demand
-        availability_factor = 1.1  # Limited availability
-        early_bird_factor = 0.9  # Early booking discount
-        
-        dynamic_price = base_price * demand_factor * availability_factor * early_bird_factor
+        # Priced from the in-memory table; the first schedule is the headline figure
+        departures = pricing_engine.route_quotes(route, date)
+        headline = departures[0]
         
         return {
             "route_id": route_id,
             "date": date,
-            "base_price": base_price,
-            "dynamic_price": round(dynamic_price, 2),
-            "factors": {
-                "demand_factor": demand_factor,
-                "availability_factor": availability_factor,
-                "early_bird_factor": early_bird_factor
-            },
-            "recommendation": "optimal_price"
+            "base_price": headline["base_price"],
+            "dynamic_price": headline["price"],
+            "factors": headline["factors"],
+            "departures": departures,
+            "recommendation": "optimal_price" if headline["load"] is not None else "time_based_estimate"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error calculating dynamic pricing: {e}")
         raise HTTPException(status_code=500, detail="Failed to calculate dynamic pricing")
@@ -411,46 +428,13 @@ async def calculate_dynamic_pricing(route_id: str, date: str, admin: dict = Depe
 @management_router.get("/realtime/dashboard")
 async def get_realtime_dashboard(admin: dict = Depends(check_admin_access)):
     """Get real-time dashboard data"""
-    try:
-        # Current active bookings
-        active_bookings = await db.bookings.count_documents({
-            "status": "paid",
-            "date": {"$gte": datetime.utcnow().strftime("%Y-%m-%d")}
-        })
-        
-        # Today's revenue
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_revenue = await db.payments.aggregate([
-            {"$match": {"created_at": {"$gte": today_start}, "status": "completed"}},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ]).to_list(length=1)
-        
-        revenue_today = today_revenue[0]["total"] if today_revenue else 0
-        
-        # Active vehicles
-        active_vehicles = await db.vehicles.count_documents({"is_active": True})
-        
-        # System alerts
-        alerts = [
-            {
-                "type": "maintenance",
-                "message": "Vehicle KH-PP-1234 maintenance due in 3 days",
-                "priority": "medium"
-            },
-            {
-                "type": "availability",
-                "message": "High demand detected for weekend routes",
-                "priority": "high"
-            }
-        ]
-        
-        return {
-            "active_bookings": active_bookings,
-            "revenue_today": revenue_today,
-            "active_vehicles": active_vehicles,
-            "alerts": alerts,
-            "last_updated": datetime.utcnow()
-        }
-    except Exception as e:
-        logger.error(f"Error getting realtime dashboard: {e}")
-        raise HTTPException(status_code=500, detail="Failed to get dashboard data")
\ No newline at end of file
+    return await realtime_feed.snapshot()
+
+@management_router.get("/realtime/stream")
+async def stream_realtime_dashboard(admin: dict = Depends(check_admin_access)):
+    """Server-sent events: a dashboard snapshot, then counter deltas and alerts as bookings change"""
+    return StreamingResponse(
+        realtime_feed.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -7,7 +7,7 @@ from bson import ObjectId
 import logging
 
 # Import from main.py
-from server import db, get_current_user
+from server import db, require_permissions
 
 logger = logging.getLogger(__name__)
 
@@ -147,22 +147,20 @@ class SeatManagementResponse(BaseModel):
     pricing_tiers: Dict[str, float]
 
 class AnalyticsResponse(BaseModel):
-    total_bookings: int
-    total_revenue: float
-    total_users: int
-    total_operators: int
-    total_vehicles: int
-    total_routes: int
+    # Totals are None when their query timed out; see partial
+    total_bookings: Optional[int]
+    total_revenue: Optional[float]
+    total_users: Optional[int]
+    total_operators: Optional[int]
+    total_vehicles: Optional[int]
+    total_routes: Optional[int]
     top_routes: List[Dict[str, Any]]
     revenue_trend: List[Dict[str, Any]]
     booking_trend: List[Dict[str, Any]]
     operator_performance: List[Dict[str, Any]]
+    partial: List[str] = []
 
 # Helper function to check admin access
-async def check_admin_access(current_user: dict = Depends(get_current_user)):
+async def check_admin_access(current_user: dict = Depends(require_permissions("operations:manage"))):
     """Check if user has admin access"""
-    # For now, we'll assume all logged-in users are admins
-    # In production, you'd check user roles
-    if not current_user:
-        raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
\ No newline at end of file
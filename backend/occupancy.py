@@ -0,0 +1,158 @@
+"""Load factor of scheduled departures.
+
+Every route runs one departure per schedule slot per day, and the slot's
+vehicle sets the capacity (see ``generate_schedules_for_route``). The
+engine lays a range out as a dates × departures matrix. Capacity is a
+broadcast row, and seats sold come from a single aggregation grouped by
+route schedule and travel date, scattered into the matrix. The load factor
+and every breakdown (per departure, route, vehicle, weekday, and the
+weekday × slot heatmap) are then NumPy reductions over that matrix. A year
+of departures is one aggregation and a few array passes, not a query per
+departure.
+"""
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+from booking_holds import SEAT_BLOCKING_STATUSES
+from catalog_cache import route_label
+from departures import SCHEDULE_TIMES, local_day_bounds
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+# Schedules offered per route per day, matching search
+SCHEDULES_PER_ROUTE = 3
+MAX_OCCUPANCY_DAYS = 366
+# Departures under this load factor are listed as running half empty
+LOW_LOAD_FACTOR = 0.5
+
+
+class OccupancyRequestError(ValueError):
+    pass
+
+
+def _ratio(sold: np.ndarray, capacity: np.ndarray) -> np.ndarray:
+    return np.divide(sold, capacity, out=np.zeros(np.shape(sold), dtype=np.float64), where=capacity > 0)
+
+
+def _grouped_load(keys: np.ndarray, sold: np.ndarray, capacity: np.ndarray) -> Dict[str, dict]:
+    """Seats sold, seats offered and load factor per distinct key"""
+    unique, index = np.unique(keys, return_inverse=True)
+    sold_sum = np.bincount(index, weights=sold, minlength=len(unique))
+    capacity_sum = np.bincount(index, weights=capacity, minlength=len(unique))
+    load = _ratio(sold_sum, capacity_sum)
+    return {
+        str(key): {"seats_sold": int(sold_sum[i]), "seats_offered": int(capacity_sum[i]),
+                   "load_factor": round(float(load[i]), 4)}
+        for i, key in enumerate(unique)
+    }
+
+
+async def compute_occupancy(db, catalog, start: str, end: str, route_id: Optional[str] = None) -> dict:
+    """Load factor of every scheduled departure between local dates start and end (inclusive)"""
+    try:
+        first_day = np.datetime64(datetime.strptime(start, "%Y-%m-%d").date(), "D")
+        last_day = np.datetime64(datetime.strptime(end, "%Y-%m-%d").date(), "D")
+    except ValueError:
+        raise OccupancyRequestError("Expected YYYY-MM-DD dates")
+    if last_day < first_day:
+        raise OccupancyRequestError("End date is before start date")
+    if last_day - first_day >= np.timedelta64(MAX_OCCUPANCY_DAYS, "D"):
+        raise OccupancyRequestError(f"Range is limited to {MAX_OCCUPANCY_DAYS} days")
+
+    # Departure columns: one per route × schedule slot with a vehicle behind it
+    vehicles = await db.vehicles.find({}, {"company": 1, "total_seats": 1, "vehicle_type": 1}).to_list(length=10)
+    slots = min(SCHEDULES_PER_ROUTE, len(vehicles), len(SCHEDULE_TIMES))
+    if route_id:
+        route_ids = [route_id]
+    else:
+        route_ids = [str(route["_id"]) for route in await db.routes.find({}, {"_id": 1}).to_list(length=None)]
+    routes = await catalog.routes(db, route_ids)
+
+    columns = [f"{rid}-{slot + 1}" for rid in route_ids for slot in range(slots)]
+    column_index = {key: i for i, key in enumerate(columns)}
+    column_route = np.array([rid for rid in route_ids for _ in range(slots)], dtype=object)
+    column_slot = np.array([slot for _ in route_ids for slot in range(slots)], dtype=np.int64)
+    column_vehicle = np.array([str(vehicles[slot]["_id"]) for slot in column_slot], dtype=object)
+    column_capacity = np.array([vehicles[slot].get("total_seats", 0) for slot in column_slot], dtype=np.float64)
+
+    dates = np.arange(first_day, last_day + 1)
+    sold = np.zeros((len(dates), len(columns)), dtype=np.float64)
+    capacity = np.broadcast_to(column_capacity, sold.shape)
+
+    if columns:
+        match = {
+            "departure_at": {"$gte": local_day_bounds(start)[0], "$lt": local_day_bounds(end)[1]},
+            "status": {"$in": SEAT_BLOCKING_STATUSES}
+        }
+        if route_id:
+            match["route_id"] = {"$in": columns}
+        rows = await db.bookings.aggregate([
+            {"$match": match},
+            {"$group": {"_id": {"route_id": "$route_id", "date": "$date"}, "seats": {"$sum": {"$size": {"$ifNull": ["$seats", []]}}}}}
+        ]).to_list(length=None)
+
+        row_dates, row_columns, row_seats = [], [], []
+        for row in rows:
+            column = column_index.get(row["_id"].get("route_id"))
+            if column is None or not row["_id"].get("date"):
+                continue
+            row_dates.append(row["_id"]["date"])
+            row_columns.append(column)
+            row_seats.append(row["seats"])
+        if row_dates:
+            day_index = (np.array(row_dates, dtype="datetime64[D]") - first_day).astype(np.int64)
+            # Travel dates and departure_at can disagree on legacy bookings; keep what lands in range
+            keep = (day_index >= 0) & (day_index < len(dates))
+            np.add.at(sold, (day_index[keep], np.array(row_columns)[keep]), np.array(row_seats, dtype=np.float64)[keep])
+
+    load = _ratio(sold, capacity)
+    # Monday = 0, as in datetime.weekday()
+    weekday = (dates.astype(np.int64) + 3) % 7
+
+    # Weekday × slot heatmap
+    cells = (weekday[:, None] * slots + column_slot[None, :]).ravel()
+    heat_sold = np.bincount(cells, weights=sold.ravel(), minlength=7 * slots).reshape(7, slots)
+    heat_capacity = np.bincount(cells, weights=capacity.ravel(), minlength=7 * slots).reshape(7, slots)
+    heatmap = np.round(_ratio(heat_sold, heat_capacity), 4)
+
+    per_departure = _ratio(sold.sum(axis=0), capacity.sum(axis=0))
+    departures = []
+    for i, key in enumerate(columns):
+        route = routes.get(column_route[i])
+        departures.append({
+            "route_schedule_id": key,
+            "route_id": column_route[i],
+            "route_name": route_label(route) if route else column_route[i],
+            "departure_time": SCHEDULE_TIMES[column_slot[i]]["departure"],
+            "operator": vehicles[column_slot[i]].get("company"),
+            "seats_sold": int(sold[:, i].sum()),
+            "seats_offered": int(capacity[:, i].sum()),
+            "load_factor": round(float(per_departure[i]), 4),
+            "low_load_days": int((load[:, i] < LOW_LOAD_FACTOR).sum())
+        })
+    departures.sort(key=lambda item: item["load_factor"])
+
+    by_route = _grouped_load(np.repeat(column_route[None, :], len(dates), axis=0).ravel(), sold.ravel(), capacity.ravel())
+    for rid, entry in by_route.items():
+        entry["route_name"] = route_label(routes[rid]) if rid in routes else rid
+    by_weekday = _grouped_load(np.repeat(weekday, len(columns)), sold.ravel(), capacity.ravel())
+
+    return {
+        "start": start,
+        "end": end,
+        "departures_scheduled": int(sold.size),
+        "seats_offered": int(capacity.sum()),
+        "seats_sold": int(sold.sum()),
+        "load_factor": round(float(_ratio(sold.sum(), capacity.sum())), 4),
+        "low_load_departures": int((load < LOW_LOAD_FACTOR).sum()),
+        "heatmap": {
+            "rows": WEEKDAYS,
+            "columns": [SCHEDULE_TIMES[slot]["departure"] for slot in range(slots)],
+            "load_factor": heatmap.tolist()
+        },
+        "by_departure": departures,
+        "by_route": by_route,
+        "by_vehicle": _grouped_load(np.repeat(column_vehicle[None, :], len(dates), axis=0).ravel(), sold.ravel(), capacity.ravel()),
+        "by_weekday": {WEEKDAYS[int(day)]: entry for day, entry in by_weekday.items()}
+    }
@@ -0,0 +1,180 @@
+"""Payment gateway adapters.
+
+Checkout talks to a ``PaymentGateway`` through ``GatewayClient``, which adds a
+per-call timeout and a retry budget. ``SimulatedGateway`` is the local
+stand-in: it injects configurable latency, transient errors, timeouts and
+declines, so checkout throughput can be load-tested offline. Real providers
+plug in with ``register_gateway``.
+"""
+import os
+import uuid
+import random
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class GatewayResult:
+    approved: bool
+    transaction_id: Optional[str]
+    message: str = ""
+    provider: str = ""
+    latency_ms: float = 0.0
+
+
+class GatewayError(Exception):
+    """Transient provider failure; safe to retry with the same idempotency key"""
+
+
+class GatewayUnavailable(Exception):
+    """Retry budget exhausted without a definitive answer from the provider"""
+
+
+class PaymentGateway(ABC):
+    name = "base"
+
+    @abstractmethod
+    async def charge(
+        self,
+        amount: float,
+        currency: str,
+        payment_method: str,
+        reference: str,
+        idempotency_key: str
+    ) -> GatewayResult:
+        """Charge the customer; raise GatewayError for retryable failures"""
+
+
+class SimulatedGateway(PaymentGateway):
+    """In-process provider with configurable latency and failure injection"""
+
+    name = "simulator"
+
+    def __init__(
+        self,
+        latency_ms: float = 150,
+        jitter_ms: float = 100,
+        failure_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        decline_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.timeout_rate = timeout_rate
+        self.decline_rate = decline_rate
+        self.random = random.Random(seed)
+        # Like real providers, a repeated idempotency key returns the first outcome
+        self._results: "OrderedDict[str, GatewayResult]" = OrderedDict()
+        self._max_results = 100_000
+
+    async def charge(self, amount, currency, payment_method, reference, idempotency_key):
+        if idempotency_key in self._results:
+            return self._results[idempotency_key]
+
+        roll = self.random.random()
+        if roll < self.timeout_rate:
+            await asyncio.sleep(3600)
+
+        latency = max(self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms), 0)
+        await asyncio.sleep(latency / 1000)
+
+        roll = self.random.random()
+        if roll < self.failure_rate:
+            raise GatewayError("Simulated provider error")
+
+        if self.random.random() < self.decline_rate:
+            result = GatewayResult(False, None, "Card declined", self.name, latency)
+        else:
+            result = GatewayResult(True, f"SIM{uuid.uuid4().hex[:16].upper()}", "Approved", self.name, latency)
+
+        self._results[idempotency_key] = result
+        if len(self._results) > self._max_results:
+            self._results.popitem(last=False)
+        return result
+
+
+class GatewayClient:
+    """Wraps a gateway with a per-attempt timeout and an overall retry budget.
+
+    Every attempt sends the caller's idempotency key, so a charge that landed
+    but timed out is returned rather than repeated.
+    """
+
+    def __init__(
+        self,
+        gateway: PaymentGateway,
+        timeout: float = 5.0,
+        max_attempts: int = 3,
+        budget: float = 12.0,
+        backoff: float = 0.25
+    ):
+        self.gateway = gateway
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.budget = budget
+        self.backoff = backoff
+
+    async def charge(
+        self,
+        amount: float,
+        payment_method: str,
+        reference: str,
+        idempotency_key: str,
+        currency: str = "USD"
+    ) -> GatewayResult:
+        """Charge with retries; the caller owns the key so retried requests reuse it too"""
+        deadline = time.monotonic() + self.budget
+        last_error = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return await asyncio.wait_for(
+                    self.gateway.charge(amount, currency, payment_method, reference, idempotency_key),
+                    timeout=min(self.timeout, remaining)
+                )
+            except (GatewayError, asyncio.TimeoutError) as e:
+                last_error = e
+                logger.warning(f"{self.gateway.name} charge attempt {attempt} for {reference} failed: {e!r}")
+                await asyncio.sleep(min(self.backoff * 2 ** (attempt - 1), max(deadline - time.monotonic(), 0)))
+
+        raise GatewayUnavailable(f"{self.gateway.name} did not confirm charge for {reference}: {last_error!r}")
+
+
+GATEWAY_FACTORIES: Dict[str, Callable[[], PaymentGateway]] = {
+    "simulator": lambda: SimulatedGateway(
+        latency_ms=float(os.getenv("PAYMENT_SIM_LATENCY_MS", "150")),
+        jitter_ms=float(os.getenv("PAYMENT_SIM_JITTER_MS", "100")),
+        failure_rate=float(os.getenv("PAYMENT_SIM_FAILURE_RATE", "0")),
+        timeout_rate=float(os.getenv("PAYMENT_SIM_TIMEOUT_RATE", "0")),
+        decline_rate=float(os.getenv("PAYMENT_SIM_DECLINE_RATE", "0")),
+        seed=int(os.environ["PAYMENT_SIM_SEED"]) if os.getenv("PAYMENT_SIM_SEED") else None
+    )
+}
+
+
+def register_gateway(name: str, factory: Callable[[], PaymentGateway]):
+    GATEWAY_FACTORIES[name] = factory
+
+
+def gateway_from_env() -> GatewayClient:
+    name = os.getenv("PAYMENT_GATEWAY", "simulator")
+    if name not in GATEWAY_FACTORIES:
+        raise ValueError(f"Unknown payment gateway '{name}'")
+    return GatewayClient(
+        GATEWAY_FACTORIES[name](),
+        timeout=float(os.getenv("PAYMENT_GATEWAY_TIMEOUT", "5")),
+        max_attempts=int(os.getenv("PAYMENT_GATEWAY_MAX_ATTEMPTS", "3")),
+        budget=float(os.getenv("PAYMENT_GATEWAY_BUDGET", "12"))
+    )
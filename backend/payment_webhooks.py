@@ -0,0 +1,191 @@
+"""Asynchronous payment provider webhooks.
+
+The HTTP endpoint only verifies the signature and enqueues the event. The
+job queue's unique dedupe_key (provider + provider event id) doubles as
+duplicate detection, so ingestion is a single insert. Status transitions on
+bookings and payments are applied later by the ``apply_payment_webhook``
+job, in a transaction together with the booking event.
+
+Signatures use the header ``X-Webhook-Signature: t=<unix ts>,v1=<hex>``. The
+hex value is HMAC-SHA256 of ``"<ts>.<raw body>"`` with the provider's
+secret, read from ``PAYMENT_WEBHOOK_SECRET_<PROVIDER>``.
+"""
+import os
+import hmac
+import time
+import hashlib
+import logging
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+
+from booking_events import BOOKING_PAID, BOOKING_REFUNDED, append_event, booking_snapshot
+from transactions import run_in_transaction
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_TOLERANCE_SECONDS = 300
+
+PAYMENT_SUCCEEDED = "payment.succeeded"
+PAYMENT_FAILED = "payment.failed"
+PAYMENT_REFUNDED = "payment.refunded"
+SUPPORTED_EVENTS = {PAYMENT_SUCCEEDED, PAYMENT_FAILED, PAYMENT_REFUNDED}
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+def webhook_secret(provider: str) -> Optional[str]:
+    return os.getenv(f"PAYMENT_WEBHOOK_SECRET_{provider.upper()}")
+
+
+def verify_signature(provider: str, body: bytes, header: Optional[str], now: Optional[float] = None):
+    """Raise InvalidSignature unless the header signs this body with the provider secret"""
+    secret = webhook_secret(provider)
+    if not secret:
+        raise InvalidSignature(f"No webhook secret configured for {provider}")
+    if not header:
+        raise InvalidSignature("Missing signature header")
+
+    parts = dict(item.split("=", 1) for item in header.split(",") if "=" in item)
+    try:
+        timestamp = int(parts["t"])
+        signature = parts["v1"]
+    except (KeyError, ValueError):
+        raise InvalidSignature("Malformed signature header")
+
+    if abs((now or time.time()) - timestamp) > SIGNATURE_TOLERANCE_SECONDS:
+        raise InvalidSignature("Signature timestamp outside tolerance")
+
+    expected = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, signature):
+        raise InvalidSignature("Signature mismatch")
+
+
+def register_webhook_jobs(queue, db):
+
+    @queue.handler("apply_payment_webhook")
+    async def apply_payment_webhook(payload: dict):
+        event_type = payload["type"]
+        data = payload.get("data", {})
+        try:
+            booking_oid = ObjectId(data.get("booking_id"))
+        except (InvalidId, TypeError):
+            logger.warning(f"Webhook {payload['provider']}:{payload['event_id']} has no valid booking_id, ignored")
+            return
+
+        if event_type == PAYMENT_SUCCEEDED:
+            await _apply_succeeded(db, booking_oid, payload)
+        elif event_type == PAYMENT_FAILED:
+            await _apply_failed(db, booking_oid, payload)
+        elif event_type == PAYMENT_REFUNDED:
+            await _apply_refunded(db, booking_oid, payload)
+
+
+def _payment_from_event(booking: dict, payload: dict, status: str) -> dict:
+    data = payload.get("data", {})
+    return {
+        "booking_id": str(booking["_id"]),
+        "user_id": booking.get("user_id"),
+        "amount": data.get("amount", booking.get("total_price")),
+        "payment_method": data.get("payment_method", payload["provider"]),
+        "status": status,
+        "transaction_id": data.get("transaction_id"),
+        "provider": payload["provider"],
+        "provider_event_id": payload["event_id"],
+        "created_at": datetime.utcnow()
+    }
+
+
+async def _apply_succeeded(db, booking_oid, payload: dict):
+    data = payload.get("data", {})
+
+    async def write(session):
+        # An expired hold's seats may already be resold, even before the sweeper marks it
+        booking = await db.bookings.find_one_and_update(
+            {"_id": booking_oid, "status": "pending", "expires_at": {"$gt": datetime.utcnow()}},
+            {
+                "$set": {
+                    "status": "paid",
+                    "payment_method": data.get("payment_method", payload["provider"]),
+                    "payment_status": "completed",
+                    "transaction_id": data.get("transaction_id"),
+                    "paid_at": datetime.utcnow()
+                },
+                "$unset": {"expires_at": ""}
+            },
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if booking is None:
+            booking = await db.bookings.find_one({"_id": booking_oid}, session=session)
+            if booking is None:
+                logger.warning(f"Webhook payment for unknown booking {booking_oid}")
+                return
+            if booking.get("transaction_id") == data.get("transaction_id"):
+                return
+            # Paid after the hold lapsed or for an already-settled booking: needs a refund
+            await db.payments.insert_one(_payment_from_event(booking, payload, "refund_pending"), session=session)
+            return
+
+        payment = _payment_from_event(booking, payload, "completed")
+        await db.payments.update_one(
+            {"booking_id": payment["booking_id"], "transaction_id": payment["transaction_id"]},
+            {"$set": payment},
+            upsert=True,
+            session=session
+        )
+        await append_event(db, BOOKING_PAID, booking_oid, {
+            **booking_snapshot(booking),
+            "status": "paid",
+            "amount": payment["amount"],
+            "payment_method": payment["payment_method"],
+            "transaction_id": payment["transaction_id"]
+        }, session=session)
+
+    await run_in_transaction(db, write)
+
+
+async def _apply_failed(db, booking_oid, payload: dict):
+    booking = await db.bookings.find_one({"_id": booking_oid}, {"user_id": 1, "total_price": 1})
+    if booking is None:
+        return
+    payment = _payment_from_event(booking, payload, "failed")
+    # The booking keeps its hold so the customer can retry before it expires
+    await db.payments.update_one(
+        {"booking_id": payment["booking_id"], "transaction_id": payment["transaction_id"]},
+        {"$set": payment},
+        upsert=True
+    )
+
+
+async def _apply_refunded(db, booking_oid, payload: dict):
+    data = payload.get("data", {})
+
+    async def write(session):
+        booking = await db.bookings.find_one_and_update(
+            {"_id": booking_oid, "status": {"$in": ["paid", "confirmed", "cancelled"]}},
+            {"$set": {"status": "refunded", "refund_status": "completed", "refunded_at": datetime.utcnow()}},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if booking is None:
+            return
+        await db.payments.update_many(
+            {"booking_id": str(booking_oid), "transaction_id": data.get("transaction_id")},
+            {"$set": {"status": "refunded", "refunded_at": datetime.utcnow()}},
+            session=session
+        )
+        await append_event(db, BOOKING_REFUNDED, booking_oid, {
+            **booking_snapshot(booking),
+            "status": "refunded",
+            "previous_status": booking.get("status"),
+            "amount": data.get("amount", booking.get("total_price")),
+            "transaction_id": data.get("transaction_id")
+        }, session=session)
+
+    await run_in_transaction(db, write)
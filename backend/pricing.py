@@ -0,0 +1,302 @@
+"""Demand-driven fares for upcoming departures.
+
+The engine prices every departure in the next PRICING_HORIZON_DAYS in one
+vectorised batch, from four signals:
+
+* load factor: seats taken (paid, confirmed or held) over vehicle capacity
+* booking velocity: seats booked in the last VELOCITY_WINDOW_HOURS, against
+  the pace that would sell the departure out over a fortnight
+* days to departure: early-bird discount far out, premium close in
+* day of week: weekend travel runs fuller
+
+Each signal maps through a piecewise-linear curve to a multiplier on the
+route's ``price_base``. The product is clamped to [PRICE_FLOOR, PRICE_CEILING]
+× base and rounded to the half dollar. Results go into an in-memory table
+keyed by route schedule and date, so search, seat maps and booking read a
+fare with one dict lookup. A background task rebuilds the table every
+PRICE_REFRESH_SECONDS from one bookings aggregation. Departures outside the
+table (past the horizon, or routes added since the last refresh) are priced
+from the time-based signals alone.
+
+Each worker keeps its own table, so two requests can see different fares
+for the same departure. Search and the seat map therefore hand out a
+``price_token`` with each fare: the fare, an expiry and an HMAC over the
+departure. A booking that presents a valid token is charged that fare,
+whichever worker takes it, so the customer always pays what they were shown.
+"""
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from booking_holds import seats_taken_filter
+from departures import SCHEDULE_TIMES, local_today, schedule_slot, to_departure_at, to_local
+
+logger = logging.getLogger(__name__)
+
+PRICE_REFRESH_SECONDS = float(os.getenv("PRICE_REFRESH_SECONDS", "300"))
+PRICING_HORIZON_DAYS = int(os.getenv("PRICING_HORIZON_DAYS", "60"))
+VELOCITY_WINDOW_HOURS = 48
+# Schedules offered per route per day, matching search
+SCHEDULES_PER_ROUTE = 3
+DEFAULT_BASE_PRICE = 15.0
+DEFAULT_CAPACITY = 45
+PRICE_FLOOR = 0.8
+PRICE_CEILING = 1.5
+MAX_QUOTE_BATCH = int(os.getenv("MAX_QUOTE_BATCH", "500"))
+# How long a fare shown to a customer can still be booked at
+QUOTE_TTL_SECONDS = int(os.getenv("QUOTE_TTL_SECONDS", "900"))
+
+# (signal points, multipliers) for np.interp; values beyond the ends are held flat
+LOAD_CURVE = ([0.0, 0.5, 0.8, 1.0], [0.9, 1.0, 1.15, 1.3])
+VELOCITY_CURVE = ([0.0, 1.0, 3.0], [0.95, 1.0, 1.15])
+DAYS_OUT_CURVE = ([0, 1, 3, 7, 21, 45], [1.15, 1.1, 1.05, 1.0, 0.95, 0.9])
+# Monday first, as in datetime.weekday()
+WEEKDAY_FACTORS = np.array([1.0, 0.95, 0.95, 1.0, 1.1, 1.1, 1.05])
+SEAT_CLASS_MULTIPLIERS = {"economy": 1.0, "premium": 1.25, "vip": 1.5}
+
+
+def price_departures(base: np.ndarray, capacity: np.ndarray, taken: np.ndarray, recent: np.ndarray,
+                     days_out: np.ndarray, weekday: np.ndarray) -> Dict[str, np.ndarray]:
+    """Fares and the factors behind them for parallel arrays of departures"""
+    load = np.divide(taken, capacity, out=np.zeros_like(taken, dtype=np.float64), where=capacity > 0)
+    # Seats per day that would sell the departure out over 14 days
+    pace = np.maximum(capacity, 1) / 14.0
+    velocity = (recent / (VELOCITY_WINDOW_HOURS / 24.0)) / pace
+
+    factors = {
+        "load_factor": np.interp(load, *LOAD_CURVE),
+        "velocity_factor": np.interp(velocity, *VELOCITY_CURVE),
+        "days_out_factor": np.interp(days_out, *DAYS_OUT_CURVE),
+        "weekday_factor": WEEKDAY_FACTORS[weekday]
+    }
+    multiplier = np.prod(np.vstack(list(factors.values())), axis=0)
+    return {"price": round_fare(base, multiplier), "load": load, **factors}
+
+
+def round_fare(base, multiplier):
+    """base × multiplier within the floor and ceiling, to the half dollar"""
+    price = np.clip(np.multiply(base, multiplier), np.multiply(base, PRICE_FLOOR), np.multiply(base, PRICE_CEILING))
+    return np.round(price * 2) / 2
+
+
+class PricingEngine:
+    def __init__(self, db, secret: str, interval: float = PRICE_REFRESH_SECONDS, horizon_days: int = PRICING_HORIZON_DAYS):
+        self.db = db
+        self.secret = secret.encode()
+        self.interval = interval
+        self.horizon_days = horizon_days
+        self.table: Dict[str, dict] = {}
+        self.refreshed_at: Optional[datetime] = None
+        self.refresh_seconds: Optional[float] = None
+        # Schedules per route as of the last refresh (one per vehicle, up to SCHEDULES_PER_ROUTE)
+        self.slots = SCHEDULES_PER_ROUTE
+        self.hits = 0
+        self.misses = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Price table refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self) -> int:
+        """Reprice every departure in the horizon and swap in the new table"""
+        started = datetime.utcnow()
+        routes = await self.db.routes.find({}, {"price_base": 1}).to_list(length=None)
+        vehicles = await self.db.vehicles.find({}, {"total_seats": 1}).to_list(length=10)
+        slots = min(SCHEDULES_PER_ROUTE, len(vehicles), len(SCHEDULE_TIMES))
+        first = datetime.strptime(local_today(), "%Y-%m-%d")
+        dates = [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(self.horizon_days)]
+
+        # Departure instants depend only on slot and date, so resolve them once for all routes
+        departures = [
+            (slot, date, departs)
+            for slot in range(slots) for date in dates
+            for departs in [to_departure_at(date, SCHEDULE_TIMES[slot]["departure"])]
+            if departs > started
+        ]
+        keys, base, capacity, departure_at = [], [], [], []
+        for route in routes:
+            for slot, date, departs in departures:
+                keys.append((f"{route['_id']}-{slot + 1}", date))
+                base.append(route.get("price_base", DEFAULT_BASE_PRICE))
+                capacity.append(vehicles[slot].get("total_seats", DEFAULT_CAPACITY))
+                departure_at.append(departs)
+
+        # Seats taken and recently booked per departure, in one pass over upcoming bookings
+        demand = {}
+        if keys:
+            rows = await self.db.bookings.aggregate([
+                {"$match": {
+                    "departure_at": {"$gte": started, "$lte": max(departure_at)},
+                    **seats_taken_filter(started)
+                }},
+                {"$project": {
+                    "route_id": 1, "date": 1,
+                    "seats": {"$size": {"$ifNull": ["$seats", []]}},
+                    "recent": {"$gte": ["$created_at", started - timedelta(hours=VELOCITY_WINDOW_HOURS)]}
+                }},
+                {"$group": {
+                    "_id": {"route_id": "$route_id", "date": "$date"},
+                    "taken": {"$sum": "$seats"},
+                    "recent": {"$sum": {"$cond": ["$recent", "$seats", 0]}}
+                }}
+            ]).to_list(length=None)
+            demand = {(row["_id"]["route_id"], row["_id"]["date"]): row for row in rows}
+
+        taken = np.array([demand.get(key, {}).get("taken", 0) for key in keys], dtype=np.float64)
+        recent = np.array([demand.get(key, {}).get("recent", 0) for key in keys], dtype=np.float64)
+        departs = np.array(departure_at, dtype="datetime64[m]")
+        days_out = (departs - np.datetime64(started, "m")).astype(np.float64) / (24 * 60)
+        local_days = np.array([date for _, date in keys], dtype="datetime64[D]")
+        weekday = ((local_days.astype(np.int64) + 3) % 7) if keys else np.zeros(0, dtype=np.int64)
+
+        priced = price_departures(np.array(base, dtype=np.float64), np.array(capacity, dtype=np.float64),
+                                  taken, recent, days_out, weekday)
+        table = {}
+        for i, (route_schedule_id, date) in enumerate(keys):
+            table[f"{route_schedule_id}|{date}"] = {
+                "price": float(priced["price"][i]),
+                "base_price": base[i],
+                "load": round(float(priced["load"][i]), 4),
+                "seats_taken": int(taken[i]),
+                "factors": {
+                    name: round(float(priced[name][i]), 4)
+                    for name in ("load_factor", "velocity_factor", "days_out_factor", "weekday_factor")
+                }
+            }
+
+        self.table = table
+        self.slots = slots or SCHEDULES_PER_ROUTE
+        self.refreshed_at = started
+        self.refresh_seconds = round((datetime.utcnow() - started).total_seconds(), 3)
+        return len(table)
+
+    def quote(self, route: dict, route_schedule_id: str, date: str) -> dict:
+        """Fare for one departure: the table entry, or a time-based estimate outside it"""
+        entry = self.table.get(f"{route_schedule_id}|{date}")
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        base = route.get("price_base", DEFAULT_BASE_PRICE) if route else DEFAULT_BASE_PRICE
+        departs = to_departure_at(date, schedule_slot(route_schedule_id)["departure"])
+        if departs is None:
+            return {"price": base, "base_price": base, "load": None, "seats_taken": None, "factors": {}}
+        # No demand signal outside the table, so only the time-based factors apply
+        days_out = max((departs - datetime.utcnow()).total_seconds() / 86400, 0)
+        factors = {
+            "days_out_factor": round(float(np.interp(days_out, *DAYS_OUT_CURVE)), 4),
+            "weekday_factor": float(WEEKDAY_FACTORS[to_local(departs).weekday()])
+        }
+        return {
+            "price": float(round_fare(base, factors["days_out_factor"] * factors["weekday_factor"])),
+            "base_price": base,
+            "load": None,
+            "seats_taken": None,
+            "factors": factors
+        }
+
+    def price(self, route: dict, route_schedule_id: str, date: str) -> float:
+        return self.quote(route, route_schedule_id, date)["price"]
+
+    def _signature(self, route_schedule_id: str, date: str, price: float, expires: int) -> str:
+        message = f"{route_schedule_id}|{date}|{price:.2f}|{expires}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()[:32]
+
+    def price_token(self, route_schedule_id: str, date: str, price: float) -> str:
+        """Signed fare for one departure, honoured by booking for QUOTE_TTL_SECONDS"""
+        expires = int(time.time()) + QUOTE_TTL_SECONDS
+        return f"{price:.2f}:{expires}:{self._signature(route_schedule_id, date, price, expires)}"
+
+    def quoted_price(self, token: str, route_schedule_id: str, date: str) -> Optional[float]:
+        """The fare a price_token guarantees for this departure; None if forged, mismatched or expired"""
+        try:
+            price_text, expires_text, signature = token.split(":")
+            price, expires = float(price_text), int(expires_text)
+        except ValueError:
+            return None
+        if expires < time.time():
+            return None
+        if not hmac.compare_digest(signature, self._signature(route_schedule_id, date, price, expires)):
+            return None
+        return price
+
+    def class_prices(self, route: dict, route_schedule_id: str, date: str) -> Dict[str, float]:
+        fare = self.price(route, route_schedule_id, date)
+        return {seat_class: round(fare * multiplier, 2) for seat_class, multiplier in SEAT_CLASS_MULTIPLIERS.items()}
+
+    def route_quotes(self, route: dict, date: str) -> List[dict]:
+        """Quotes for every schedule of a route on a date"""
+        return [
+            {"route_schedule_id": f"{route['_id']}-{slot + 1}", "departure_time": SCHEDULE_TIMES[slot]["departure"],
+             **self.quote(route, f"{route['_id']}-{slot + 1}", date)}
+            for slot in range(self.slots)
+        ]
+
+    def batch_quotes(self, routes: Dict[str, dict], items: List[dict]) -> List[dict]:
+        """Quotes for (route_id, date) items against already-resolved route docs.
+
+        A bare route id is quoted at its cheapest schedule that day, as a "from" fare.
+        """
+        quotes = []
+        for item in items:
+            route_id, date = item["route_id"], item["date"]
+            result = {"route_id": route_id, "date": date}
+            route = routes.get(route_id.split("-")[0])
+            if route is None:
+                quotes.append({**result, "error": "Route not found"})
+                continue
+            if to_departure_at(date) is None:
+                quotes.append({**result, "error": "Expected a YYYY-MM-DD date"})
+                continue
+
+            if "-" in route_id:
+                route_schedule_id = route_id
+                quote = self.quote(route, route_id, date)
+            else:
+                candidates = [(self.quote(route, f"{route_id}-{slot + 1}", date), f"{route_id}-{slot + 1}")
+                              for slot in range(self.slots)]
+                quote, route_schedule_id = min(candidates, key=lambda candidate: candidate[0]["price"])
+            quotes.append({
+                **result,
+                "route_schedule_id": route_schedule_id,
+                "price": quote["price"],
+                "base_price": quote["base_price"],
+                "estimated": quote["load"] is None
+            })
+        return quotes
+
+    def stats(self) -> dict:
+        lookups = max(self.hits + self.misses, 1)
+        return {
+            "departures_priced": len(self.table),
+            "refreshed_at": self.refreshed_at,
+            "refresh_seconds": self.refresh_seconds,
+            "horizon_days": self.horizon_days,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4)
+        }
@@ -0,0 +1,87 @@
+"""In-process cache of authenticated principals.
+
+``get_current_user`` resolves the token subject to a user document on every
+authenticated request. This TTL/LRU cache keeps recent principals so that in
+steady state auth needs no Mongo round trip. Cached documents never include
+the password hash. Writes to a user (profile, password, permissions)
+invalidate their entry in this process. Other workers pick up the change
+when their entry's TTL expires.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+# Fields never loaded into a principal
+PRINCIPAL_PROJECTION = {"password": 0}
+
+
+class PrincipalCache:
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_size: int = PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, principal = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # Callers get their own copy so request handlers cannot mutate the cache
+        return dict(principal)
+
+    def set(self, key: str, principal: dict):
+        principal = {k: v for k, v in principal.items() if k not in PRINCIPAL_PROJECTION}
+        self._entries[key] = (time.monotonic() + self.ttl, principal)
+        self._entries.move_to_end(key)
+        self._keys_by_user.setdefault(str(principal["_id"]), set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def invalidate_user(self, user_id):
+        """Drop every cached entry for a user, whatever subject it was cached under"""
+        for key in self._keys_by_user.pop(str(user_id), set()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = str(entry[1]["_id"])
+        keys = self._keys_by_user.get(user_id)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+    def stats(self) -> dict:
+        lookups = max(self.hits + self.misses, 1)
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4)
+        }
@@ -0,0 +1,225 @@
+"""Token-bucket rate limiting for abuse-prone endpoints.
+
+Policies match a method and path prefix and key their bucket by client IP,
+authenticated user, or the endpoint as a whole. ``RateLimitMiddleware``
+checks them before routing. Rejected requests get a 429 with
+``Retry-After`` and never reach bcrypt, Mongo or the handler.
+
+The default backend keeps buckets in memory, split across shards that each
+have their own lock and LRU bound. That makes limits per worker. Set
+``RATE_LIMIT_BACKEND=mongo`` to share buckets across workers through one
+atomic pipeline update per check, at the cost of a Mongo round trip.
+
+Clients listed in ``RATE_LIMIT_EXEMPT_IPS`` (load generators, health
+checkers) bypass every policy.
+"""
+import os
+import time
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Honour X-Forwarded-For only behind a proxy that sets it
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() in ("1", "true", "yes")
+RATE_LIMIT_EXEMPT_IPS = frozenset(ip.strip() for ip in os.getenv("RATE_LIMIT_EXEMPT_IPS", "").split(",") if ip.strip())
+
+KEY_IP = "ip"
+KEY_USER = "user"
+KEY_ENDPOINT = "endpoint"
+
+
+@dataclass(frozen=True)
+class RatePolicy:
+    name: str
+    method: str
+    path_prefix: str
+    key: str
+    rate: float  # tokens refilled per second
+    burst: int
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and path.startswith(self.path_prefix)
+
+
+DEFAULT_POLICIES = [
+    # Every login attempt costs a bcrypt verification
+    RatePolicy("login-ip", "POST", "/api/auth/login", KEY_IP, rate=10 / 60, burst=10),
+    RatePolicy("login-global", "POST", "/api/auth/login", KEY_ENDPOINT, rate=50, burst=100),
+    RatePolicy("register-ip", "POST", "/api/auth/register", KEY_IP, rate=5 / 60, burst=5),
+    RatePolicy("refresh-ip", "POST", "/api/auth/refresh", KEY_IP, rate=1, burst=20),
+    RatePolicy("search-ip", "POST", "/api/search", KEY_IP, rate=2, burst=20),
+    RatePolicy("search-user", "POST", "/api/search", KEY_USER, rate=5, burst=30),
+    # One request can ask for up to MAX_QUOTE_BATCH quotes
+    RatePolicy("quotes-ip", "POST", "/api/pricing/quotes", KEY_IP, rate=1, burst=10),
+]
+
+
+class MemoryBackend:
+    """Buckets in this process, sharded by key hash with a per-shard LRU bound"""
+
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.shards = [OrderedDict() for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.max_keys_per_shard = max(1, max_keys // shards)
+
+    async def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> Tuple[bool, float]:
+        """Consume cost tokens; returns (allowed, seconds until enough tokens)"""
+        index = zlib.crc32(key.encode()) % len(self.shards)
+        shard = self.shards[index]
+        now = time.monotonic()
+        with self.locks[index]:
+            tokens, updated = shard.get(key, (float(burst), now))
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            shard[key] = (tokens, now)
+            shard.move_to_end(key)
+            while len(shard) > self.max_keys_per_shard:
+                shard.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "shards": len(self.shards), "keys": sum(len(shard) for shard in self.shards)}
+
+
+class MongoBackend:
+    """Buckets shared by all workers, refilled and spent in one atomic update"""
+
+    def __init__(self, db, collection: str = "rate_limits"):
+        self.collection = db[collection]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> Tuple[bool, float]:
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    # An idle bucket is full again after burst / rate seconds
+                    "expires_at": now + timedelta(seconds=burst / rate)
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (cost - bucket["tokens"]) / rate
+
+    def stats(self) -> dict:
+        return {"backend": "mongo", "collection": self.collection.name}
+
+
+class RateLimiter:
+    def __init__(self, backend, policies: List[RatePolicy] = DEFAULT_POLICIES):
+        self.backend = backend
+        self.policies = policies
+        self.rejected = {}
+
+    async def check(self, method: str, path: str, client_ip: str,
+                    identify_user: Callable[[], Optional[str]]) -> Optional[float]:
+        """None when allowed, otherwise seconds the client should wait.
+
+        identify_user is only called, at most once, when a per-user policy matches.
+        """
+        user_id = None
+        identified = False
+        for policy in self.policies:
+            if not policy.matches(method, path):
+                continue
+            if policy.key == KEY_IP:
+                subject = client_ip
+            elif policy.key == KEY_USER:
+                if not identified:
+                    user_id, identified = identify_user(), True
+                if not user_id:
+                    continue
+                subject = user_id
+            else:
+                subject = "*"
+
+            try:
+                allowed, retry_after = await self.backend.take(f"{policy.name}:{subject}", policy.rate, policy.burst)
+            except Exception as e:
+                # A broken shared backend must not take the endpoints down with it
+                logger.error(f"Rate limit backend failed for {policy.name}: {e}")
+                continue
+            if not allowed:
+                self.rejected[policy.name] = self.rejected.get(policy.name, 0) + 1
+                return retry_after
+        return None
+
+    def stats(self) -> dict:
+        return {**self.backend.stats(), "rejected": dict(self.rejected)}
+
+
+def rate_limiter_from_env(db) -> RateLimiter:
+    if RATE_LIMIT_BACKEND == "mongo":
+        return RateLimiter(MongoBackend(db))
+    if RATE_LIMIT_BACKEND != "memory":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND {RATE_LIMIT_BACKEND!r}, using memory")
+    return RateLimiter(MemoryBackend())
+
+
+def client_ip(scope: dict) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode().split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying a RateLimiter before the request is routed"""
+
+    def __init__(self, app, limiter: RateLimiter, identify_user: Callable[[dict], Optional[str]], enabled: bool = RATE_LIMIT_ENABLED,
+                 exempt_ips: frozenset = RATE_LIMIT_EXEMPT_IPS):
+        self.app = app
+        self.limiter = limiter
+        self.identify_user = identify_user
+        self.enabled = enabled
+        self.exempt_ips = exempt_ips
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        ip = client_ip(scope)
+        if ip in self.exempt_ips:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = await self.limiter.check(scope["method"], scope["path"], ip, lambda: self.identify_user(scope))
+        if retry_after is None:
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse(
+            status_code=429,
+            content={"detail": "Too many requests, please slow down"},
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,291 @@
+"""Push-based operations dashboard counters.
+
+Each worker runs one ``RealtimeFeed``. It loads a snapshot once (today's
+rollup plus two bounded counts) and then tails ``booking_events`` from the
+live end of the log. Every event becomes a small counter delta that is
+applied to the snapshot and fanned out to subscribers. Ops screens hold a
+server-sent-events stream: they get the snapshot on connect and then only
+deltas and alerts, so adding a screen adds no queries at all.
+
+Time-driven figures (departures boarding now, upcoming paid bookings) are
+recomputed once per tick per worker, whatever the number of screens, and
+pushed only when they change. The snapshot is reloaded at local midnight
+and every FEED_RESYNC_SECONDS to absorb any drift. The rollup lags the
+event log, so a reload replays the events between the rollup's watermark
+and the live end into the day counters before tailing resumes from the
+live end. A subscriber that falls FEED_QUEUE_SIZE messages behind is sent
+a fresh snapshot instead of the backlog.
+"""
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+from booking_events import (
+    BOOKING_CREATED, BOOKING_PAID, BOOKING_CANCELLED, BOOKING_EXPIRED, BOOKING_REFUNDED,
+    EventConsumer
+)
+from booking_holds import SEAT_BLOCKING_STATUSES
+from daily_rollups import read_rollup_at, net_revenue
+from dashboard_stats import bounded_count, gather_stats
+from departures import local_day_bounds, local_today, to_local
+
+logger = logging.getLogger(__name__)
+
+FEED_TICK_SECONDS = float(os.getenv("FEED_TICK_SECONDS", "30"))
+FEED_RESYNC_SECONDS = float(os.getenv("FEED_RESYNC_SECONDS", "300"))
+FEED_HEARTBEAT_SECONDS = 15.0
+FEED_QUEUE_SIZE = 256
+BOARDING_WINDOW_MINUTES = int(os.getenv("BOARDING_WINDOW_MINUTES", "30"))
+MAX_ALERTS = 20
+# Cancellations within CANCELLATION_WINDOW that raise an alert
+CANCELLATION_BURST = 5
+CANCELLATION_WINDOW = timedelta(minutes=10)
+# Counters loaded from the day rollup rather than counted live
+ROLLUP_COUNTERS = {"bookings_today", "revenue_today", "seats_sold_today", "cancellations_today", "expired_holds_today"}
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def event_deltas(event: dict, today: str, now: datetime) -> dict:
+    """Counter changes one booking event makes to the dashboard"""
+    data = event.get("data", {})
+    on_today = to_local(event["created_at"]).strftime("%Y-%m-%d") == today
+    departs_later = data.get("departure_at") is not None and data["departure_at"] >= now
+    seats = data.get("seat_count", 0)
+    deltas = {}
+    if event["type"] == BOOKING_CREATED and on_today:
+        deltas["bookings_today"] = 1
+    elif event["type"] == BOOKING_PAID:
+        if on_today:
+            deltas["revenue_today"] = data.get("amount", data.get("total_price", 0))
+            deltas["seats_sold_today"] = seats
+        if departs_later:
+            deltas["active_bookings"] = 1
+    elif event["type"] == BOOKING_CANCELLED:
+        if on_today:
+            deltas["cancellations_today"] = 1
+        if departs_later and data.get("previous_status") == "paid":
+            deltas["active_bookings"] = -1
+    elif event["type"] == BOOKING_EXPIRED and on_today:
+        deltas["expired_holds_today"] = 1
+    elif event["type"] == BOOKING_REFUNDED and on_today:
+        deltas["revenue_today"] = -data.get("amount", data.get("total_price", 0))
+    return deltas
+
+
+class RealtimeFeed:
+    def __init__(self, db, tick: float = FEED_TICK_SECONDS):
+        self.db = db
+        self.tick = tick
+        self.consumer = EventConsumer(db, "realtime_feed")
+        self.state: Optional[dict] = None
+        self.alerts = deque(maxlen=MAX_ALERTS)
+        self._cancellations = deque()
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._tasks = []
+        self._loaded_at: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._tail()), asyncio.create_task(self._ticker())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def snapshot(self) -> dict:
+        if self.state is None:
+            await self._reload()
+        return {**self.state, "alerts": list(self.alerts), "last_updated": datetime.utcnow()}
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=FEED_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    async def stream(self):
+        """SSE body: a snapshot, then deltas and alerts as they happen"""
+        queue = self.subscribe()
+        try:
+            yield format_sse("snapshot", await self.snapshot())
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event == "resync":
+                    event, data = "snapshot", await self.snapshot()
+                yield format_sse(event, data)
+        finally:
+            self.unsubscribe(queue)
+
+    def _publish(self, event: str, data: dict):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                # Too far behind for deltas to be worth replaying
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("resync", {}))
+
+    def _apply(self, deltas: dict, seq: Optional[int] = None):
+        if not deltas:
+            return
+        for name, value in deltas.items():
+            self.state[name] = round(self.state.get(name, 0) + value, 2)
+        self._publish("delta", {"seq": seq, "deltas": deltas})
+
+    def _alert(self, kind: str, message: str, priority: str):
+        alert = {"type": kind, "message": message, "priority": priority, "at": datetime.utcnow()}
+        self.alerts.appendleft(alert)
+        self._publish("alert", alert)
+
+    async def _live_end(self) -> int:
+        counter = await self.db.counters.find_one({"_id": "booking_events"})
+        return counter["seq"] if counter else 0
+
+    async def _reload(self):
+        async with self._lock:
+            now = datetime.utcnow()
+            today = local_today()
+            live_end = await self._live_end()
+            stats, partial = await gather_stats({
+                "today": read_rollup_at(self.db, today),
+                "active_bookings": bounded_count(self.db.bookings, {"status": "paid", "departure_at": {"$gte": now}}),
+                "active_vehicles": bounded_count(self.db.vehicles, {"is_active": True}),
+                "boarding": self._boarding(now)
+            })
+            counters, watermark = stats["today"] or ({}, live_end)
+            boarding = stats["boarding"] or {}
+            self.state = {
+                "date": today,
+                "bookings_today": counters.get("bookings_created", 0),
+                "revenue_today": net_revenue(counters),
+                "seats_sold_today": counters.get("seats_sold", 0),
+                "cancellations_today": counters.get("bookings_cancelled", 0),
+                "expired_holds_today": counters.get("bookings_expired", 0),
+                "active_bookings": stats["active_bookings"] or 0,
+                "active_vehicles": stats["active_vehicles"] or 0,
+                "departures_boarding": boarding.get("departures", 0),
+                "passengers_boarding": boarding.get("passengers", 0),
+                "partial": partial
+            }
+            await self._catch_up(watermark, live_end, today, now)
+            # Anything later reaches the state through the tail
+            self.consumer.position = live_end
+            self._loaded_at = now
+
+    async def _catch_up(self, watermark: int, live_end: int, today: str, now: datetime):
+        """Add events the rollup has not applied yet to the day counters"""
+        if watermark >= live_end:
+            return
+        cursor = self.db.booking_events.find({
+            "seq": {"$gt": watermark, "$lte": live_end},
+            "created_at": {"$gte": local_day_bounds(today)[0]}
+        }).sort("seq", 1)
+        async for event in cursor:
+            for name, value in event_deltas(event, today, now).items():
+                if name in ROLLUP_COUNTERS:
+                    self.state[name] = round(self.state.get(name, 0) + value, 2)
+
+    async def _boarding(self, now: datetime) -> dict:
+        """Departures leaving within the boarding window that have seated passengers"""
+        rows = await self.db.bookings.aggregate([
+            {"$match": {
+                "departure_at": {"$gte": now, "$lt": now + timedelta(minutes=BOARDING_WINDOW_MINUTES)},
+                "status": {"$in": SEAT_BLOCKING_STATUSES}
+            }},
+            {"$group": {"_id": {"route_id": "$route_id", "departure_at": "$departure_at"},
+                        "passengers": {"$sum": {"$size": {"$ifNull": ["$seats", []]}}}}}
+        ]).to_list(length=None)
+        return {"departures": len(rows), "passengers": sum(row["passengers"] for row in rows)}
+
+    async def _tail(self):
+        """Apply booking events as they are appended; the position lives in memory only"""
+        while True:
+            try:
+                if self.state is None:
+                    await self._reload()
+                events = await self.consumer.poll()
+                if events:
+                    async with self._lock:
+                        now = datetime.utcnow()
+                        # A reload while polling may already cover some of these
+                        for event in events:
+                            if event["seq"] <= self.consumer.position:
+                                continue
+                            self._apply(event_deltas(event, self.state["date"], now), event["seq"])
+                            self._watch(event, now)
+                            self.consumer.position = event["seq"]
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Realtime feed failed: {e}")
+            await asyncio.sleep(0.5)
+
+    def _watch(self, event: dict, now: datetime):
+        data = event.get("data", {})
+        if event["type"] == BOOKING_REFUNDED:
+            amount = data.get("amount", data.get("total_price", 0))
+            self._alert("refund", f"Refund of ${amount} issued for booking {data.get('booking_reference')}", "medium")
+        elif event["type"] == BOOKING_CANCELLED:
+            self._cancellations.append(now)
+            while self._cancellations and now - self._cancellations[0] > CANCELLATION_WINDOW:
+                self._cancellations.popleft()
+            if len(self._cancellations) == CANCELLATION_BURST:
+                minutes = int(CANCELLATION_WINDOW.total_seconds() // 60)
+                self._alert("cancellations", f"{CANCELLATION_BURST} cancellations in the last {minutes} minutes", "high")
+
+    async def _ticker(self):
+        """Refresh time-driven figures, push what changed, reload at midnight or on schedule"""
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                if self.state is None:
+                    continue
+                now = datetime.utcnow()
+                if local_today() != self.state["date"] or (now - self._loaded_at).total_seconds() >= FEED_RESYNC_SECONDS:
+                    await self._reload()
+                    self._publish("resync", {})
+                    continue
+
+                stats, _ = await gather_stats({
+                    "active_bookings": bounded_count(self.db.bookings, {"status": "paid", "departure_at": {"$gte": now}}),
+                    "boarding": self._boarding(now)
+                })
+                current = {"active_bookings": stats["active_bookings"]}
+                if stats["boarding"] is not None:
+                    current["departures_boarding"] = stats["boarding"]["departures"]
+                    current["passengers_boarding"] = stats["boarding"]["passengers"]
+                self._apply({
+                    name: value - self.state.get(name, 0)
+                    for name, value in current.items()
+                    if value is not None and value != self.state.get(name, 0)
+                })
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Realtime feed tick failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "position": self.consumer.position,
+            "loaded_at": self._loaded_at,
+            "alerts": len(self.alerts)
+        }
@@ -0,0 +1,240 @@
+"""Payment reconciliation.
+
+Streams ``bookings`` (sorted by _id) and ``payments`` (sorted by booking_id)
+side by side and merge-joins them, so memory stays at one cursor batch per
+collection regardless of size. Booking ids are compared as hex strings, which
+sort in the same order as the ObjectIds themselves.
+
+A full run covers everything. An incremental run only re-checks bookings
+touched since the last checkpoint: ids from booking_events plus payments
+created after the previous run started. Mismatches are upserted into
+``reconciliation_mismatches`` per (run, booking, kind).
+"""
+import sys
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+from booking_events import EventConsumer
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+AMOUNT_TOLERANCE = 0.005
+CONSUMER_NAME = "reconciliation"
+
+BOOKING_FIELDS = {"status": 1, "total_price": 1, "transaction_id": 1, "refund_status": 1}
+PAYMENT_FIELDS = {"booking_id": 1, "amount": 1, "status": 1, "transaction_id": 1}
+
+
+async def ensure_reconciliation_indexes(db):
+    await db.payments.create_index([("booking_id", 1), ("created_at", 1)])
+    await db.payments.create_index("created_at")
+    await db.reconciliation_mismatches.create_index([("run_id", 1), ("booking_id", 1), ("kind", 1)], unique=True)
+
+
+def compare(booking_id: str, booking: Optional[dict], payments: List[dict]) -> List[Tuple[str, dict]]:
+    """Return (kind, details) for every disagreement between a booking and its payments"""
+    if booking is None:
+        if any(p.get("status") == "completed" for p in payments):
+            return [("orphan_payment", {"payment_ids": [str(p["_id"]) for p in payments]})]
+        return []
+
+    status = booking.get("status")
+    completed = [p for p in payments if p.get("status") == "completed"]
+    issues = []
+
+    if status == "paid" and not completed:
+        issues.append(("missing_payment", {"booking_status": status}))
+    if completed and status not in ("paid", "confirmed") and not booking.get("refund_status"):
+        issues.append(("status_mismatch", {"booking_status": status, "payment_status": "completed"}))
+    if len(completed) > 1:
+        issues.append(("duplicate_payment", {"payment_ids": [str(p["_id"]) for p in completed]}))
+
+    if completed:
+        paid = round(sum(p.get("amount") or 0 for p in completed), 2)
+        expected = round(booking.get("total_price") or 0, 2)
+        if abs(paid - expected) > AMOUNT_TOLERANCE:
+            issues.append(("amount_mismatch", {"booking_total": expected, "paid_total": paid}))
+
+        transaction_id = booking.get("transaction_id")
+        if transaction_id and transaction_id not in {p.get("transaction_id") for p in completed}:
+            issues.append(("transaction_mismatch", {
+                "booking_transaction_id": transaction_id,
+                "payment_transaction_ids": [p.get("transaction_id") for p in completed]
+            }))
+
+    return issues
+
+
+async def _grouped_payments(cursor) -> AsyncIterator[Tuple[str, List[dict]]]:
+    """Group a booking_id-sorted payments cursor into (booking_id, payments)"""
+    current_id, group = None, []
+    async for payment in cursor:
+        booking_id = str(payment.get("booking_id"))
+        if booking_id != current_id and group:
+            yield current_id, group
+            group = []
+        current_id = booking_id
+        group.append(payment)
+    if group:
+        yield current_id, group
+
+
+async def _keyed_bookings(cursor) -> AsyncIterator[Tuple[str, dict]]:
+    async for booking in cursor:
+        yield str(booking["_id"]), booking
+
+
+async def merge_join(bookings: AsyncIterator, payments: AsyncIterator) -> AsyncIterator[Tuple[str, Optional[dict], List[dict]]]:
+    """Walk both sorted streams once, yielding (booking_id, booking, payments)"""
+    booking_item = await anext(bookings, None)
+    payment_item = await anext(payments, None)
+
+    while booking_item or payment_item:
+        if payment_item is None or (booking_item and booking_item[0] < payment_item[0]):
+            yield booking_item[0], booking_item[1], []
+            booking_item = await anext(bookings, None)
+        elif booking_item is None or payment_item[0] < booking_item[0]:
+            yield payment_item[0], None, payment_item[1]
+            payment_item = await anext(payments, None)
+        else:
+            yield booking_item[0], booking_item[1], payment_item[1]
+            booking_item = await anext(bookings, None)
+            payment_item = await anext(payments, None)
+
+
+class MismatchWriter:
+    """Buffers mismatch upserts into bulk writes"""
+
+    def __init__(self, db, run_id):
+        self.db = db
+        self.run_id = run_id
+        self.operations = []
+        self.counts = {}
+
+    async def add(self, booking_id: str, issues: List[Tuple[str, dict]]):
+        for kind, details in issues:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            key = {"run_id": self.run_id, "booking_id": booking_id, "kind": kind}
+            self.operations.append(UpdateOne(
+                key,
+                {"$set": {**key, "details": details, "detected_at": datetime.utcnow()}},
+                upsert=True
+            ))
+        if len(self.operations) >= BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if self.operations:
+            await self.db.reconciliation_mismatches.bulk_write(self.operations, ordered=False)
+            self.operations = []
+
+
+async def _reconcile_stream(db, writer: MismatchWriter, booking_query: dict, payment_query: dict) -> int:
+    bookings = db.bookings.find(booking_query, BOOKING_FIELDS).sort("_id", 1).batch_size(BATCH_SIZE)
+    payments = db.payments.find(payment_query, PAYMENT_FIELDS).sort([("booking_id", 1), ("created_at", 1)]).batch_size(BATCH_SIZE)
+
+    checked = 0
+    async for booking_id, booking, booking_payments in merge_join(_keyed_bookings(bookings), _grouped_payments(payments)):
+        checked += 1
+        issues = compare(booking_id, booking, booking_payments)
+        if issues:
+            await writer.add(booking_id, issues)
+    return checked
+
+
+async def _reconcile_ids(db, writer: MismatchWriter, booking_ids: set) -> int:
+    """Merge-join only the given bookings (one bounded chunk)"""
+    object_ids = []
+    for booking_id in booking_ids:
+        try:
+            object_ids.append(ObjectId(booking_id))
+        except (InvalidId, TypeError):
+            continue
+    return await _reconcile_stream(
+        db, writer,
+        {"_id": {"$in": object_ids}},
+        {"booking_id": {"$in": list(booking_ids)}}
+    )
+
+
+async def run_reconciliation(db, incremental: bool = True) -> dict:
+    """Run a reconciliation pass and store its summary in reconciliation_runs"""
+    started_at = datetime.utcnow()
+    previous = await db.reconciliation_runs.find_one({"status": "completed"}, sort=[("started_at", -1)])
+    if previous is None:
+        incremental = False
+
+    run = {"started_at": started_at, "mode": "incremental" if incremental else "full", "status": "running"}
+    run_id = (await db.reconciliation_runs.insert_one(run)).inserted_id
+    writer = MismatchWriter(db, run_id)
+    consumer = EventConsumer(db, CONSUMER_NAME, batch_size=BATCH_SIZE)
+
+    try:
+        if incremental:
+            checked = 0
+            # Bookings changed since the last checkpoint, one event batch at a time
+            while True:
+                events = await consumer.poll()
+                if not events:
+                    break
+                checked += await _reconcile_ids(db, writer, {e["booking_id"] for e in events})
+                await consumer.commit(events)
+
+            # Payments written without a booking state change (declines, refunds, webhooks)
+            chunk = set()
+            cursor = db.payments.find({"created_at": {"$gte": previous["started_at"]}}, {"booking_id": 1}).batch_size(BATCH_SIZE)
+            async for payment in cursor:
+                chunk.add(str(payment.get("booking_id")))
+                if len(chunk) >= BATCH_SIZE:
+                    checked += await _reconcile_ids(db, writer, chunk)
+                    chunk = set()
+            if chunk:
+                checked += await _reconcile_ids(db, writer, chunk)
+        else:
+            counter = await db.counters.find_one({"_id": "booking_events"})
+            checkpoint = counter["seq"] if counter else 0
+            # Only string booking_ids sort consistently with the booking _id stream
+            checked = await _reconcile_stream(db, writer, {}, {"booking_id": {"$type": "string"}})
+            await consumer.commit([{"seq": checkpoint}])
+
+        await writer.flush()
+    except Exception as e:
+        await db.reconciliation_runs.update_one(
+            {"_id": run_id},
+            {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()}}
+        )
+        raise
+
+    summary = {
+        "status": "completed",
+        "checked": checked,
+        "mismatches": writer.counts,
+        "finished_at": datetime.utcnow()
+    }
+    await db.reconciliation_runs.update_one({"_id": run_id}, {"$set": summary})
+    logger.info(f"Reconciliation {run['mode']} run checked {checked} bookings, mismatches: {writer.counts}")
+    return {"run_id": str(run_id), "mode": run["mode"], "started_at": started_at, **summary}
+
+
+def register_reconciliation_jobs(queue, db):
+    @queue.handler("reconcile_payments")
+    async def reconcile_payments(payload: dict):
+        await run_reconciliation(db, incremental=payload.get("incremental", True))
+
+
+if __name__ == "__main__":
+    from server import db
+
+    async def main():
+        await ensure_reconciliation_indexes(db)
+        summary = await run_reconciliation(db, incremental="--full" not in sys.argv)
+        print(summary)
+
+    asyncio.run(main())
@@ -1,10 +1,11 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from contextlib import asynccontextmanager
 import os
+import json
 from datetime import datetime, timedelta
 from typing import Optional, List
 import jwt
@@ -12,7 +13,8 @@ from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
 from bson import ObjectId
 from bson.errors import InvalidId
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 import logging
@@ -20,6 +22,42 @@ from pathlib import Path
 from dotenv import load_dotenv
 import random
 
+from departures import (
+    SCHEDULE_TIMES, to_departure_at, schedule_slot, local_day_bounds, local_today,
+    ensure_departure_indexes, backfill_departure_times
+)
+from job_queue import JobQueue, QueueFullError
+from booking_pipeline import register_booking_jobs, booking_created_jobs, payment_completed_jobs
+from idempotency import IdempotencyStore
+from booking_holds import HoldSweeper, ensure_hold_indexes, hold_expiry, hold_expired, seats_taken_filter
+from booking_events import (
+    BOOKING_CREATED, BOOKING_PAID, BOOKING_CANCELLED,
+    append_event, booking_snapshot, ensure_event_indexes
+)
+from transactions import run_in_transaction
+from payment_gateway import GatewayUnavailable, gateway_from_env
+from reconciliation import ensure_reconciliation_indexes, register_reconciliation_jobs
+from payment_webhooks import InvalidSignature, SUPPORTED_EVENTS, register_webhook_jobs, verify_signature
+from password_hashing import PasswordHasher, PasswordHasherBusy
+from principal_cache import PrincipalCache, PRINCIPAL_PROJECTION
+from auth_sessions import SessionStore, InvalidRefreshToken
+from daily_rollups import (
+    RollupUpdater, ensure_rollup_indexes, read_rollup, window_start, net_revenue,
+    vehicle_operators, booking_operator, top_routes
+)
+from dashboard_stats import bounded_count, estimated_count, gather_stats
+from analytics_cache import AnalyticsCache
+from catalog_cache import CatalogCache
+from occupancy import OccupancyRequestError, compute_occupancy
+from cohorts import CohortRefresher
+from realtime_feed import RealtimeFeed
+from pricing import MAX_QUOTE_BATCH, PricingEngine
+from exports import DATASETS, FORMATS, ExportUnavailable, arrow_schema, export_query, format_watermark, stream_export
+from rate_limiting import RateLimitMiddleware, rate_limiter_from_env
+from access_control import (
+    ADMIN_EMAILS, ROLES, admin_email_filter, compile_permissions, has_permissions, is_admin_email, permission_mask
+)
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -30,19 +68,62 @@ logger = logging.getLogger(__name__)
 # JWT Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
 
-# Password hashing
+# Password hashing (bcrypt runs on a bounded thread pool, not the event loop)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(pwd_context)
 
 # Database
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 client = AsyncIOMotorClient(MONGO_URL)
 db = client.busticket_db
 
+# Background jobs (tickets, notifications, stats) run off the request path
+job_queue = JobQueue(db)
+register_booking_jobs(job_queue, db)
+register_reconciliation_jobs(job_queue, db)
+register_webhook_jobs(job_queue, db)
+
+# Stored first responses for retried POSTs carrying an Idempotency-Key
+idempotency_store = IdempotencyStore(db)
+
+# Releases seats held by bookings that were never paid
+hold_sweeper = HoldSweeper(db)
+
+# Folds booking events into pre-summed daily dashboard counters
+rollup_updater = RollupUpdater(db)
+
+# Folds each closed month into the signup cohort summaries
+cohort_refresher = CohortRefresher(db)
+
+# Pushes ops dashboard counter deltas to streaming subscribers
+realtime_feed = RealtimeFeed(db)
+
+# Demand-driven fares for upcoming departures, refreshed in the background
+pricing_engine = PricingEngine(db, SECRET_KEY)
+
+# Serves admin analytics widgets stale-while-revalidate
+analytics_cache = AnalyticsCache()
+
+# Route names for analytics rows, resolved in bulk
+catalog_cache = CatalogCache()
+
+# Payment provider (PAYMENT_GATEWAY, defaults to the local simulator)
+payment_gateway = gateway_from_env()
+
 # Security
 security = HTTPBearer()
 
+# Recently authenticated users, so steady-state auth skips the users lookup
+principal_cache = PrincipalCache()
+
+# Refresh token rotation and logout, checked against an in-memory revocation filter
+session_store = SessionStore(db, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES), SECRET_KEY)
+
+# Token buckets for login, register and search (RATE_LIMIT_BACKEND=memory|mongo)
+rate_limiter = rate_limiter_from_env(db)
+
 # Pydantic Models (keeping existing models)
 class UserBase(BaseModel):
     email: EmailStr
@@ -65,6 +146,11 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class SearchRequest(BaseModel):
     origin: str
@@ -81,6 +167,7 @@ class RouteResponse(BaseModel):
     arrival_time: str
     duration: str
     price: float
+    price_token: Optional[str] = None
     vehicle_type: str
     company: str
     amenities: List[str]
@@ -98,6 +185,8 @@ class BookingRequest(BaseModel):
     selected_seats: List[str]
     passenger_details: List[dict]
     date: str
+    # From search or the seat map; holds the booking to the fare shown
+    price_token: Optional[str] = None
 
 class BookingResponse(BaseModel):
     id: str
@@ -109,12 +198,20 @@ class BookingResponse(BaseModel):
     total_price: float
     status: str
     created_at: datetime
+    expires_at: Optional[datetime] = None
 
 class PaymentRequest(BaseModel):
     booking_id: str
     payment_method: str
     card_details: Optional[dict] = None
 
+class QuoteItem(BaseModel):
+    route_id: str
+    date: str
+
+class QuoteBatchRequest(BaseModel):
+    items: List[QuoteItem]
+
 # Helper Functions
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -126,14 +223,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+def create_user_access_token(user: dict, sid: Optional[str] = None, expires_delta: Optional[timedelta] = None):
+    """Access token carrying the user id, role, compiled permissions and session id"""
+    claims = {
+        "sub": str(user["_id"]),
+        "email": user["email"],
+        "role": user.get("role", "passenger"),
+        "perm": compile_permissions(user)
+    }
+    if sid:
+        claims["sid"] = sid
+    return create_access_token(data=claims, expires_delta=expires_delta)
+
+def issue_tokens(user: dict, sid: str, refresh_token: str) -> dict:
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    return {
+        "access_token": create_user_access_token(user, sid=sid, expires_delta=access_token_expires),
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": int(access_token_expires.total_seconds())
+    }
+
+def decode_access_token(token: str) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -141,25 +258,106 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+        if payload.get("sub") is None:
             raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
-    
-    user = await db.users.find_one({"email": username})
+    return payload
+
+async def verify_access_token(token: str) -> dict:
+    """Decode a token and reject it if its session was logged out"""
+    payload = decode_access_token(token)
+    sid = payload.get("sid")
+    if sid and await session_store.is_revoked(sid):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Session has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return payload
+
+async def load_principal(subject: str) -> dict:
+    """Resolve a token subject (user id, or email for older tokens) to a cached user document"""
+    user = principal_cache.get(subject)
     if user is None:
-        raise credentials_exception
+        query = {"_id": ObjectId(subject)} if ObjectId.is_valid(subject) else {"email": subject}
+        user = await db.users.find_one(query, PRINCIPAL_PROJECTION)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        user["permission_mask"] = compile_permissions(user)
+        principal_cache.set(subject, user)
     return user
 
+def rate_limit_subject(scope: dict) -> Optional[str]:
+    """User id from a valid bearer token, for per-user limits (no revocation check or DB lookup)"""
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode().partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            except jwt.PyJWTError:
+                return None
+    return None
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Full user document (without password) for handlers that need profile fields"""
+    payload = await verify_access_token(credentials.credentials)
+    return await load_principal(payload["sub"])
+
+async def get_current_principal(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Identity from verified token claims, without a database lookup"""
+    payload = await verify_access_token(credentials.credentials)
+    subject = payload["sub"]
+    if ObjectId.is_valid(subject) and "perm" in payload:
+        return {
+            "_id": ObjectId(subject),
+            "email": payload.get("email"),
+            "role": payload["role"],
+            "permission_mask": payload["perm"],
+            "sid": payload.get("sid")
+        }
+    # Older tokens lack the claims; resolve (and compile permissions) from the user document
+    return await load_principal(subject)
+
+def require_permissions(*names: str):
+    """Dependency that admits principals holding every named permission"""
+    required = permission_mask(names)
+
+    async def guard(current_user: dict = Depends(get_current_principal)):
+        if not has_permissions(current_user.get("permission_mask", 0), required):
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
+        return current_user
+
+    return guard
+
 # Startup event
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize database collections and indexes
     await init_database()
+    job_queue.start()
+    hold_sweeper.start()
+    session_store.start()
+    rollup_updater.start()
+    cohort_refresher.start()
+    realtime_feed.start()
+    pricing_engine.start()
     yield
     # Cleanup
-    pass
+    await pricing_engine.stop()
+    await realtime_feed.stop()
+    await cohort_refresher.stop()
+    await rollup_updater.stop()
+    await session_store.stop()
+    await hold_sweeper.stop()
+    await job_queue.stop()
+    password_hasher.shutdown()
 
 async def init_database():
     """Initialize database with sample data"""
@@ -167,6 +365,26 @@ async def init_database():
     await db.users.create_index("email", unique=True)
     await db.bookings.create_index("booking_reference", unique=True)
     await db.routes.create_index([("origin", 1), ("destination", 1)])
+    await ensure_departure_indexes(db)
+    await job_queue.ensure_indexes()
+    await idempotency_store.ensure_indexes()
+    await ensure_hold_indexes(db)
+    await ensure_event_indexes(db)
+    await ensure_reconciliation_indexes(db)
+    await session_store.ensure_indexes()
+    await ensure_rollup_indexes(db)
+    if hasattr(rate_limiter.backend, "ensure_indexes"):
+        await rate_limiter.backend.ensure_indexes()
+    
+    # Bootstrap administrators named in ADMIN_EMAILS
+    if ADMIN_EMAILS:
+        await db.users.update_many(
+            {**admin_email_filter(), "role": {"$ne": "admin"}},
+            {"$set": {"role": "admin"}, "$inc": {"permission_version": 1}}
+        )
+    
+    # Migrate bookings created before departure_at existed
+    await backfill_departure_times(db)
     
     # Insert sample data if collections are empty
     if await db.routes.count_documents({}) == 0:
@@ -270,6 +488,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Rate limits run inside CORS so 429 responses still carry CORS headers
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, identify_user=rate_limit_subject)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -279,6 +500,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many sign-in attempts in progress, please retry"},
+        headers={"Retry-After": "2"}
+    )
+
 # Include management router
 try:
     import sys
@@ -308,7 +537,7 @@ async def register(user: UserCreate):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_dict = {
         "email": user.email,
         "first_name": user.first_name,
@@ -318,6 +547,8 @@ async def register(user: UserCreate):
         "created_at": datetime.utcnow(),
         "is_active": True
     }
+    if is_admin_email(user.email):
+        user_dict["role"] = "admin"
     
     result = await db.users.insert_one(user_dict)
     user_dict["id"] = str(result.inserted_id)
@@ -328,20 +559,60 @@ async def register(user: UserCreate):
 async def login(user: UserLogin):
     # Find user
     db_user = await db.users.find_one({"email": user.email})
-    if not db_user or not verify_password(user.password, db_user["password"]):
+    if not db_user or not await verify_password(user.password, db_user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Create access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": db_user["email"]}, expires_delta=access_token_expires
-    )
+    # ADMIN_EMAILS added after the account was created take effect on next sign-in
+    if is_admin_email(db_user["email"]) and db_user.get("role") != "admin":
+        db_user = await db.users.find_one_and_update(
+            {"_id": db_user["_id"]},
+            {"$set": {"role": "admin"}, "$inc": {"permission_version": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        principal_cache.invalidate_user(db_user["_id"])
+    
+    # Start a session: short-lived access token plus a rotating refresh token
+    sid, refresh_token = await session_store.start_session(db_user["_id"])
+    return issue_tokens(db_user, sid, refresh_token)
+
+@app.post("/api/auth/refresh", response_model=Token)
+async def refresh_access_token(request: RefreshRequest):
+    """Exchange a refresh token for a new access token and refresh token"""
+    try:
+        user_id, sid, refresh_token = await session_store.rotate(request.refresh_token)
+    except InvalidRefreshToken as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
-    return {"access_token": access_token, "token_type": "bearer"}
+    db_user = await db.users.find_one({"_id": ObjectId(user_id)}, PRINCIPAL_PROJECTION)
+    if not db_user or not db_user.get("is_active", True):
+        await session_store.revoke_sessions([sid], user_id)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Account is no longer active",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return issue_tokens(db_user, sid, refresh_token)
+
+@app.post("/api/auth/logout")
+async def logout(current_user: dict = Depends(get_current_principal)):
+    """Revoke the current session and its refresh tokens"""
+    if current_user.get("sid"):
+        await session_store.revoke_sessions([current_user["sid"]], current_user["_id"])
+    return {"message": "Logged out"}
+
+@app.post("/api/auth/logout-all")
+async def logout_all(current_user: dict = Depends(get_current_principal)):
+    """Revoke every session of the current user"""
+    revoked = await session_store.revoke_user(current_user["_id"], extra_sids=[current_user.get("sid")])
+    return {"message": "Logged out of all sessions", "sessions_revoked": revoked}
 
 @app.get("/api/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
@@ -374,12 +645,15 @@ async def search_routes(search: SearchRequest):
         for schedule in schedules:
             vehicle = await db.vehicles.find_one({"_id": schedule["vehicle_id"]})
             if vehicle:
+                route_schedule_id = str(route["_id"]) + "-" + str(schedule["schedule_id"])
+                fare = pricing_engine.price(route, route_schedule_id, search.date)
+                
                 # Calculate available seats
                 bookings = await db.bookings.find({
-                    "route_id": str(route["_id"]),
+                    "route_id": route_schedule_id,
                     "date": search.date,
-                    "status": {"$in": ["confirmed", "paid"]}
-                }).to_list(length=1000)
+                    **seats_taken_filter()
+                }, {"seats": 1}).to_list(length=1000)
                 
                 booked_seats = []
                 for booking in bookings:
@@ -388,13 +662,14 @@ async def search_routes(search: SearchRequest):
                 available_seats = vehicle["total_seats"] - len(booked_seats)
                 
                 results.append(RouteResponse(
-                    id=str(route["_id"]) + "-" + str(schedule["schedule_id"]),
+                    id=route_schedule_id,
                     origin=route["origin"],
                     destination=route["destination"],
                     departure_time=schedule["departure_time"],
                     arrival_time=schedule["arrival_time"],
                     duration=route["duration"],
-                    price=route["price_base"],
+                    price=fare,
+                    price_token=pricing_engine.price_token(route_schedule_id, search.date, fare),
                     vehicle_type=vehicle["vehicle_type"],
                     company=vehicle["company"],
                     amenities=vehicle["amenities"],
@@ -404,27 +679,32 @@ async def search_routes(search: SearchRequest):
     
     return results
 
+@app.post("/api/pricing/quotes")
+async def batch_price_quotes(request: QuoteBatchRequest):
+    """Fares for many (route, date) items from the price table"""
+    if len(request.items) > MAX_QUOTE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_QUOTE_BATCH} items per request")
+    
+    # One bulk catalog lookup for every route in the batch, then dict reads per item
+    routes = await catalog_cache.routes(db, [item.route_id.split("-")[0] for item in request.items])
+    return {
+        "quotes": pricing_engine.batch_quotes(routes, [item.dict() for item in request.items]),
+        "priced_at": pricing_engine.refreshed_at
+    }
+
 async def generate_schedules_for_route(route, date):
     """Generate schedules for a route on a given date"""
-    # Sample schedule generation
-    base_times = [
-        {"departure": "06:00", "arrival": "11:45"},
-        {"departure": "08:30", "arrival": "14:15"},
-        {"departure": "13:00", "arrival": "18:45"},
-        {"departure": "15:30", "arrival": "21:15"},
-        {"departure": "20:00", "arrival": "01:45+1"}
-    ]
-    
     vehicles = await db.vehicles.find().to_list(length=10)
     schedules = []
     
-    for i, time_slot in enumerate(base_times[:3]):  # Limit to 3 schedules per route
+    for i, time_slot in enumerate(SCHEDULE_TIMES[:3]):  # Limit to 3 schedules per route
         if i < len(vehicles):
             schedules.append({
                 "schedule_id": i + 1,
                 "vehicle_id": vehicles[i]["_id"],
                 "departure_time": time_slot["departure"],
                 "arrival_time": time_slot["arrival"],
+                "departure_at": to_departure_at(date, time_slot["departure"]),
                 "date": date
             })
     
@@ -436,7 +716,7 @@ async def generate_schedules_for_route(route, date):
 async def get_seat_layout(
     route_schedule_id: str, 
     date: str = None,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_principal)
 ):
     """Get seat layout for a specific route schedule"""
     try:
@@ -464,6 +744,8 @@ async def get_seat_layout(
                 "capacity": 45
             }
         
+        fare = pricing_engine.price(route, route_schedule_id, date) if date else route.get("price_base", 15.0)
+        
         # Generate seat layout based on vehicle type
         async def generate_seat_layout(vehicle_type, capacity=45, route_id=None, schedule_date=None):
             seats = []
@@ -475,8 +757,8 @@ async def get_seat_layout(
                 existing_bookings = await db.bookings.find({
                     "route_id": route_id,
                     "date": schedule_date,
-                    "status": {"$in": ["confirmed", "paid"]}
-                }).to_list(length=1000)
+                    **seats_taken_filter()
+                }, {"seats": 1}).to_list(length=1000)
                 
                 for booking in existing_bookings:
                     booked_seats.extend(booking.get("seats", []))
@@ -499,7 +781,7 @@ async def get_seat_layout(
                         "seat_number": seat_id,
                         "type": "standard",
                         "status": "occupied" if is_occupied else "available",
-                        "price": 15.0 if not is_occupied else None
+                        "price": fare if not is_occupied else None
                     }
                     seats.append(seat)
                     seat_id += 1
@@ -525,6 +807,7 @@ async def get_seat_layout(
             "vehicle_type": route.get("vehicle_type", "Standard Bus"),
             "total_seats": route.get("capacity", 45),
             "available_seats": len([s for s in seats if s["status"] == "available"]),
+            "price_token": pricing_engine.price_token(route_schedule_id, date, fare) if date else None,
             "seats": seats,
             "layout": {
                 "rows": max([s["row"] for s in seats]) if seats else 12,
@@ -599,8 +882,23 @@ def generate_seat_layout(vehicle, booked_seats):
 
 # Booking endpoints
 @app.post("/api/bookings", response_model=BookingResponse)
-async def create_booking(booking: BookingRequest, current_user: dict = Depends(get_current_user)):
+async def create_booking(
+    booking: BookingRequest,
+    current_user: dict = Depends(get_current_principal),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Create a new booking"""
+    return await idempotency_store.run(
+        idempotency_key, str(current_user["_id"]), "create_booking", booking,
+        lambda: _create_booking(booking, current_user)
+    )
+
+async def _create_booking(booking: BookingRequest, current_user: dict):
+    try:
+        job_queue.check_capacity()
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Booking service is busy, please retry shortly", headers={"Retry-After": "5"})
+    
     # Generate unique identifiers
     timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
     random_suffix = f"{random.randint(1000, 9999)}"
@@ -621,8 +919,8 @@ async def create_booking(booking: BookingRequest, current_user: dict = Depends(g
     existing_bookings = await db.bookings.find({
         "route_id": booking.route_id,
         "date": booking.date,
-        "status": {"$in": ["confirmed", "paid"]},
-        "seats": {"$in": booking.selected_seats}
+        "seats": {"$in": booking.selected_seats},
+        **seats_taken_filter()
     }).to_list(length=1000)
     
     if existing_bookings:
@@ -636,47 +934,60 @@ async def create_booking(booking: BookingRequest, current_user: dict = Depends(g
     if not route:
         raise HTTPException(status_code=404, detail="Route not found")
     
-    total_price = route["price_base"] * len(booking.selected_seats)
-    
-    # Create individual tickets for each seat/passenger
-    tickets = []
-    for i, (seat, passenger) in enumerate(zip(booking.selected_seats, booking.passenger_details)):
-        ticket = {
-            "ticket_number": ticket_numbers[i],
-            "seat_number": seat,
-            "passenger_name": f"{passenger.get('firstName', '')} {passenger.get('lastName', '')}".strip(),
-            "passenger_email": passenger.get('email', ''),
-            "passenger_phone": passenger.get('phone', ''),
-            "ticket_price": route["price_base"],
-            "qr_code": f"BMB-{booking_ref}-{ticket_numbers[i]}-{seat}"
-        }
-        tickets.append(ticket)
-    
-    # Create booking
+    fare = pricing_engine.price(route, booking.route_id, booking.date)
+    if booking.price_token:
+        quoted = pricing_engine.quoted_price(booking.price_token, booking.route_id, booking.date)
+        if quoted is None:
+            raise HTTPException(
+                status_code=409,
+                detail=f"The fare you were shown has expired; the current fare is ${fare:.2f} per seat, please confirm to continue"
+            )
+        fare = quoted
+    total_price = fare * len(booking.selected_seats)
+    operator = booking_operator({"route_id": booking.route_id}, await vehicle_operators(db))
+    
+    # Resolve the departure instant for this schedule (Cambodia local time)
+    slot = schedule_slot(booking.route_id)
+    departure_at = to_departure_at(booking.date, slot["departure"])
+    if departure_at is None:
+        raise HTTPException(status_code=400, detail="Invalid travel date, expected YYYY-MM-DD")
+    
+    # Create booking (tickets are generated by the background pipeline)
     booking_dict = {
         "booking_reference": booking_ref,
         "order_id": order_id,
         "ticket_numbers": ticket_numbers,
-        "tickets": tickets,
         "user_id": str(current_user["_id"]),
         "route_id": booking.route_id,
         "route_schedule_id": booking.route_id,
+        "operator": operator,
         "seats": booking.selected_seats,
         "passenger_details": booking.passenger_details,
         "date": booking.date,
+        "departure_time": slot["departure"],
+        "arrival_time": slot["arrival"],
+        "departure_at": departure_at,
         "total_price": total_price,
         "status": "pending",
+        "expires_at": hold_expiry(),
         "created_at": datetime.utcnow(),
         "booking_type": "bus_ticket"
     }
+    booking_dict["_id"] = ObjectId()
     
-    result = await db.bookings.insert_one(booking_dict)
-    booking_dict["id"] = str(result.inserted_id)
+    async def write(session):
+        await db.bookings.insert_one(booking_dict, session=session)
+        await append_event(db, BOOKING_CREATED, booking_dict["_id"], booking_snapshot(booking_dict), session=session)
+        # Jobs commit with the booking, so a crash after commit cannot lose them
+        await job_queue.enqueue_many(booking_created_jobs(str(booking_dict["_id"])), session=session)
+    
+    await run_in_transaction(db, write)
+    booking_dict["id"] = str(booking_dict["_id"])
     
     return BookingResponse(**booking_dict)
 
 @app.get("/api/bookings")
-async def get_user_bookings(current_user: dict = Depends(get_current_user)):
+async def get_user_bookings(current_user: dict = Depends(get_current_principal)):
     """Get user's bookings"""
     try:
         bookings = await db.bookings.find({
@@ -709,8 +1020,101 @@ async def get_user_bookings(current_user: dict = Depends(get_current_user)):
         logger.error(f"Error fetching user bookings: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch bookings")
 
+@app.get("/api/bookings/upcoming")
+async def get_upcoming_bookings(current_user: dict = Depends(get_current_principal)):
+    """Get user's upcoming bookings"""
+    bookings = await db.bookings.find({
+        "user_id": str(current_user["_id"]),
+        "departure_at": {"$gte": datetime.utcnow()},
+        "status": {"$in": ["confirmed", "paid"]}
+    }).sort("departure_at", 1).to_list(length=50)
+    
+    for booking in bookings:
+        booking["id"] = str(booking["_id"])
+        # Get route details
+        if "route_id" in booking:
+            try:
+                route_parts = booking["route_id"].split("-")
+                if len(route_parts) > 0:
+                    # Handle both ObjectId and string route IDs
+                    route_id = route_parts[0]
+                    if len(route_id) == 24:  # Standard ObjectId length
+                        route = await db.routes.find_one({"_id": ObjectId(route_id)})
+                    else:
+                        route = await db.routes.find_one({"id": route_id})
+                    
+                    if route:
+                        booking["route_details"] = {
+                            "origin": route.get("origin", "Unknown"),
+                            "destination": route.get("destination", "Unknown"),
+                            "duration": route.get("duration", "Unknown")
+                        }
+                    else:
+                        # If route not found, create mock route details
+                        booking["route_details"] = {
+                            "origin": "Unknown",
+                            "destination": "Unknown", 
+                            "duration": "Unknown"
+                        }
+            except Exception as e:
+                logger.error(f"Error getting route details for booking {booking['id']}: {str(e)}")
+                booking["route_details"] = {
+                    "origin": "Unknown",
+                    "destination": "Unknown",
+                    "duration": "Unknown"
+                }
+    
+    # Use jsonable_encoder to properly serialize ObjectId objects
+    return jsonable_encoder(bookings, custom_encoder={ObjectId: str})
+
+@app.get("/api/bookings/past")
+async def get_past_bookings(current_user: dict = Depends(get_current_principal)):
+    """Get user's past bookings"""
+    bookings = await db.bookings.find({
+        "user_id": str(current_user["_id"]),
+        "departure_at": {"$lt": datetime.utcnow()}
+    }).sort("departure_at", -1).to_list(length=50)
+    
+    for booking in bookings:
+        booking["id"] = str(booking["_id"])
+        # Get route details
+        if "route_id" in booking:
+            try:
+                route_parts = booking["route_id"].split("-")
+                if len(route_parts) > 0:
+                    # Handle both ObjectId and string route IDs
+                    route_id = route_parts[0]
+                    if len(route_id) == 24:  # Standard ObjectId length
+                        route = await db.routes.find_one({"_id": ObjectId(route_id)})
+                    else:
+                        route = await db.routes.find_one({"id": route_id})
+                    
+                    if route:
+                        booking["route_details"] = {
+                            "origin": route.get("origin", "Unknown"),
+                            "destination": route.get("destination", "Unknown"),
+                            "duration": route.get("duration", "Unknown")
+                        }
+                    else:
+                        # If route not found, create mock route details
+                        booking["route_details"] = {
+                            "origin": "Unknown",
+                            "destination": "Unknown",
+                            "duration": "Unknown"
+                        }
+            except Exception as e:
+                logger.error(f"Error getting route details for booking {booking['id']}: {str(e)}")
+                booking["route_details"] = {
+                    "origin": "Unknown",
+                    "destination": "Unknown",
+                    "duration": "Unknown"
+                }
+    
+    # Use jsonable_encoder to properly serialize ObjectId objects
+    return jsonable_encoder(bookings, custom_encoder={ObjectId: str})
+
 @app.get("/api/bookings/{booking_id}")
-async def get_booking_details(booking_id: str, current_user: dict = Depends(get_current_user)):
+async def get_booking_details(booking_id: str, current_user: dict = Depends(get_current_principal)):
     """Get booking details"""
     try:
         booking = await db.bookings.find_one({
@@ -749,10 +1153,68 @@ async def get_booking_details(booking_id: str, current_user: dict = Depends(get_
         logger.error(f"Error fetching booking details: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch booking details")
 
+@app.post("/api/bookings/{booking_id}/cancel")
+async def cancel_booking(booking_id: str, current_user: dict = Depends(get_current_principal)):
+    """Cancel a booking and release its seats"""
+    try:
+        booking_oid = ObjectId(booking_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid booking ID")
+    
+    async def write(session):
+        booking = await db.bookings.find_one_and_update(
+            {
+                "_id": booking_oid,
+                "user_id": str(current_user["_id"]),
+                "status": {"$in": ["pending", "confirmed", "paid"]}
+            },
+            {
+                "$set": {"status": "cancelled", "cancelled_at": datetime.utcnow()},
+                "$unset": {"expires_at": ""}
+            },
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if not booking:
+            raise HTTPException(status_code=404, detail="Booking not found or cannot be cancelled")
+        
+        if booking["status"] == "paid":
+            await db.bookings.update_one(
+                {"_id": booking_oid},
+                {"$set": {"refund_status": "pending"}},
+                session=session
+            )
+        
+        await append_event(db, BOOKING_CANCELLED, booking_oid, {
+            **booking_snapshot(booking),
+            "status": "cancelled",
+            "previous_status": booking["status"]
+        }, session=session)
+        return booking
+    
+    booking = await run_in_transaction(db, write)
+    
+    return {
+        "status": "success",
+        "message": "Booking cancelled successfully",
+        "booking_id": booking_id,
+        "refund_status": "pending" if booking["status"] == "paid" else None
+    }
+
 # Payment endpoints
 @app.post("/api/payments/process")
-async def process_payment(payment: PaymentRequest, current_user: dict = Depends(get_current_user)):
+async def process_payment(
+    payment: PaymentRequest,
+    current_user: dict = Depends(get_current_principal),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Process payment for booking"""
+    return await idempotency_store.run(
+        idempotency_key, str(current_user["_id"]), "process_payment", payment,
+        lambda: _process_payment(payment, current_user)
+    )
+
+async def _process_payment(payment: PaymentRequest, current_user: dict):
     # Get booking
     booking = await db.bookings.find_one({
         "_id": ObjectId(payment.booking_id),
@@ -765,35 +1227,12 @@ async def process_payment(payment: PaymentRequest, current_user: dict = Depends(
     if booking["status"] != "pending":
         raise HTTPException(status_code=400, detail="Booking is not pending payment")
     
-    # Simulate payment processing
-    payment_successful = True  # In real implementation, integrate with payment gateway
+    if hold_expired(booking):
+        raise HTTPException(status_code=400, detail="Booking hold has expired, please book again")
     
-    if payment_successful:
-        # Update booking status
-        await db.bookings.update_one(
-            {"_id": ObjectId(payment.booking_id)},
-            {
-                "$set": {
-                    "status": "paid",
-                    "payment_method": payment.payment_method,
-                    "paid_at": datetime.utcnow()
-                }
-            }
-        )
-        
-        # Create payment record
-        payment_record = {
-            "booking_id": payment.booking_id,
-            "user_id": str(current_user["_id"]),
-            "amount": booking["total_price"],
-            "payment_method": payment.payment_method,
-            "status": "completed",
-            "transaction_id": f"TXN{datetime.utcnow().strftime('%Y%m%d%H%M%S')}",
-            "created_at": datetime.utcnow()
-        }
-        
-        await db.payments.insert_one(payment_record)
-        
+    payment_record = await charge_booking(booking, str(current_user["_id"]), payment.payment_method, booking["total_price"])
+    
+    if payment_record["status"] == "completed":
         return {
             "status": "success",
             "message": "Payment processed successfully",
@@ -806,61 +1245,354 @@ async def process_payment(payment: PaymentRequest, current_user: dict = Depends(
             "message": "Payment processing failed"
         }
 
+async def charge_booking(booking: dict, user_id: str, payment_method: str, amount: float, payment_data: Optional[dict] = None) -> dict:
+    """Charge through the payment gateway, then mark the booking paid atomically.
+    
+    Returns the stored payment record; its status is "failed" when the
+    provider declined the charge.
+    """
+    booking_id = str(booking["_id"])
+    # Stable across client retries until the provider declines, so a charge that
+    # landed but timed out is never repeated under a fresh key
+    attempt = booking.get("payment_attempts", 0)
+    try:
+        result = await payment_gateway.charge(
+            amount, payment_method, booking.get("booking_reference") or booking_id, f"{booking_id}-{attempt}"
+        )
+    except GatewayUnavailable as e:
+        logger.error(f"Payment for booking {booking_id} not confirmed: {e}")
+        raise HTTPException(status_code=503, detail="Payment provider unavailable, please retry", headers={"Retry-After": "5"})
+    
+    payment_record = {
+        "booking_id": booking_id,
+        "user_id": user_id,
+        "amount": amount,
+        "payment_method": payment_method,
+        "status": "completed" if result.approved else "failed",
+        "transaction_id": result.transaction_id,
+        "provider": result.provider,
+        "provider_message": result.message,
+        "created_at": datetime.utcnow(),
+        "payment_data": payment_data or {}
+    }
+    
+    if not result.approved:
+        await db.payments.insert_one(payment_record)
+        # A declined key is spent; the next attempt (e.g. another card) gets a new one
+        await db.bookings.update_one(
+            {"_id": booking["_id"], "payment_attempts": {"$in": [attempt, None]}},
+            {"$set": {"payment_attempts": attempt + 1}}
+        )
+        return payment_record
+    
+    # Booking status, payment record and event commit together
+    async def write(session):
+        # Update booking status, unless the hold expired while the provider was charging
+        update = await db.bookings.update_one(
+            {"_id": booking["_id"], "status": "pending", "expires_at": {"$gt": datetime.utcnow()}},
+            {
+                "$set": {
+                    "status": "paid",
+                    "payment_method": payment_method,
+                    "payment_status": "completed",
+                    "transaction_id": result.transaction_id,
+                    "paid_at": datetime.utcnow()
+                },
+                "$unset": {"expires_at": ""}
+            },
+            session=session
+        )
+        if update.modified_count == 0:
+            raise HTTPException(status_code=409, detail="Booking is no longer pending payment")
+        
+        await db.payments.insert_one(payment_record, session=session)
+        await append_event(db, BOOKING_PAID, booking_id, {
+            **booking_snapshot(booking),
+            "status": "paid",
+            "amount": amount,
+            "payment_method": payment_method,
+            "transaction_id": result.transaction_id
+        }, session=session)
+        await job_queue.enqueue_many(payment_completed_jobs(booking_id), session=session)
+    
+    try:
+        await run_in_transaction(db, write)
+    except HTTPException as e:
+        if e.status_code != 409:
+            raise
+        # The provider took the money but the seats are gone; keep a record for the refund
+        payment_record.pop("_id", None)
+        payment_record["status"] = "refund_pending"
+        await db.payments.insert_one(payment_record)
+        raise HTTPException(status_code=409, detail="Booking is no longer pending payment, the charge will be refunded")
+    
+    return payment_record
+
+# Payment provider webhooks
+@app.post("/api/payments/webhooks/{provider}")
+async def receive_payment_webhook(provider: str, request: Request):
+    """Verify, dedupe and queue a provider payment event; a worker applies it"""
+    body = await request.body()
+    try:
+        verify_signature(provider, body, request.headers.get("X-Webhook-Signature"))
+    except InvalidSignature as e:
+        logger.warning(f"Rejected {provider} webhook: {e}")
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    
+    try:
+        event = json.loads(body)
+        event_id = str(event["id"])
+        event_type = event["type"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Malformed webhook payload")
+    
+    if event_type not in SUPPORTED_EVENTS:
+        return {"status": "ignored"}
+    
+    try:
+        await job_queue.enqueue(
+            "apply_payment_webhook",
+            {"provider": provider, "event_id": event_id, "type": event_type, "data": event.get("data", {})},
+            dedupe_key=f"webhook:{provider}:{event_id}"
+        )
+    except DuplicateKeyError:
+        return {"status": "duplicate"}
+    
+    return {"status": "accepted"}
+
 # Admin endpoints
+async def load_admin_stats():
+    """Admin statistics, recomputed by the analytics cache"""
+    stats, partial = await gather_stats({
+        "totals": read_rollup(db),
+        "total_users": estimated_count(db.users)
+    })
+    totals = stats["totals"]
+    
+    return {
+        "total_bookings": totals["bookings_created"] if totals else None,
+        "total_users": stats["total_users"],
+        "total_revenue": net_revenue(totals) if totals else None,
+        "partial": partial,
+        "generated_at": datetime.utcnow()
+    }
+
 @app.get("/api/admin/stats")
-async def get_admin_stats(current_user: dict = Depends(get_current_user)):
+async def get_admin_stats(current_user: dict = Depends(require_permissions("analytics:view"))):
     """Get admin statistics"""
-    total_bookings = await db.bookings.count_documents({})
-    total_users = await db.users.count_documents({})
-    total_revenue = await db.payments.aggregate([
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]).to_list(length=1)
+    return await analytics_cache.get("admin_stats", load_admin_stats)
+
+# Password hashing pool metrics
+@app.get("/api/admin/metrics/password-hashing")
+async def get_password_hashing_metrics(current_user: dict = Depends(require_permissions("system:metrics"))):
+    """Queue depth and timings of the bcrypt worker pool"""
+    return password_hasher.stats()
+
+@app.get("/api/admin/metrics/principal-cache")
+async def get_principal_cache_metrics(current_user: dict = Depends(require_permissions("system:metrics"))):
+    """Hit rate of the authenticated principal cache"""
+    return principal_cache.stats()
+
+@app.get("/api/admin/metrics/sessions")
+async def get_session_metrics(current_user: dict = Depends(require_permissions("system:metrics"))):
+    """Size and hit counts of the session revocation filter"""
+    return session_store.stats()
+
+@app.get("/api/admin/metrics/rate-limits")
+async def get_rate_limit_metrics(current_user: dict = Depends(require_permissions("system:metrics"))):
+    """Rate limiter backend and rejections per policy"""
+    return rate_limiter.stats()
+
+@app.get("/api/admin/metrics/analytics-cache")
+async def get_analytics_cache_metrics(current_user: dict = Depends(require_permissions("system:metrics"))):
+    """Hit rates and widget ages of the analytics cache"""
+    return analytics_cache.stats()
+
+@app.get("/api/admin/metrics/catalog-cache")
+async def get_catalog_cache_metrics(current_user: dict = Depends(require_permissions("system:metrics"))):
+    """Hit rate and bulk lookups of the route catalog cache"""
+    return catalog_cache.stats()
+
+@app.get("/api/admin/metrics/realtime-feed")
+async def get_realtime_feed_metrics(current_user: dict = Depends(require_permissions("system:metrics"))):
+    """Subscribers and log position of the realtime dashboard feed"""
+    return realtime_feed.stats()
+
+@app.get("/api/admin/metrics/pricing")
+async def get_pricing_metrics(current_user: dict = Depends(require_permissions("system:metrics"))):
+    """Size, age and lookup hit rate of the price table"""
+    return pricing_engine.stats()
+
+# Booking event log
+@app.get("/api/admin/events")
+async def get_booking_events(after: int = 0, limit: int = 500, current_user: dict = Depends(require_permissions("bookings:read"))):
+    """Read booking events in order; pass the last seen seq as `after` to resume"""
+    limit = max(1, min(limit, 1000))
+    events = await db.booking_events.find(
+        {"seq": {"$gt": after}}, {"_id": 0}
+    ).sort("seq", 1).limit(limit).to_list(length=limit)
     
-    revenue = total_revenue[0]["total"] if total_revenue else 0
+    return {
+        "events": jsonable_encoder(events),
+        "next_after": events[-1]["seq"] if events else after
+    }
+
+# Payment reconciliation
+@app.post("/api/admin/reconciliation/run")
+async def trigger_reconciliation(full: bool = False, current_user: dict = Depends(require_permissions("payments:reports"))):
+    """Queue a payment reconciliation run (incremental unless full=true)"""
+    job_id = await job_queue.enqueue("reconcile_payments", {"incremental": not full})
+    return {"message": "Reconciliation queued", "job_id": job_id}
+
+@app.get("/api/admin/reconciliation/report")
+async def get_reconciliation_report(limit: int = 100, current_user: dict = Depends(require_permissions("payments:reports"))):
+    """Latest reconciliation run and its mismatches"""
+    run = await db.reconciliation_runs.find_one({}, sort=[("started_at", -1)])
+    if not run:
+        return {"run": None, "mismatches": []}
+    
+    mismatches = await db.reconciliation_mismatches.find(
+        {"run_id": run["_id"]}, {"_id": 0, "run_id": 0}
+    ).limit(max(1, min(limit, 1000))).to_list(length=1000)
+    
+    run["id"] = str(run.pop("_id"))
+    return jsonable_encoder({"run": run, "mismatches": mismatches})
+
+# Columnar exports for finance and offline analysis
+@app.get("/api/admin/exports/{dataset}")
+async def export_dataset(
+    dataset: str,
+    format: str = "parquet",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    since: Optional[str] = None,
+    current_user: dict = Depends(require_permissions("analytics:export"))
+):
+    """Stream a collection as Parquet or Arrow; pass the returned X-Export-Watermark as `since` to resume"""
+    spec = DATASETS.get(dataset)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset, expected one of {', '.join(sorted(DATASETS))}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {', '.join(sorted(FORMATS))}")
+    try:
+        arrow_schema(spec)
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    
+    try:
+        query, until = await export_query(db, spec, start, end, since)
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid date range or watermark")
+    
+    extension = "parquet" if format == "parquet" else "arrows"
+    return StreamingResponse(
+        stream_export(db, spec, query, format),
+        media_type=FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{dataset}.{extension}"',
+            "X-Export-Watermark": format_watermark(until) or ""
+        }
+    )
+
+# Departure manifest
+@app.get("/api/admin/manifest")
+async def get_departure_manifest(date: str, route_id: Optional[str] = None, current_user: dict = Depends(require_permissions("bookings:read"))):
+    """List passengers departing on a local date, optionally for one route schedule"""
+    try:
+        start, end = local_day_bounds(date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    
+    query = {
+        "departure_at": {"$gte": start, "$lt": end},
+        "status": {"$in": ["confirmed", "paid"]}
+    }
+    if route_id:
+        query["route_id"] = route_id
+    
+    bookings = await db.bookings.find(query, {
+        "booking_reference": 1,
+        "route_id": 1,
+        "seats": 1,
+        "passenger_details": 1,
+        "departure_time": 1,
+        "departure_at": 1,
+        "status": 1
+    }).sort("departure_at", 1).to_list(length=5000)
+    
+    for booking in bookings:
+        booking["id"] = str(booking.pop("_id"))
     
     return {
-        "total_bookings": total_bookings,
-        "total_users": total_users,
-        "total_revenue": revenue,
-        "generated_at": datetime.utcnow()
+        "date": date,
+        "route_id": route_id,
+        "total_bookings": len(bookings),
+        "total_passengers": sum(len(b.get("seats", [])) for b in bookings),
+        "bookings": jsonable_encoder(bookings)
     }
 
 # Analytics endpoint
-@app.get("/api/admin/analytics")
-async def get_analytics(current_user: dict = Depends(get_current_user)):
-    """Get analytics data"""
+async def load_admin_analytics():
+    """Analytics data, recomputed by the analytics cache"""
     try:
-        # Get basic counts
-        total_users = await db.users.count_documents({})
-        total_bookings = await db.bookings.count_documents({})
-        total_routes = await db.routes.count_documents({})
-        total_buses = await db.buses.count_documents({})
-        
-        # Get revenue (sum of all confirmed/paid bookings)
-        pipeline = [
-            {"$match": {"status": {"$in": ["confirmed", "paid"]}}},
-            {"$group": {"_id": None, "total_revenue": {"$sum": "$total_price"}}}
-        ]
-        revenue_result = await db.bookings.aggregate(pipeline).to_list(length=1)
-        total_revenue = revenue_result[0]["total_revenue"] if revenue_result else 0
+        # Collection totals from metadata, bookings and revenue from the rollups, all at once
+        stats, partial = await gather_stats({
+            "total_users": estimated_count(db.users),
+            "total_routes": estimated_count(db.routes),
+            "total_buses": estimated_count(db.buses),
+            "active_buses": bounded_count(db.buses, {"status": "active"}),
+            "pending_bookings": bounded_count(db.bookings, {"status": "pending"}),
+            "totals": read_rollup(db)
+        })
+        totals = stats.pop("totals")
         
         return {
-            "total_users": total_users,
-            "total_bookings": total_bookings,
-            "total_routes": total_routes,
-            "total_buses": total_buses,
-            "total_revenue": total_revenue,
-            "active_buses": total_buses - 5,  # Mock some inactive buses
-            "pending_bookings": await db.bookings.count_documents({"status": "pending"})
+            **stats,
+            "total_bookings": totals["bookings_created"] if totals else None,
+            "total_revenue": net_revenue(totals) if totals else None,
+            "partial": partial
         }
     except Exception as e:
         logger.error(f"Error getting analytics: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/api/admin/analytics")
+async def get_analytics(current_user: dict = Depends(require_permissions("analytics:view"))):
+    """Get analytics data"""
+    return await analytics_cache.get("admin_analytics", load_admin_analytics)
+
+@app.get("/api/admin/analytics/top-routes")
+async def get_top_routes(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = 10,
+    current_user: dict = Depends(require_permissions("analytics:view"))
+):
+    """Route leaderboard per canonical route, departure slot and operator"""
+    start = start or window_start(30)
+    end = end or local_today()
+    return {
+        "start": start,
+        "end": end,
+        "routes": await top_routes(db, catalog_cache, start, end, limit=max(1, min(limit, 100)))
+    }
+
+@app.get("/api/admin/analytics/occupancy")
+async def get_occupancy(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    route_id: Optional[str] = None,
+    current_user: dict = Depends(require_permissions("analytics:view"))
+):
+    """Load factor per departure, route, vehicle and weekday, with a weekday × slot heatmap"""
+    try:
+        return await compute_occupancy(db, catalog_cache, start or window_start(30), end or local_today(), route_id)
+    except OccupancyRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # Management endpoints for vehicles
 @app.get("/api/management/vehicles")
-async def get_vehicles(current_user: dict = Depends(get_current_user)):
+async def get_vehicles(current_user: dict = Depends(require_permissions("buses:read"))):
     """Get all vehicles for management"""
     try:
         vehicles = await db.buses.find({}).to_list(length=1000)
@@ -897,7 +1629,7 @@ async def get_vehicles(current_user: dict = Depends(get_current_user)):
         return []  # Return empty array instead of error
 
 @app.post("/api/management/vehicles")
-async def create_vehicle(vehicle_data: dict, current_user: dict = Depends(get_current_user)):
+async def create_vehicle(vehicle_data: dict, current_user: dict = Depends(require_permissions("buses:create"))):
     """Create a new vehicle"""
     try:
         vehicle_dict = {
@@ -916,31 +1648,30 @@ async def create_vehicle(vehicle_data: dict, current_user: dict = Depends(get_cu
 
 # AI dynamic pricing endpoint  
 @app.post("/api/management/ai/dynamic-pricing")
-async def calculate_dynamic_pricing(request_data: dict, current_user: dict = Depends(get_current_user)):
-    """Calculate AI-powered dynamic pricing suggestions"""
-    # Mock AI pricing logic - no required parameters
-    base_price = request_data.get("base_price", 15.0)
-    demand_factor = request_data.get("demand_factor", 1.0)
-    
-    # Simple dynamic pricing calculation
-    suggested_price = base_price * demand_factor
-    
-    # Add some intelligence based on time and demand
-    import random
-    adjustment = random.uniform(0.8, 1.2)
-    final_price = suggested_price * adjustment
+async def calculate_dynamic_pricing(request_data: dict, current_user: dict = Depends(require_permissions("routes:update"))):
+    """Current engine fare for a route schedule on a date"""
+    route_schedule_id = str(request_data.get("route_id", ""))
+    date = request_data.get("date") or local_today()
+    try:
+        route = await db.routes.find_one({"_id": ObjectId(route_schedule_id.split("-")[0])})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid route ID")
+    if not route:
+        raise HTTPException(status_code=404, detail="Route not found")
     
+    if "-" not in route_schedule_id:
+        route_schedule_id = f"{route_schedule_id}-1"
+    quote = pricing_engine.quote(route, route_schedule_id, date)
     return {
-        "base_price": base_price,
-        "suggested_price": round(final_price, 2),
-        "demand_factor": demand_factor,
-        "price_change": round(((final_price - base_price) / base_price) * 100, 1),
-        "confidence": round(random.uniform(0.7, 0.95), 2)
+        "base_price": quote["base_price"],
+        "suggested_price": quote["price"],
+        "factors": quote["factors"],
+        "price_change": round(((quote["price"] - quote["base_price"]) / quote["base_price"]) * 100, 1) if quote["base_price"] else 0.0
     }
 
 # Ticket generation and download endpoints
 @app.get("/api/tickets/download/{booking_id}")
-async def download_ticket(booking_id: str, current_user: dict = Depends(get_current_user)):
+async def download_ticket(booking_id: str, current_user: dict = Depends(get_current_principal)):
     """Generate and download ticket PDF"""
     try:
         # Find the booking
@@ -970,8 +1701,8 @@ async def download_ticket(booking_id: str, current_user: dict = Depends(get_curr
                 "origin": "Phnom Penh",
                 "destination": "Siem Reap", 
                 "date": booking.get("date"),
-                "departure_time": "06:00",
-                "arrival_time": "11:45",
+                "departure_time": booking.get("departure_time", "06:00"),
+                "arrival_time": booking.get("arrival_time", "11:45"),
                 "duration": "5h 45m"
             },
             "passenger_details": booking.get("passenger_details", []),
@@ -1014,8 +1745,8 @@ def generate_ticket_content(booking):
     ROUTE INFORMATION
     ================================
     
-    From: Phnom Penh (06:00)
-    To: Siem Reap (11:45)
+    From: Phnom Penh ({booking.get('departure_time', '06:00')})
+    To: Siem Reap ({booking.get('arrival_time', '11:45')})
     Duration: 5h 45m
     
     ================================
@@ -1099,7 +1830,7 @@ async def get_route_suggestions(q: str = ""):
 
 # User Profile endpoints
 @app.get("/api/user/credit")
-async def get_user_credit(current_user: dict = Depends(get_current_user)):
+async def get_user_credit(current_user: dict = Depends(get_current_principal)):
     """Get user credit balance and transactions"""
     # Sample credit data - in real app, this would come from database
     credit_data = {
@@ -1113,107 +1844,8 @@ async def get_user_credit(current_user: dict = Depends(get_current_user)):
     }
     return credit_data
 
-@app.get("/api/bookings/upcoming")
-async def get_upcoming_bookings(current_user: dict = Depends(get_current_user)):
-    """Get user's upcoming bookings"""
-    from datetime import datetime
-    today = datetime.utcnow()
-    
-    bookings = await db.bookings.find({
-        "user_id": str(current_user["_id"]),
-        "date": {"$gte": today.strftime("%Y-%m-%d")},
-        "status": {"$in": ["confirmed", "paid"]}
-    }).sort("date", 1).to_list(length=50)
-    
-    for booking in bookings:
-        booking["id"] = str(booking["_id"])
-        # Get route details
-        if "route_id" in booking:
-            try:
-                route_parts = booking["route_id"].split("-")
-                if len(route_parts) > 0:
-                    # Handle both ObjectId and string route IDs
-                    route_id = route_parts[0]
-                    if len(route_id) == 24:  # Standard ObjectId length
-                        route = await db.routes.find_one({"_id": ObjectId(route_id)})
-                    else:
-                        route = await db.routes.find_one({"id": route_id})
-                    
-                    if route:
-                        booking["route_details"] = {
-                            "origin": route.get("origin", "Unknown"),
-                            "destination": route.get("destination", "Unknown"),
-                            "duration": route.get("duration", "Unknown")
-                        }
-                    else:
-                        # If route not found, create mock route details
-                        booking["route_details"] = {
-                            "origin": "Unknown",
-                            "destination": "Unknown", 
-                            "duration": "Unknown"
-                        }
-            except Exception as e:
-                logger.error(f"Error getting route details for booking {booking['id']}: {str(e)}")
-                booking["route_details"] = {
-                    "origin": "Unknown",
-                    "destination": "Unknown",
-                    "duration": "Unknown"
-                }
-    
-    # Use jsonable_encoder to properly serialize ObjectId objects
-    return jsonable_encoder(bookings, custom_encoder={ObjectId: str})
-
-@app.get("/api/bookings/past")
-async def get_past_bookings(current_user: dict = Depends(get_current_user)):
-    """Get user's past bookings"""
-    from datetime import datetime
-    today = datetime.utcnow()
-    
-    bookings = await db.bookings.find({
-        "user_id": str(current_user["_id"]),
-        "date": {"$lt": today.strftime("%Y-%m-%d")}
-    }).sort("date", -1).to_list(length=50)
-    
-    for booking in bookings:
-        booking["id"] = str(booking["_id"])
-        # Get route details
-        if "route_id" in booking:
-            try:
-                route_parts = booking["route_id"].split("-")
-                if len(route_parts) > 0:
-                    # Handle both ObjectId and string route IDs
-                    route_id = route_parts[0]
-                    if len(route_id) == 24:  # Standard ObjectId length
-                        route = await db.routes.find_one({"_id": ObjectId(route_id)})
-                    else:
-                        route = await db.routes.find_one({"id": route_id})
-                    
-                    if route:
-                        booking["route_details"] = {
-                            "origin": route.get("origin", "Unknown"),
-                            "destination": route.get("destination", "Unknown"),
-                            "duration": route.get("duration", "Unknown")
-                        }
-                    else:
-                        # If route not found, create mock route details
-                        booking["route_details"] = {
-                            "origin": "Unknown",
-                            "destination": "Unknown",
-                            "duration": "Unknown"
-                        }
-            except Exception as e:
-                logger.error(f"Error getting route details for booking {booking['id']}: {str(e)}")
-                booking["route_details"] = {
-                    "origin": "Unknown",
-                    "destination": "Unknown",
-                    "duration": "Unknown"
-                }
-    
-    # Use jsonable_encoder to properly serialize ObjectId objects
-    return jsonable_encoder(bookings, custom_encoder={ObjectId: str})
-
 @app.post("/api/user/invite")
-async def send_invite(invite_data: dict, current_user: dict = Depends(get_current_user)):
+async def send_invite(invite_data: dict, current_user: dict = Depends(get_current_principal)):
     """Send invitation to friends"""
     # In real implementation, this would send actual emails
     invite_record = {
@@ -1228,8 +1860,15 @@ async def send_invite(invite_data: dict, current_user: dict = Depends(get_curren
     return {"message": "Invite sent successfully"}
 
 @app.put("/api/user/profile")
-async def update_user_profile(profile_data: dict, current_user: dict = Depends(get_current_user)):
+async def update_user_profile(profile_data: dict, current_user: dict = Depends(get_current_principal)):
     """Update user profile"""
+    # Tokens are keyed by user id, so changing email is safe as long as it stays unique
+    existing = await db.users.find_one(
+        {"email": profile_data["email"], "_id": {"$ne": current_user["_id"]}}, {"_id": 1}
+    )
+    if existing:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
     await db.users.update_one(
         {"_id": current_user["_id"]},
         {"$set": {
@@ -1240,15 +1879,18 @@ async def update_user_profile(profile_data: dict, current_user: dict = Depends(g
             "updated_at": datetime.utcnow()
         }}
     )
+    principal_cache.invalidate_user(current_user["_id"])
     return {"message": "Profile updated successfully"}
 
 @app.put("/api/user/change-password")
-async def change_password(password_data: dict, current_user: dict = Depends(get_current_user)):
+async def change_password(password_data: dict, current_user: dict = Depends(get_current_principal)):
     """Change user password"""
-    if not verify_password(password_data["current_password"], current_user["password"]):
+    # Principals never carry the hash, so load it just for this check
+    stored = await db.users.find_one({"_id": current_user["_id"]}, {"password": 1})
+    if not stored or not await verify_password(password_data["current_password"], stored["password"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
-    new_password_hash = get_password_hash(password_data["new_password"])
+    new_password_hash = await get_password_hash(password_data["new_password"])
     await db.users.update_one(
         {"_id": current_user["_id"]},
         {"$set": {
@@ -1256,11 +1898,12 @@ async def change_password(password_data: dict, current_user: dict = Depends(get_
             "updated_at": datetime.utcnow()
         }}
     )
+    principal_cache.invalidate_user(current_user["_id"])
     return {"message": "Password changed successfully"}
 
 # Affiliate Program endpoints
 @app.get("/api/affiliate/status")
-async def get_affiliate_status(current_user: dict = Depends(get_current_user)):
+async def get_affiliate_status(current_user: dict = Depends(get_current_principal)):
     """Check if user is an affiliate"""
     affiliate = await db.affiliates.find_one({"user_id": str(current_user["_id"])})
     
@@ -1277,7 +1920,7 @@ async def get_affiliate_status(current_user: dict = Depends(get_current_user)):
         return {"isAffiliate": False, "affiliateData": None}
 
 @app.post("/api/affiliate/register")
-async def register_affiliate(affiliate_data: dict, current_user: dict = Depends(get_current_user)):
+async def register_affiliate(affiliate_data: dict, current_user: dict = Depends(get_current_principal)):
     """Register as affiliate"""
     # Generate unique affiliate code
     affiliate_code = f"BMB{str(current_user['_id'])[-6:].upper()}"
@@ -1303,7 +1946,7 @@ async def register_affiliate(affiliate_data: dict, current_user: dict = Depends(
     }
 
 @app.get("/api/affiliate/stats")
-async def get_affiliate_stats(current_user: dict = Depends(get_current_user)):
+async def get_affiliate_stats(current_user: dict = Depends(get_current_principal)):
     """Get affiliate statistics"""
     # Sample stats - in real app, this would be calculated from actual data
     stats = {
@@ -1315,7 +1958,7 @@ async def get_affiliate_stats(current_user: dict = Depends(get_current_user)):
     return stats
 
 @app.get("/api/affiliate/activity")
-async def get_affiliate_activity(current_user: dict = Depends(get_current_user)):
+async def get_affiliate_activity(current_user: dict = Depends(get_current_principal)):
     """Get recent affiliate activity"""
     # Sample activity data
     activity = [
@@ -1327,7 +1970,7 @@ async def get_affiliate_activity(current_user: dict = Depends(get_current_user))
 
 # Ticket Management endpoints
 @app.get("/api/tickets/download/{booking_id}")
-async def download_ticket(booking_id: str, current_user: dict = Depends(get_current_user)):
+async def download_ticket(booking_id: str, current_user: dict = Depends(get_current_principal)):
     """Download ticket as PDF"""
     try:
         booking = await db.bookings.find_one({
@@ -1345,7 +1988,7 @@ async def download_ticket(booking_id: str, current_user: dict = Depends(get_curr
         raise HTTPException(status_code=400, detail="Invalid booking ID")
 
 @app.post("/api/tickets/send")
-async def send_ticket(send_data: dict, current_user: dict = Depends(get_current_user)):
+async def send_ticket(send_data: dict, current_user: dict = Depends(get_current_principal)):
     """Send ticket via email or SMS"""
     try:
         booking = await db.bookings.find_one({
@@ -1380,9 +2023,8 @@ async def search_by_transport_type(transport_type: str, search: SearchRequest):
 
 # Admin Management APIs
 @app.get("/api/admin/users")
-async def get_all_users(current_user: dict = Depends(get_current_user)):
+async def get_all_users(current_user: dict = Depends(require_permissions("users:read"))):
     """Get all users for admin management"""
-    # In real implementation, check admin permissions
     try:
         users = await db.users.find({}).to_list(length=1000)
         
@@ -1400,22 +2042,33 @@ async def get_all_users(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.put("/api/admin/users/{user_id}/permissions")
-async def update_user_permissions(user_id: str, permissions_data: dict, current_user: dict = Depends(get_current_user)):
-    """Update user permissions"""
+async def update_user_permissions(user_id: str, permissions_data: dict, current_user: dict = Depends(require_permissions("users:permissions"))):
+    """Update user permissions (and optionally role)"""
+    updates = {
+        "permissions": permissions_data.get("permissions", {}),
+        "updated_at": datetime.utcnow()
+    }
+    if not isinstance(updates["permissions"], dict):
+        raise HTTPException(status_code=400, detail="Permissions must map categories to actions")
+    if "role" in permissions_data:
+        if permissions_data["role"] not in ROLES:
+            raise HTTPException(status_code=400, detail=f"Role must be one of {', '.join(ROLES)}")
+        updates["role"] = permissions_data["role"]
+
     try:
         await db.users.update_one(
             {"_id": ObjectId(user_id)},
-            {"$set": {
-                "permissions": permissions_data["permissions"],
-                "updated_at": datetime.utcnow()
-            }}
+            {"$set": updates, "$inc": {"permission_version": 1}}
         )
+        principal_cache.invalidate_user(user_id)
+        # Access tokens carry the old permissions; end the user's sessions so none outlive the change
+        await session_store.revoke_user(user_id)
         return {"message": "Permissions updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid user ID")
 
 @app.get("/api/admin/buses")
-async def get_all_buses(current_user: dict = Depends(get_current_user)):
+async def get_all_buses(current_user: dict = Depends(require_permissions("buses:read"))):
     """Get all buses for admin management"""
     try:
         buses = await db.buses.find({}).to_list(length=1000)
@@ -1430,7 +2083,7 @@ async def get_all_buses(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/api/admin/buses")
-async def create_bus(bus_data: dict, current_user: dict = Depends(get_current_user)):
+async def create_bus(bus_data: dict, current_user: dict = Depends(require_permissions("buses:create"))):
     """Create new bus"""
     bus_record = {
         **bus_data,
@@ -1443,7 +2096,7 @@ async def create_bus(bus_data: dict, current_user: dict = Depends(get_current_us
     return {"message": "Bus created successfully", "id": str(result.inserted_id)}
 
 @app.put("/api/admin/buses/{bus_id}")
-async def update_bus(bus_id: str, bus_data: dict, current_user: dict = Depends(get_current_user)):
+async def update_bus(bus_id: str, bus_data: dict, current_user: dict = Depends(require_permissions("buses:update"))):
     """Update bus information"""
     try:
         await db.buses.update_one(
@@ -1459,7 +2112,7 @@ async def update_bus(bus_id: str, bus_data: dict, current_user: dict = Depends(g
         raise HTTPException(status_code=400, detail="Invalid bus ID")
 
 @app.delete("/api/admin/buses/{bus_id}")
-async def delete_bus(bus_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_bus(bus_id: str, current_user: dict = Depends(require_permissions("buses:delete"))):
     """Delete bus"""
     try:
         result = await db.buses.delete_one({"_id": ObjectId(bus_id)})
@@ -1470,7 +2123,7 @@ async def delete_bus(bus_id: str, current_user: dict = Depends(get_current_user)
         raise HTTPException(status_code=400, detail="Invalid bus ID")
 
 @app.get("/api/admin/routes")
-async def get_all_routes(current_user: dict = Depends(get_current_user)):
+async def get_all_routes(current_user: dict = Depends(require_permissions("routes:read"))):
     """Get all routes for admin management"""
     try:
         routes = await db.routes.find({}).to_list(length=1000)
@@ -1485,7 +2138,7 @@ async def get_all_routes(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/api/admin/routes")
-async def create_route(route_data: dict, current_user: dict = Depends(get_current_user)):
+async def create_route(route_data: dict, current_user: dict = Depends(require_permissions("routes:create"))):
     """Create new route"""
     route_record = {
         **route_data,
@@ -1498,7 +2151,7 @@ async def create_route(route_data: dict, current_user: dict = Depends(get_curren
     return {"message": "Route created successfully", "id": str(result.inserted_id)}
 
 @app.put("/api/admin/routes/{route_id}")
-async def update_route(route_id: str, route_data: dict, current_user: dict = Depends(get_current_user)):
+async def update_route(route_id: str, route_data: dict, current_user: dict = Depends(require_permissions("routes:update"))):
     """Update route information"""
     try:
         await db.routes.update_one(
@@ -1509,68 +2162,26 @@ async def update_route(route_id: str, route_data: dict, current_user: dict = Dep
                 "updated_by": str(current_user["_id"])
             }}
         )
+        catalog_cache.invalidate_route(route_id)
         return {"message": "Route updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid route ID")
 
 @app.delete("/api/admin/routes/{route_id}")
-async def delete_route(route_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_route(route_id: str, current_user: dict = Depends(require_permissions("routes:delete"))):
     """Delete route"""
     try:
         result = await db.routes.delete_one({"_id": ObjectId(route_id)})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Route not found")
+        catalog_cache.invalidate_route(route_id)
         return {"message": "Route deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid route ID")
 
-@app.get("/api/admin/stats")
-async def get_admin_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    """Get comprehensive admin dashboard statistics"""
-    # Get various counts and stats
-    total_users = await db.users.count_documents({})
-    active_buses = await db.buses.count_documents({"status": "active"})
-    total_routes = await db.routes.count_documents({})
-    
-    # Get revenue data
-    revenue_pipeline = [
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]
-    revenue_result = await db.payments.aggregate(revenue_pipeline).to_list(length=1)
-    total_revenue = revenue_result[0]["total"] if revenue_result else 0
-    
-    # Get monthly stats
-    from datetime import datetime, timedelta
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    
-    monthly_bookings = await db.bookings.count_documents({
-        "created_at": {"$gte": thirty_days_ago}
-    })
-    
-    monthly_revenue_pipeline = [
-        {"$match": {
-            "status": "completed",
-            "created_at": {"$gte": thirty_days_ago}
-        }},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]
-    monthly_revenue_result = await db.payments.aggregate(monthly_revenue_pipeline).to_list(length=1)
-    monthly_revenue = monthly_revenue_result[0]["total"] if monthly_revenue_result else 0
-    
-    return {
-        "total_users": total_users,
-        "active_buses": active_buses,
-        "total_routes": total_routes,
-        "total_revenue": round(total_revenue, 2),
-        "monthly_bookings": monthly_bookings,
-        "monthly_revenue": round(monthly_revenue, 2),
-        "generated_at": datetime.utcnow()
-    }
-
 # Bulk operations for admin
 @app.post("/api/admin/buses/bulk-upload")
-async def bulk_upload_buses(buses_data: list, current_user: dict = Depends(get_current_user)):
+async def bulk_upload_buses(buses_data: list, current_user: dict = Depends(require_permissions("buses:upload"))):
     """Bulk upload buses from CSV/Excel"""
     created_count = 0
     errors = []
@@ -1595,7 +2206,7 @@ async def bulk_upload_buses(buses_data: list, current_user: dict = Depends(get_c
     }
 
 @app.post("/api/admin/routes/bulk-upload")
-async def bulk_upload_routes(routes_data: list, current_user: dict = Depends(get_current_user)):
+async def bulk_upload_routes(routes_data: list, current_user: dict = Depends(require_permissions("routes:upload"))):
     """Bulk upload routes from CSV/Excel"""
     created_count = 0
     errors = []
@@ -1621,7 +2232,7 @@ async def bulk_upload_routes(routes_data: list, current_user: dict = Depends(get
 
 # Seat configuration management
 @app.get("/api/admin/seats/configurations")
-async def get_seat_configurations(current_user: dict = Depends(get_current_user)):
+async def get_seat_configurations(current_user: dict = Depends(require_permissions("buses:read"))):
     """Get all seat layout configurations"""
     configurations = await db.seat_configurations.find({}).to_list(length=100)
     
@@ -1631,7 +2242,7 @@ async def get_seat_configurations(current_user: dict = Depends(get_current_user)
     return configurations
 
 @app.post("/api/admin/seats/configurations")
-async def create_seat_configuration(config_data: dict, current_user: dict = Depends(get_current_user)):
+async def create_seat_configuration(config_data: dict, current_user: dict = Depends(require_permissions("buses:update"))):
     """Create new seat layout configuration"""
     config_record = {
         "name": config_data["name"],
@@ -1647,7 +2258,7 @@ async def create_seat_configuration(config_data: dict, current_user: dict = Depe
 
 # Bus operator management
 @app.get("/api/admin/operators")
-async def get_bus_operators(current_user: dict = Depends(get_current_user)):
+async def get_bus_operators(current_user: dict = Depends(require_permissions("operations:manage"))):
     """Get all bus operators"""
     operators = await db.bus_operators.find({}).to_list(length=1000)
     
@@ -1657,7 +2268,7 @@ async def get_bus_operators(current_user: dict = Depends(get_current_user)):
     return operators
 
 @app.post("/api/admin/operators")
-async def create_bus_operator(operator_data: dict, current_user: dict = Depends(get_current_user)):
+async def create_bus_operator(operator_data: dict, current_user: dict = Depends(require_permissions("operations:manage"))):
     """Create new bus operator"""
     operator_record = {
         **operator_data,
@@ -1718,104 +2329,6 @@ async def get_popular_routes():
         print(f"Error fetching popular routes: {str(e)}")
         return []
 
-# Enhanced booking endpoint with better error handling
-@app.post("/api/bookings")
-async def create_booking(booking_data: dict, current_user: dict = Depends(get_current_user)):
-    """Create a new booking with comprehensive validation"""
-    try:
-        # Generate booking reference
-        booking_reference = f"BMB{random.randint(100000, 999999)}"
-        
-        # Create booking record
-        booking = {
-            "booking_reference": booking_reference,
-            "user_id": str(current_user["_id"]),
-            "route_id": booking_data.get("route_id"),
-            "date": booking_data.get("date"),
-            "departure_time": booking_data.get("departure_time", "06:00"),
-            "arrival_time": booking_data.get("arrival_time", "11:45"),
-            "seats": booking_data.get("seats", []),
-            "passenger_details": booking_data.get("passenger_details", []),
-            "total_price": booking_data.get("total_price", 15.0),
-            "status": "pending",
-            "created_at": datetime.utcnow(),
-            "route_details": booking_data.get("route_details", {})
-        }
-        
-        # Insert booking
-        result = await db.bookings.insert_one(booking)
-        booking["id"] = str(result.inserted_id)
-        booking["_id"] = result.inserted_id
-        
-        return {
-            "booking_id": str(result.inserted_id),
-            "booking_reference": booking_reference,
-            "status": "success",
-            "message": "Booking created successfully",
-            "booking": booking
-        }
-        
-    except Exception as e:
-        print(f"Error creating booking: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to create booking")
-
-# Enhanced payment processing
-@app.post("/api/payments/process")
-async def process_payment(payment_data: dict, current_user: dict = Depends(get_current_user)):
-    """Process payment with multiple methods support"""
-    try:
-        booking_id = payment_data.get("booking_id")
-        payment_method = payment_data.get("payment_method")
-        amount = payment_data.get("amount", 15.0)
-        
-        # Validate booking exists
-        booking = await db.bookings.find_one({"_id": ObjectId(booking_id)})
-        if not booking:
-            raise HTTPException(status_code=404, detail="Booking not found")
-        
-        # Generate transaction ID
-        transaction_id = f"TXN{random.randint(1000000, 9999999)}"
-        
-        # Create payment record
-        payment = {
-            "transaction_id": transaction_id,
-            "booking_id": booking_id,
-            "user_id": str(current_user["_id"]),
-            "amount": amount,
-            "payment_method": payment_method,
-            "status": "completed",
-            "created_at": datetime.utcnow(),
-            "payment_data": payment_data.get("payment_data", {})
-        }
-        
-        # Insert payment
-        await db.payments.insert_one(payment)
-        
-        # Update booking status
-        await db.bookings.update_one(
-            {"_id": ObjectId(booking_id)},
-            {"$set": {
-                "status": "paid",
-                "payment_status": "completed",
-                "transaction_id": transaction_id,
-                "paid_at": datetime.utcnow()
-            }}
-        )
-        
-        return {
-            "transaction_id": transaction_id,
-            "status": "success",
-            "message": "Payment processed successfully",
-            "booking_reference": booking.get("booking_reference"),
-            "amount": amount
-        }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error processing payment: {str(e)}")
-        raise HTTPException(status_code=500, detail="Payment processing failed")
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,41 @@
+"""Multi-document transaction helper.
+
+Transactions need a replica set or mongos. On a standalone development
+server the callback runs without a session instead, so the code path stays
+the same everywhere and production gets atomic writes.
+"""
+import logging
+from typing import Awaitable, Callable, Optional
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Server error codes meaning "this deployment cannot run transactions"
+TRANSACTIONS_UNSUPPORTED_CODES = {20, 263}
+
+_transactions_supported: Optional[bool] = None
+
+
+async def run_in_transaction(db, callback: Callable[[object], Awaitable]):
+    """Run callback(session) atomically, retrying transient transaction errors.
+
+    The callback may be re-run by the driver, so it must not have side effects
+    outside the database (no gateway calls). Jobs are enqueued with the
+    session so they commit together with the writes that caused them.
+    """
+    global _transactions_supported
+
+    if _transactions_supported is not False:
+        try:
+            async with await db.client.start_session() as session:
+                result = await session.with_transaction(callback)
+            _transactions_supported = True
+            return result
+        except OperationFailure as e:
+            if _transactions_supported or e.code not in TRANSACTIONS_UNSUPPORTED_CODES:
+                raise
+            _transactions_supported = False
+            logger.warning("MongoDB deployment does not support transactions; writes will not be atomic")
+
+    return await callback(None)
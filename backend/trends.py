@@ -0,0 +1,153 @@
+"""Booking and revenue trends over arbitrary ranges.
+
+Trends come from the hourly sub-buckets of ``daily_rollups``, never from
+raw bookings. Each hourly value is placed on a UTC hour axis, shifted into
+the requested timezone, then bucketed by hour, day, ISO week (Monday start)
+or month with NumPy. Empty buckets are filled with zeros, so a two-year
+monthly chart reads at most ~730 day docs per series and does a handful of
+vectorised passes.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from catalog_cache import route_label
+from daily_rollups import ALL
+from departures import to_utc
+
+GRANULARITIES = ["hour", "day", "week", "month"]
+GROUP_BY = ["route", "operator", "transport_type"]
+METRICS = {"bookings": "bookings_created", "revenue": "revenue"}
+MAX_BUCKETS = 5000
+
+
+class TrendRequestError(ValueError):
+    pass
+
+
+def _bucket_starts(local_hours: np.ndarray, granularity: str) -> np.ndarray:
+    """Start of the bucket each local datetime64[h] falls in, as datetime64[h]"""
+    if granularity == "hour":
+        return local_hours
+    days = local_hours.astype("datetime64[D]")
+    if granularity == "day":
+        return days.astype("datetime64[h]")
+    if granularity == "week":
+        # 1970-01-01 was a Thursday; shift back to the preceding Monday
+        weekday = (days.astype(np.int64) + 3) % 7
+        return (days - weekday.astype("timedelta64[D]")).astype("datetime64[h]")
+    return local_hours.astype("datetime64[M]").astype("datetime64[h]")
+
+
+def _bucket_axis(start: datetime, end: datetime, granularity: str) -> np.ndarray:
+    """Every bucket start from start's bucket to end's bucket inclusive"""
+    first, last = _bucket_starts(np.array([start, end], dtype="datetime64[h]"), granularity)
+    if granularity == "month":
+        months = np.arange(first.astype("datetime64[M]"), last.astype("datetime64[M]") + 1)
+        return months.astype("datetime64[h]")
+    step = {"hour": 1, "day": 24, "week": 24 * 7}[granularity]
+    return np.arange(first, last + np.timedelta64(step, "h"), np.timedelta64(step, "h"))
+
+
+def _utc_offsets(utc_hours: np.ndarray, tz: ZoneInfo) -> np.ndarray:
+    """Offset of tz at each UTC hour as timedelta64[m] (computed once per distinct hour)"""
+    unique, inverse = np.unique(utc_hours, return_inverse=True)
+    offsets = np.array([
+        tz.utcoffset(hour.astype(datetime).replace(tzinfo=timezone.utc)).total_seconds() / 60
+        for hour in unique
+    ], dtype=np.int64)
+    return offsets[inverse].astype("timedelta64[m]")
+
+
+def _series_labels(group_by: Optional[str], keys: List[str], route_info: Dict[str, dict]) -> Dict[str, str]:
+    if group_by == "route":
+        return {key: route_label(route_info[key]) if key in route_info else key for key in keys}
+    return {key: key for key in keys}
+
+
+async def compute_trend(db, catalog, start: str, end: str, granularity: str = "day", group_by: Optional[str] = None,
+                        tz_name: str = "Asia/Phnom_Penh") -> dict:
+    """Bucketed bookings/revenue between local dates start and end (inclusive) in tz_name"""
+    if granularity not in GRANULARITIES:
+        raise TrendRequestError(f"Granularity must be one of {', '.join(GRANULARITIES)}")
+    if group_by is not None and group_by not in GROUP_BY:
+        raise TrendRequestError(f"Group by must be one of {', '.join(GROUP_BY)}")
+    try:
+        tz = ZoneInfo(tz_name)
+        range_start = datetime.strptime(start, "%Y-%m-%d")
+        range_end = datetime.strptime(end, "%Y-%m-%d") + timedelta(hours=23)
+    except (ValueError, KeyError):
+        raise TrendRequestError("Expected YYYY-MM-DD dates and an IANA timezone")
+    if range_end < range_start:
+        raise TrendRequestError("End date is before start date")
+
+    axis = _bucket_axis(range_start, range_end, granularity)
+    if len(axis) > MAX_BUCKETS:
+        raise TrendRequestError(f"Range has {len(axis)} buckets, the limit is {MAX_BUCKETS}; use a coarser granularity")
+
+    # Rollup days are Cambodia dates; widen by a day on each side to cover any timezone shift
+    utc_start = range_start.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+    utc_end = (range_end + timedelta(hours=1)).replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+    first_day = (utc_start - timedelta(days=1)).strftime("%Y-%m-%d")
+    last_day = (utc_end + timedelta(days=1)).strftime("%Y-%m-%d")
+
+    query = {"date": {"$gte": first_day, "$lte": last_day}}
+    if group_by is None:
+        query.update({"route_id": ALL, "operator": ALL})
+    else:
+        query["route_id"] = {"$ne": ALL}
+    docs = await db.daily_rollups.find(query, {"date": 1, "route_id": 1, "operator": 1, "hourly": 1}).to_list(length=None)
+
+    route_info = {}
+    if group_by in ("route", "transport_type"):
+        route_info = await catalog.routes(db, [doc["route_id"] for doc in docs])
+
+    # Flatten hourly sub-buckets into parallel arrays
+    hours, groups = [], []
+    values = {metric: [] for metric in METRICS}
+    for doc in docs:
+        if group_by == "route":
+            group = doc["route_id"]
+        elif group_by == "operator":
+            group = doc["operator"]
+        elif group_by == "transport_type":
+            group = route_info.get(doc["route_id"], {}).get("transport_type", "unknown")
+        else:
+            group = "all"
+        day = datetime.strptime(doc["date"], "%Y-%m-%d")
+        for hour, counters in (doc.get("hourly") or {}).items():
+            hours.append(to_utc(day + timedelta(hours=int(hour))))
+            groups.append(group)
+            for metric, field in METRICS.items():
+                values[metric].append(counters.get(field, 0))
+
+    buckets = [str(bucket) for bucket in axis.astype("datetime64[m]")]
+    if not hours:
+        return {"granularity": granularity, "timezone": tz_name, "start": start, "end": end,
+                "buckets": buckets, "series": []}
+
+    utc_hours = np.array(hours, dtype="datetime64[h]")
+    local_hours = (utc_hours.astype("datetime64[m]") + _utc_offsets(utc_hours, tz)).astype("datetime64[h]")
+    in_range = (local_hours >= np.datetime64(range_start, "h")) & (local_hours <= np.datetime64(range_end, "h"))
+    bucket_index = np.searchsorted(axis, _bucket_starts(local_hours, granularity))
+
+    group_keys, group_index = np.unique(np.array(groups, dtype=object), return_inverse=True)
+    labels = _series_labels(group_by, list(group_keys), route_info)
+
+    series = []
+    for g, key in enumerate(group_keys):
+        mask = in_range & (group_index == g)
+        entry = {"key": key, "label": labels.get(key, key)}
+        for metric in METRICS:
+            weights = np.asarray(values[metric], dtype=np.float64)[mask]
+            totals = np.bincount(bucket_index[mask], weights=weights, minlength=len(axis))[:len(axis)]
+            entry[metric] = (totals.astype(np.int64) if metric == "bookings" else np.round(totals, 2)).tolist()
+        entry["total_bookings"] = sum(entry["bookings"])
+        entry["total_revenue"] = round(float(sum(entry["revenue"])), 2)
+        series.append(entry)
+
+    series.sort(key=lambda item: item["total_revenue"], reverse=True)
+    return {"granularity": granularity, "timezone": tz_name, "start": start, "end": end,
+            "buckets": buckets, "series": series}
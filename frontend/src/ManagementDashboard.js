@@ -47,6 +47,7 @@ export const ManagementDashboard = () => {
   const [activeTab, setActiveTab] = useState('dashboard');
   const [dashboardData, setDashboardData] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [streamStatus, setStreamStatus] = useState('connecting');
   const { token } = useAuth();
 
   const tabs = [
@@ -64,6 +65,77 @@ export const ManagementDashboard = () => {
     fetchDashboardData();
   }, []);
 
+  // Live counters: a snapshot, then deltas and alerts pushed by the server
+  useEffect(() => {
+    if (!token) return;
+    const controller = new AbortController();
+
+    const applyEvent = (event, payload) => {
+      if (event === 'snapshot') {
+        setDashboardData(payload);
+        setLoading(false);
+        setStreamStatus('live');
+      } else if (event === 'delta') {
+        setDashboardData(prev => {
+          if (!prev) return prev;
+          const next = { ...prev };
+          Object.entries(payload.deltas).forEach(([name, value]) => {
+            next[name] = Math.round(((next[name] || 0) + value) * 100) / 100;
+          });
+          return next;
+        });
+      } else if (event === 'alert') {
+        setDashboardData(prev => prev && { ...prev, alerts: [payload, ...(prev.alerts || [])].slice(0, 20) });
+      }
+    };
+
+    const readStream = async () => {
+      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/management/realtime/stream`, {
+        headers: { 'Authorization': `Bearer ${token}` },
+        signal: controller.signal
+      });
+      if (!response.ok || !response.body) throw new Error(`Dashboard stream returned ${response.status}`);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) return;
+        buffer += decoder.decode(value, { stream: true });
+        const messages = buffer.split('\n\n');
+        buffer = messages.pop();
+        messages.forEach(message => {
+          const event = message.match(/^event: (.*)$/m);
+          const data = message.match(/^data: (.*)$/m);
+          if (event && data) applyEvent(event[1], JSON.parse(data[1]));
+        });
+      }
+    };
+
+    // Streams end on server restarts, proxy idle timeouts and errors; reconnect with backoff
+    const streamDashboard = async () => {
+      let delay = 1000;
+      while (!controller.signal.aborted) {
+        const startedAt = Date.now();
+        try {
+          await readStream();
+        } catch (error) {
+          if (error.name === 'AbortError') return;
+          console.error('Dashboard stream closed:', error);
+        }
+        if (controller.signal.aborted) return;
+        setStreamStatus('disconnected');
+        // A stream that stayed up a while was healthy; start the backoff over
+        if (Date.now() - startedAt > 30000) delay = 1000;
+        await new Promise(resolve => setTimeout(resolve, delay * (0.5 + Math.random())));
+        delay = Math.min(delay * 2, 30000);
+      }
+    };
+
+    streamDashboard();
+    return () => controller.abort();
+  }, [token]);
+
   const fetchDashboardData = async () => {
     try {
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/management/realtime/dashboard`, {
@@ -95,13 +167,25 @@ export const ManagementDashboard = () => {
                 <p className="text-sm text-gray-500">Smart AI-Powered Platform</p>
               </div>
             </div>
-            <button
-              onClick={fetchDashboardData}
-              className="flex items-center space-x-2 bg-orange-500 text-white px-4 py-2 rounded-lg hover:bg-orange-600 transition-colors"
-            >
-              <RefreshCw className="w-4 h-4" />
-              <span>Refresh</span>
-            </button>
+            <div className="flex items-center space-x-4">
+              <span
+                className={`flex items-center space-x-2 text-sm font-medium ${
+                  streamStatus === 'live' ? 'text-green-600' : streamStatus === 'disconnected' ? 'text-red-600' : 'text-gray-500'
+                }`}
+              >
+                {streamStatus === 'disconnected' ? <XCircle className="w-4 h-4" /> : <Activity className="w-4 h-4" />}
+                <span>
+                  {streamStatus === 'live' ? 'Live' : streamStatus === 'disconnected' ? 'Disconnected, reconnecting…' : 'Connecting…'}
+                </span>
+              </span>
+              <button
+                onClick={fetchDashboardData}
+                className="flex items-center space-x-2 bg-orange-500 text-white px-4 py-2 rounded-lg hover:bg-orange-600 transition-colors"
+              >
+                <RefreshCw className="w-4 h-4" />
+                <span>Refresh</span>
+              </button>
+            </div>
           </div>
         </div>
       </div>
@@ -170,6 +254,7 @@ const DashboardOverview = ({ data, loading }) => {
     { label: 'Active Bookings', value: data?.active_bookings || 0, icon: Users, color: 'text-blue-600 bg-blue-100' },
     { label: 'Today\'s Revenue', value: `$${data?.revenue_today || 0}`, icon: DollarSign, color: 'text-green-600 bg-green-100' },
     { label: 'Active Vehicles', value: data?.active_vehicles || 0, icon: Bus, color: 'text-purple-600 bg-purple-100' },
+    { label: 'Departures Boarding', value: data?.departures_boarding || 0, icon: Clock, color: 'text-orange-600 bg-orange-100' },
     { label: 'System Alerts', value: data?.alerts?.length || 0, icon: AlertTriangle, color: 'text-red-600 bg-red-100' }
   ];
 
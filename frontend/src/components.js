@@ -41,16 +41,81 @@ export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [token, setToken] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [expiresIn, setExpiresIn] = useState(null);
 
   useEffect(() => {
     // Check for existing token on mount
     const savedToken = localStorage.getItem('token');
-    if (savedToken) {
+    if (localStorage.getItem('refreshToken')) {
+      refreshSession();
+    } else if (savedToken) {
       setToken(savedToken);
       fetchUserProfile(savedToken);
     }
   }, []);
 
+  useEffect(() => {
+    // Access tokens are short-lived; rotate shortly before this one expires
+    if (!token || !expiresIn) return;
+    const timer = setTimeout(refreshSession, Math.max(expiresIn - 60, 30) * 1000);
+    return () => clearTimeout(timer);
+  }, [token, expiresIn]);
+
+  const storeTokens = (data) => {
+    setToken(data.access_token);
+    setExpiresIn(data.expires_in || null);
+    localStorage.setItem('token', data.access_token);
+    if (data.expires_in) {
+      localStorage.setItem('tokenExpiresAt', String(Date.now() + data.expires_in * 1000));
+    }
+    if (data.refresh_token) {
+      localStorage.setItem('refreshToken', data.refresh_token);
+    }
+  };
+
+  const refreshSession = async () => {
+    const seenToken = localStorage.getItem('refreshToken');
+    if (!seenToken) return;
+    // Refresh tokens are single-use: one refresh at a time across tabs and remounts
+    if (navigator.locks) {
+      await navigator.locks.request('refresh-session', () => rotateRefreshToken(seenToken));
+    } else {
+      await rotateRefreshToken(seenToken);
+    }
+  };
+
+  const rotateRefreshToken = async (seenToken) => {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (!refreshToken) return;
+    if (refreshToken !== seenToken) {
+      // Another tab rotated while this one waited for the lock; adopt its tokens
+      const savedToken = localStorage.getItem('token');
+      const expiresAt = Number(localStorage.getItem('tokenExpiresAt'));
+      setToken(savedToken);
+      setExpiresIn(expiresAt ? Math.max((expiresAt - Date.now()) / 1000, 1) : null);
+      await fetchUserProfile(savedToken);
+      return;
+    }
+    try {
+      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/auth/refresh`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ refresh_token: refreshToken }),
+      });
+      if (response.ok) {
+        const data = await response.json();
+        storeTokens(data);
+        await fetchUserProfile(data.access_token);
+      } else {
+        clearSession();
+      }
+    } catch (error) {
+      console.error('Error refreshing session:', error);
+    }
+  };
+
   const fetchUserProfile = async (authToken) => {
     try {
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/auth/me`, {
@@ -83,8 +148,7 @@ export const AuthProvider = ({ children }) => {
 
       if (response.ok) {
         const data = await response.json();
-        setToken(data.access_token);
-        localStorage.setItem('token', data.access_token);
+        storeTokens(data);
         await fetchUserProfile(data.access_token);
         return { success: true };
       } else {
@@ -125,10 +189,27 @@ export const AuthProvider = ({ children }) => {
     }
   };
 
-  const logout = () => {
+  const clearSession = () => {
     setUser(null);
     setToken(null);
+    setExpiresIn(null);
     localStorage.removeItem('token');
+    localStorage.removeItem('tokenExpiresAt');
+    localStorage.removeItem('refreshToken');
+  };
+
+  const logout = () => {
+    const currentToken = token || localStorage.getItem('token');
+    if (currentToken) {
+      // Revoke the session server-side; local state is cleared regardless
+      fetch(`${process.env.REACT_APP_BACKEND_URL}/api/auth/logout`, {
+        method: 'POST',
+        headers: {
+          'Authorization': `Bearer ${currentToken}`
+        },
+      }).catch((error) => console.error('Logout error:', error));
+    }
+    clearSession();
   };
 
   const value = {
@@ -672,7 +753,9 @@ export const SeatSelection = ({ route, searchData, onConfirmBooking }) => {
       route_id: route.id,
       selected_seats: selectedSeats,
       passenger_details: passengerDetails,
-      date: searchData.date
+      date: searchData.date,
+      // Holds the booking to the fare shown in the summary
+      price_token: route.price_token
     });
   };
 
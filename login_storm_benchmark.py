@@ -0,0 +1,116 @@
+# Measures search latency while a login storm keeps the bcrypt pool busy.
+#
+# Login, register and search are rate limited per client IP, so the API under
+# test must exempt the benchmark host, otherwise searches start failing with
+# 429 after the search-ip burst and the storm never reaches bcrypt:
+#
+#     RATE_LIMIT_EXEMPT_IPS=127.0.0.1 uvicorn server:app --port 8001
+#
+# (or RATE_LIMIT_ENABLED=false on a throwaway instance).
+import requests
+import os
+import time
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables from frontend/.env
+load_dotenv('/app/frontend/.env')
+
+BACKEND_URL = os.getenv('REACT_APP_BACKEND_URL', 'http://localhost:8001')
+API_URL = f"{BACKEND_URL}/api"
+
+SEARCH_REQUESTS = int(os.getenv('BENCH_SEARCH_REQUESTS', '300'))
+LOGIN_THREADS = int(os.getenv('BENCH_LOGIN_THREADS', '32'))
+
+SEARCH_PAYLOAD = {
+    "origin": "Phnom Penh",
+    "destination": "Siem Reap",
+    "date": datetime.now().strftime('%Y-%m-%d'),
+    "passengers": 1,
+    "transport_type": "bus"
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def measure_search_latency(count):
+    """Sequential searches, returning latencies in milliseconds"""
+    latencies = []
+    session = requests.Session()
+    for _ in range(count):
+        started = time.perf_counter()
+        response = session.post(f"{API_URL}/search", json=SEARCH_PAYLOAD)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code == 429:
+            raise SystemExit("Search was rate limited; start the API with RATE_LIMIT_EXEMPT_IPS set to this host")
+        response.raise_for_status()
+    return latencies
+
+
+def login_storm(credentials, stop_event, counters):
+    """Hammer the login endpoint until stop_event is set"""
+    session = requests.Session()
+    while not stop_event.is_set():
+        response = session.post(f"{API_URL}/auth/login", json=credentials)
+        counters[response.status_code] = counters.get(response.status_code, 0) + 1
+
+
+def report(label, latencies):
+    print(f"{label:<28} p50={statistics.median(latencies):7.1f}ms "
+          f"p95={percentile(latencies, 95):7.1f}ms p99={percentile(latencies, 99):7.1f}ms")
+
+
+def main():
+    print(f"Using API base URL: {API_URL}")
+
+    credentials = {
+        "email": f"bench_{datetime.now().strftime('%Y%m%d%H%M%S%f')}@example.com",
+        "password": "Bench123!"
+    }
+    register = requests.post(f"{API_URL}/auth/register", json={
+        **credentials, "first_name": "Bench", "last_name": "User", "phone": "0000000000"
+    })
+    register.raise_for_status()
+
+    # Warm up connections and caches
+    measure_search_latency(10)
+
+    baseline = measure_search_latency(SEARCH_REQUESTS)
+    report("search (idle)", baseline)
+
+    stop_event = threading.Event()
+    counters = {}
+    with ThreadPoolExecutor(max_workers=LOGIN_THREADS) as pool:
+        for _ in range(LOGIN_THREADS):
+            pool.submit(login_storm, credentials, stop_event, counters)
+        time.sleep(1)
+        during_storm = measure_search_latency(SEARCH_REQUESTS)
+        stop_event.set()
+
+    report(f"search ({LOGIN_THREADS} login threads)", during_storm)
+    print(f"login responses by status: {counters}")
+    if counters.get(429):
+        print("warning: logins were rate limited, so part of the storm never reached bcrypt")
+
+    metrics_token = requests.post(f"{API_URL}/auth/login", json=credentials).json().get("access_token")
+    if metrics_token:
+        metrics = requests.get(
+            f"{API_URL}/admin/metrics/password-hashing",
+            headers={"Authorization": f"Bearer {metrics_token}"}
+        )
+        if metrics.ok:
+            print(f"password hashing pool: {metrics.json()}")
+
+    ratio = percentile(during_storm, 99) / max(percentile(baseline, 99), 0.001)
+    print(f"search p99 during storm is {ratio:.2f}x idle p99")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other as top-level modules (``from booking_events import ...``)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory database; runs transactional code the way a standalone server does"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    import transactions
+
+    # mongomock has no sessions, so take run_in_transaction's no-transaction path
+    monkeypatch.setattr(transactions, "_transactions_supported", False)
+    return AsyncMongoMockClient()["test"]
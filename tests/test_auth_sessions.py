@@ -0,0 +1,120 @@
+import asyncio
+import secrets
+from datetime import datetime, timedelta
+
+import pytest
+
+from auth_sessions import BloomFilter, InvalidRefreshToken, RefreshTokenReused, SessionStore, hash_refresh_token
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    sids = [secrets.token_hex(16) for _ in range(1000)]
+    for sid in sids:
+        bloom.add(sid)
+    assert all(sid in bloom for sid in sids)
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_false_positive_rate_near_target():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for _ in range(1000):
+        bloom.add(secrets.token_hex(16))
+    probes = [secrets.token_hex(16) for _ in range(20000)]
+    false_positives = sum(probe in bloom for probe in probes)
+    # Well under 3x the configured rate at capacity
+    assert false_positives / len(probes) < 0.03
+
+
+def test_empty_bloom_filter_contains_nothing():
+    bloom = BloomFilter(capacity=100, error_rate=0.001)
+    assert "anything" not in bloom
+    assert bloom.size >= 8 and bloom.hash_count >= 1
+
+
+def test_replacement_token_is_stable_per_token_and_secret():
+    store = SessionStore(None, timedelta(minutes=15), "secret")
+    token = secrets.token_urlsafe(32)
+    assert store.replacement_token(token) == store.replacement_token(token)
+    assert store.replacement_token(token) != store.replacement_token(secrets.token_urlsafe(32))
+    assert store.replacement_token(token) != SessionStore(None, timedelta(minutes=15), "other").replacement_token(token)
+
+
+@pytest.fixture
+def store(db):
+    return SessionStore(db, timedelta(minutes=15), "secret", reuse_grace=timedelta(seconds=10))
+
+
+async def age_spent_token(db, token: str, by: timedelta):
+    await db.refresh_tokens.update_one({"_id": hash_refresh_token(token)}, {"$set": {"used_at": datetime.utcnow() - by}})
+
+
+@pytest.mark.asyncio
+async def test_rotation_spends_token_and_issues_replacement(store, db):
+    sid, token = await store.start_session("u1")
+    user_id, rotated_sid, replacement = await store.rotate(token)
+
+    assert (user_id, rotated_sid) == ("u1", sid)
+    assert replacement == store.replacement_token(token)
+    assert (await db.refresh_tokens.find_one({"_id": hash_refresh_token(token)}))["used_at"] is not None
+    assert (await db.refresh_tokens.find_one({"_id": hash_refresh_token(replacement)}))["used_at"] is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reuse_within_grace_gets_same_replacement(store, db):
+    sid, token = await store.start_session("u1")
+    first, second = await asyncio.gather(store.rotate(token), store.rotate(token))
+
+    assert first == second
+    assert await db.refresh_tokens.count_documents({"sid": sid}) == 2
+    assert not await store.is_revoked(sid)
+
+
+@pytest.mark.asyncio
+async def test_reuse_after_grace_revokes_session(store, db):
+    sid, token = await store.start_session("u1")
+    await store.rotate(token)
+    await age_spent_token(db, token, timedelta(minutes=1))
+
+    with pytest.raises(RefreshTokenReused):
+        await store.rotate(token)
+    assert await store.is_revoked(sid)
+    assert await db.refresh_tokens.count_documents({"sid": sid}) == 0
+
+
+@pytest.mark.asyncio
+async def test_reuse_after_replacement_was_rotated_revokes_session(store, db):
+    sid, token = await store.start_session("u1")
+    _, _, replacement = await store.rotate(token)
+    await store.rotate(replacement)
+
+    # Still inside the grace window, but the chain has already moved on
+    with pytest.raises(RefreshTokenReused):
+        await store.rotate(token)
+    assert await store.is_revoked(sid)
+    assert await db.refresh_tokens.count_documents({"sid": sid}) == 0
+
+
+@pytest.mark.asyncio
+async def test_logout_racing_rotation_leaves_no_live_token(store, db):
+    sid, token = await store.start_session("u1")
+    # Another worker has recorded the logout but not yet deleted the session's refresh tokens
+    await db.revoked_sessions.insert_one({"_id": sid, "user_id": "u1", "created_at": datetime.utcnow(),
+                                          "expires_at": datetime.utcnow() + timedelta(minutes=15)})
+
+    with pytest.raises(InvalidRefreshToken, match="revoked"):
+        await store.rotate(token)
+    assert await db.refresh_tokens.count_documents({"sid": sid}) == 0
+
+
+@pytest.mark.asyncio
+async def test_unknown_or_expired_token_is_rejected(store, db):
+    with pytest.raises(InvalidRefreshToken, match="Unknown"):
+        await store.rotate("never-issued")
+
+    sid, token = await store.start_session("u1")
+    await db.refresh_tokens.update_one({"_id": hash_refresh_token(token)},
+                                       {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    with pytest.raises(InvalidRefreshToken):
+        await store.rotate(token)
+    assert not await store.is_revoked(sid)
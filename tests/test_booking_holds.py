@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from booking_holds import (
+    BOOKING_HOLD_MINUTES, HoldSweeper, expire_pending_bookings, hold_expired, hold_expiry, seats_taken_filter
+)
+
+NOW = datetime(2024, 3, 5, 12, 0)
+
+
+async def insert_booking(db, status: str, expires_in: timedelta = None, seats=(1,)) -> object:
+    booking = {"user_id": "u1", "route_id": "r1", "date": "2024-03-06", "status": status,
+               "seats": list(seats), "total_price": 15.0 * len(seats)}
+    if expires_in is not None:
+        booking["expires_at"] = NOW + expires_in
+    return (await db.bookings.insert_one(booking)).inserted_id
+
+
+def test_hold_expiry_uses_hold_window():
+    assert hold_expiry(NOW) == NOW + timedelta(minutes=BOOKING_HOLD_MINUTES)
+
+
+def test_hold_expired_only_for_lapsed_pending_bookings():
+    assert hold_expired({"status": "pending", "expires_at": NOW}, now=NOW)
+    assert not hold_expired({"status": "pending", "expires_at": NOW + timedelta(seconds=1)}, now=NOW)
+    assert not hold_expired({"status": "paid", "expires_at": NOW - timedelta(hours=1)}, now=NOW)
+    assert not hold_expired({"status": "pending"}, now=NOW)
+
+
+@pytest.mark.asyncio
+async def test_seats_taken_counts_paid_and_live_holds(db):
+    paid = await insert_booking(db, "paid")
+    confirmed = await insert_booking(db, "confirmed")
+    live = await insert_booking(db, "pending", timedelta(minutes=5))
+    await insert_booking(db, "pending", timedelta(minutes=-5))
+    await insert_booking(db, "cancelled")
+    await insert_booking(db, "expired", timedelta(minutes=-20))
+
+    taken = await db.bookings.find(seats_taken_filter(NOW)).to_list(None)
+    assert {doc["_id"] for doc in taken} == {paid, confirmed, live}
+
+
+@pytest.mark.asyncio
+async def test_sweep_expires_lapsed_holds_and_logs_events(db):
+    lapsed = [await insert_booking(db, "pending", timedelta(minutes=-m)) for m in (1, 2, 3)]
+    live = await insert_booking(db, "pending", timedelta(minutes=5))
+    paid = await insert_booking(db, "paid", timedelta(minutes=-10))
+
+    expired = await expire_pending_bookings(db, batch_size=2, now=NOW)
+
+    assert sorted(expired) == sorted(lapsed)
+    for booking_id in lapsed:
+        assert (await db.bookings.find_one({"_id": booking_id}))["status"] == "expired"
+    assert (await db.bookings.find_one({"_id": live}))["status"] == "pending"
+    assert (await db.bookings.find_one({"_id": paid}))["status"] == "paid"
+
+    events = await db.booking_events.find({}).sort("seq", 1).to_list(None)
+    assert [event["type"] for event in events] == ["booking.expired"] * 3
+    assert [event["seq"] for event in events] == [1, 2, 3]
+    assert {event["booking_id"] for event in events} == {str(booking_id) for booking_id in lapsed}
+
+
+@pytest.mark.asyncio
+async def test_sweep_is_idempotent(db):
+    await insert_booking(db, "pending", timedelta(minutes=-1))
+    assert len(await expire_pending_bookings(db, now=NOW)) == 1
+    assert await expire_pending_bookings(db, now=NOW) == []
+    assert await db.booking_events.count_documents({}) == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_sweepers_expire_each_hold_once(db):
+    for minutes in range(1, 6):
+        await insert_booking(db, "pending", timedelta(minutes=-minutes))
+
+    first, second = await asyncio.gather(expire_pending_bookings(db, now=NOW), expire_pending_bookings(db, now=NOW))
+    assert len(first) + len(second) == 5
+    assert not set(first) & set(second)
+    assert await db.booking_events.count_documents({"type": "booking.expired"}) == 5
+
+
+@pytest.mark.asyncio
+async def test_hold_paid_before_sweep_is_not_expired(db):
+    booking_id = await insert_booking(db, "pending", timedelta(minutes=-1))
+    await db.bookings.update_one({"_id": booking_id}, {"$set": {"status": "paid"}, "$unset": {"expires_at": ""}})
+
+    assert await expire_pending_bookings(db, now=NOW) == []
+    assert (await db.bookings.find_one({"_id": booking_id}))["status"] == "paid"
+
+
+@pytest.mark.asyncio
+async def test_sweeper_releases_holds_in_background(db):
+    booking_id = await insert_booking(db, "pending", timedelta(minutes=-1))
+    await db.bookings.update_one({"_id": booking_id}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+    sweeper = HoldSweeper(db, interval=0.01)
+    sweeper.start()
+    try:
+        for _ in range(100):
+            if (await db.bookings.find_one({"_id": booking_id}))["status"] == "expired":
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await sweeper.stop()
+    assert (await db.bookings.find_one({"_id": booking_id}))["status"] == "expired"
@@ -0,0 +1,100 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from cohorts import fold_month, month_bounds, months_between, next_month, read_cohorts, rebuild_cohorts, refresh_cohorts
+
+
+def at(month: str, day: int = 15) -> datetime:
+    return datetime.strptime(f"{month}-{day:02d} 05:00", "%Y-%m-%d %H:%M")
+
+
+async def signup(db, month: str) -> str:
+    return str((await db.users.insert_one({"email": f"{ObjectId()}@example.com", "created_at": at(month)})).inserted_id)
+
+
+async def book(db, user_id: str, month: str, status: str = "paid", day: int = 15) -> ObjectId:
+    return (await db.bookings.insert_one({"user_id": user_id, "status": status, "created_at": at(month, day)})).inserted_id
+
+
+async def summary(db, cohort: str) -> dict:
+    return await db.cohort_summaries.find_one({"_id": cohort}, {"_id": 0, "updated_at": 0})
+
+
+def test_month_helpers():
+    assert next_month("2024-12") == "2025-01"
+    assert next_month("2024-03") == "2024-04"
+    assert months_between("2023-11", "2024-02") == 3
+    start, end = month_bounds("2024-03")
+    # Local (UTC+7) midnight on the first, in UTC
+    assert (start, end) == (datetime(2024, 2, 29, 17), datetime(2024, 3, 31, 17))
+
+
+@pytest.mark.asyncio
+async def test_fold_counts_bookers_repeat_bookers_and_retention(db):
+    first, second, _ = [await signup(db, "2024-01") for _ in range(3)]
+    await book(db, first, "2024-01")
+    await book(db, first, "2024-02")
+    await book(db, second, "2024-02")
+    await book(db, second, "2024-02", day=20)
+    # Only bookings holding seats count
+    await book(db, second, "2024-01", status="cancelled")
+    await book(db, second, "2024-01", status="pending")
+
+    await fold_month(db, "2024-01")
+    await fold_month(db, "2024-02")
+
+    assert await summary(db, "2024-01") == {
+        "cohort": "2024-01", "applied_through": "2024-02",
+        "size": 3, "bookers": 2, "repeat_bookers": 2, "bookings": 4,
+        "months": {"0": {"active": 1, "bookings": 1}, "1": {"active": 2, "bookings": 3}}
+    }
+
+
+@pytest.mark.asyncio
+async def test_refolding_a_month_changes_nothing(db):
+    user = await signup(db, "2024-01")
+    await book(db, user, "2024-01")
+    await fold_month(db, "2024-01")
+    before = await summary(db, "2024-01")
+
+    await fold_month(db, "2024-01")
+    assert await summary(db, "2024-01") == before
+    assert (await db.cohort_members.find_one({"_id": user}))["bookings"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancellation_after_fold_does_not_recount_bookers(db):
+    user = await signup(db, "2024-01")
+    booking_id = await book(db, user, "2024-01")
+    await fold_month(db, "2024-01")
+    await db.bookings.update_one({"_id": booking_id}, {"$set": {"status": "cancelled"}})
+    await book(db, user, "2024-02")
+    await fold_month(db, "2024-02")
+
+    doc = await summary(db, "2024-01")
+    assert doc["bookers"] == 1 <= doc["size"]
+    assert doc["repeat_bookers"] == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_folds_closed_months_once_and_rebuild_matches(db):
+    users = [await signup(db, "2024-01") for _ in range(2)] + [await signup(db, "2024-02")]
+    for user in users:
+        await book(db, user, "2024-02")
+    await book(db, users[0], "2024-03")
+
+    applied = await refresh_cohorts(db)
+    assert applied[:3] == ["2024-01", "2024-02", "2024-03"]
+    assert await refresh_cohorts(db) == []
+
+    folded = await read_cohorts(db)
+    rebuilt_months = await rebuild_cohorts(db)
+    assert rebuilt_months == applied
+    assert await read_cohorts(db) == folded
+
+    by_cohort = {cohort["cohort"]: cohort for cohort in folded["cohorts"]}
+    assert (by_cohort["2024-01"]["size"], by_cohort["2024-01"]["bookers"], by_cohort["2024-01"]["repeat_bookers"]) == (2, 2, 1)
+    assert by_cohort["2024-01"]["retention"] == [0.0, 1.0, 0.5]
+    assert by_cohort["2024-02"]["conversion_rate"] == 1.0
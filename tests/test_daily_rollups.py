@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from booking_events import BOOKING_CANCELLED, BOOKING_CREATED, BOOKING_PAID, BOOKING_REFUNDED
+from daily_rollups import (
+    ALL, CONSUMER_NAME, RollupUpdater, apply_rollup_events, net_revenue, read_rollup, read_rollup_at, rollup_id,
+    transition_counters
+)
+
+# 10:00 local (UTC+7) on 2024-03-05
+CREATED_AT = datetime(2024, 3, 5, 3, 0)
+DAY = "2024-03-05"
+
+
+def event(seq: int, event_type: str = BOOKING_CREATED, route_id: str = "r1-2", **data) -> dict:
+    return {
+        "seq": seq,
+        "type": event_type,
+        "booking_id": f"b{seq}",
+        "created_at": CREATED_AT,
+        "data": {"route_id": route_id, "operator": "Giant Ibis", "seat_count": 2, "total_price": 30.0, **data}
+    }
+
+
+def test_transition_counters():
+    assert transition_counters(BOOKING_CREATED, {"seat_count": 2, "total_price": 30.0}) == {
+        "bookings_created": 1, "seats_booked": 2, "booked_value": 30.0}
+    assert transition_counters(BOOKING_PAID, {"seat_count": 2, "total_price": 30.0, "amount": 28.0})["revenue"] == 28.0
+    assert transition_counters(BOOKING_REFUNDED, {"total_price": 30.0}) == {"refunds": 1, "refunded_amount": 30.0}
+    assert transition_counters("booking.unknown", {}) == {}
+
+
+def test_net_revenue():
+    assert net_revenue({"revenue": 100.0, "refunded_amount": 30.5}) == 69.5
+    assert net_revenue({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_events_fold_into_detail_total_and_all_time_docs(db):
+    await apply_rollup_events(db, [event(1), event(2, BOOKING_PAID, amount=30.0), event(3, route_id="r2-1")])
+
+    detail = await db.daily_rollups.find_one({"_id": rollup_id(DAY, "r1", "Giant Ibis", "08:30")})
+    assert detail["bookings_created"] == 1
+    assert detail["revenue"] == 30.0
+    assert detail["applied_seq"] == 2
+    assert detail["hourly"]["10"] == {"bookings_created": 1, "revenue": 30.0}
+
+    day = await read_rollup(db, DAY)
+    assert day["bookings_created"] == 2
+    assert day["seats_booked"] == 4
+    assert day["bookings_paid"] == 1
+    assert (await read_rollup(db, ALL))["bookings_created"] == 2
+    assert "hourly" not in await db.daily_rollups.find_one({"_id": rollup_id(ALL)})
+
+
+@pytest.mark.asyncio
+async def test_replayed_batch_changes_nothing(db):
+    batch = [event(1), event(2, BOOKING_PAID, amount=30.0)]
+    await apply_rollup_events(db, batch)
+    before = await db.daily_rollups.find({}).sort("_id", 1).to_list(None)
+
+    await apply_rollup_events(db, batch)
+    after = await db.daily_rollups.find({}).sort("_id", 1).to_list(None)
+    assert [{k: v for k, v in doc.items() if k != "updated_at"} for doc in after] == \
+           [{k: v for k, v in doc.items() if k != "updated_at"} for doc in before]
+
+
+@pytest.mark.asyncio
+async def test_overlapping_batch_applies_only_new_events(db):
+    await apply_rollup_events(db, [event(1), event(2)])
+    await apply_rollup_events(db, [event(2), event(3), event(4, BOOKING_CANCELLED)])
+
+    day = await read_rollup(db, DAY)
+    assert day["bookings_created"] == 3
+    assert day["bookings_cancelled"] == 1
+    assert (await db.daily_rollups.find_one({"_id": rollup_id(DAY)}))["applied_seq"] == 4
+
+
+@pytest.mark.asyncio
+async def test_concurrent_consumers_apply_a_batch_once(db):
+    batch = [event(1), event(2), event(3)]
+    await asyncio.gather(*(apply_rollup_events(db, batch) for _ in range(3)))
+    assert (await read_rollup(db, DAY))["bookings_created"] == 3
+
+
+@pytest.mark.asyncio
+async def test_updater_tails_event_log_and_checkpoints(db):
+    await db.booking_events.insert_many([event(1), event(2), event(3, BOOKING_PAID, amount=30.0)])
+    updater = RollupUpdater(db, interval=0.01)
+    updater.start()
+    try:
+        for _ in range(100):
+            if (await db.event_consumers.find_one({"_id": CONSUMER_NAME}) or {}).get("position") == 3:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await updater.stop()
+
+    counters, seq = await read_rollup_at(db, DAY)
+    assert seq == 3
+    assert counters["bookings_created"] == 2
+    assert counters["revenue"] == 30.0
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+
+from idempotency import IdempotencyStore, request_fingerprint
+
+@pytest_asyncio.fixture
+async def store(db):
+    store = IdempotencyStore(db)
+    await store.ensure_indexes()
+    return store
+
+
+class Handler:
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_fingerprint_ignores_key_order():
+    assert request_fingerprint({"a": 1, "b": [1, 2]}) == request_fingerprint({"b": [1, 2], "a": 1})
+    assert request_fingerprint({"a": 1}) != request_fingerprint({"a": 2})
+
+
+@pytest.mark.asyncio
+async def test_retry_replays_stored_response(store):
+    handler = Handler({"booking_id": "b1", "total_price": 30.0})
+    first = await store.run("key-1", "u1", "create_booking", {"seats": [1]}, handler)
+    replay = await store.run("key-1", "u1", "create_booking", {"seats": [1]}, handler)
+
+    assert first == {"booking_id": "b1", "total_price": 30.0}
+    assert handler.calls == 1
+    assert replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert json.loads(replay.body) == first
+
+
+@pytest.mark.asyncio
+async def test_key_reused_with_different_body_is_rejected(store):
+    handler = Handler({"ok": True})
+    await store.run("key-1", "u1", "process_payment", {"amount": 30}, handler)
+
+    with pytest.raises(HTTPException) as error:
+        await store.run("key-1", "u1", "process_payment", {"amount": 3000}, handler)
+    assert error.value.status_code == 422
+    assert handler.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_keys_are_scoped_per_user_and_endpoint(store):
+    handler = Handler({"ok": True})
+    await store.run("key-1", "u1", "create_booking", {}, handler)
+    await store.run("key-1", "u2", "create_booking", {}, handler)
+    await store.run("key-1", "u1", "process_payment", {}, handler)
+    assert handler.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_retry_while_first_request_runs_gets_409(store):
+    async def concurrent_retry():
+        # Arrives while the first request is still inside its handler
+        with pytest.raises(HTTPException) as error:
+            await store.run("key-1", "u1", "process_payment", {}, Handler({"ok": True}))
+        assert error.value.status_code == 409
+        return {"ok": True}
+
+    await store.run("key-1", "u1", "process_payment", {}, concurrent_retry)
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_replayed(store):
+    handler = Handler(error=HTTPException(status_code=400, detail="Seat 3 is already booked"))
+    with pytest.raises(HTTPException):
+        await store.run("key-1", "u1", "create_booking", {}, handler)
+
+    replay = await store.run("key-1", "u1", "create_booking", {}, handler)
+    assert replay.status_code == 400
+    assert json.loads(replay.body) == {"detail": "Seat 3 is already booked"}
+    assert handler.calls == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [HTTPException(status_code=502, detail="Gateway down"), RuntimeError("boom")])
+async def test_server_errors_release_the_key(store, error):
+    with pytest.raises(type(error)):
+        await store.run("key-1", "u1", "process_payment", {}, Handler(error=error))
+
+    retry = Handler({"ok": True})
+    assert await store.run("key-1", "u1", "process_payment", {}, retry) == {"ok": True}
+    assert retry.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_requests_without_key_always_run(store):
+    handler = Handler({"ok": True})
+    await store.run(None, "u1", "create_booking", {}, handler)
+    await store.run(None, "u1", "create_booking", {}, handler)
+    assert handler.calls == 2
+    assert await store.collection.count_documents({}) == 0
@@ -0,0 +1,165 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from job_queue import JobQueue, QueueFullError
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def queue(db):
+    queue = JobQueue(db, concurrency=2, max_attempts=2, lease_seconds=60, poll_interval=0.01)
+    calls = []
+
+    @queue.handler("record")
+    async def record(payload: dict):
+        calls.append(payload)
+
+    queue.calls = calls
+    return queue
+
+
+async def wait_for_status(queue, status: str, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        if await queue.collection.count_documents({"status": {"$ne": status}}) == 0:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"jobs did not reach {status}")
+
+
+async def test_workers_run_enqueued_jobs_once(queue):
+    queue.start()
+    try:
+        await queue.enqueue("record", {"n": 1})
+        await queue.enqueue_many([("record", {"n": 2}), ("record", {"n": 3})])
+        await wait_for_status(queue, "done")
+    finally:
+        await queue.stop()
+
+    assert sorted(call["n"] for call in queue.calls) == [1, 2, 3]
+    job = await queue.collection.find_one({"payload.n": 1})
+    assert job["attempts"] == 1
+    assert "owner" not in job and "locked_until" not in job
+    assert queue.pending == 0
+
+
+async def test_enqueue_rejects_unknown_kind(queue):
+    with pytest.raises(ValueError):
+        await queue.enqueue("missing", {})
+    with pytest.raises(ValueError):
+        await queue.enqueue_many([("record", {}), ("missing", {})])
+    assert await queue.collection.count_documents({}) == 0
+
+
+async def test_dedupe_key_admits_one_job(queue):
+    await queue.ensure_indexes()
+    await queue.enqueue("record", {"n": 1}, dedupe_key="acme:evt_1")
+    with pytest.raises(DuplicateKeyError):
+        await queue.enqueue("record", {"n": 1}, dedupe_key="acme:evt_1")
+    # Jobs without a key are not deduplicated against each other
+    await queue.enqueue("record", {"n": 2})
+    await queue.enqueue("record", {"n": 3})
+    assert await queue.collection.count_documents({}) == 3
+
+
+async def test_check_capacity_at_high_watermark(queue):
+    queue.max_pending = 1
+    queue.check_capacity()
+    await queue.enqueue("record", {})
+    with pytest.raises(QueueFullError):
+        queue.check_capacity()
+
+
+async def test_delayed_job_is_not_claimed_early(queue):
+    await queue.enqueue("record", {}, delay=60)
+    assert await queue._claim() is None
+
+
+async def test_claim_stamps_owner_and_lease(queue):
+    await queue.enqueue("record", {})
+    job = await queue._claim()
+    assert job["status"] == "running"
+    assert job["owner"]
+    assert job["locked_until"] > datetime.utcnow()
+    # A running job is not claimed a second time
+    assert await queue._claim() is None
+
+
+async def test_failure_retries_then_fails_permanently(queue):
+    @queue.handler("broken")
+    async def broken(payload: dict):
+        raise RuntimeError("boom")
+
+    await queue.enqueue("broken", {})
+    await queue._run(await queue._claim())
+    job = await queue.collection.find_one({})
+    assert job["status"] == "queued"
+    assert job["run_at"] > datetime.utcnow()
+    assert job["last_error"] == "boom"
+
+    await queue.collection.update_one({}, {"$set": {"run_at": datetime.utcnow()}})
+    await queue._run(await queue._claim())
+    job = await queue.collection.find_one({})
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
+
+
+async def test_heartbeat_renews_lease_while_handler_runs(db):
+    queue = JobQueue(db, lease_seconds=0.3)
+    leases = []
+
+    @queue.handler("slow")
+    async def slow(payload: dict):
+        for _ in range(3):
+            await asyncio.sleep(0.15)
+            leases.append((await queue.collection.find_one({}))["locked_until"])
+
+    await queue.enqueue("slow", {})
+    job = await queue._claim()
+    await queue._run(job)
+
+    # The handler outlived the original lease, which kept moving forward
+    assert leases[-1] > job["locked_until"]
+    assert (await queue.collection.find_one({}))["status"] == "done"
+
+
+async def test_worker_that_lost_its_lease_cannot_overwrite_new_owner(queue):
+    await queue.enqueue("record", {})
+    stale = await queue._claim()
+    # The lease expired, maintenance re-queued the job and another worker claimed it
+    await queue.collection.update_one({}, {"$set": {"status": "queued", "run_at": datetime.utcnow()},
+                                          "$unset": {"owner": "", "locked_until": ""}})
+    current = await queue._claim()
+
+    await queue._run(stale)
+    await queue._fail(stale, RuntimeError("late"))
+    job = await queue.collection.find_one({})
+    assert job["status"] == "running"
+    assert job["owner"] == current["owner"]
+    assert "last_error" not in job
+
+    await queue._run(current)
+    assert (await queue.collection.find_one({}))["status"] == "done"
+
+
+async def test_maintenance_requeues_expired_leases(queue):
+    await queue.enqueue("record", {})
+    await queue._claim()
+    await queue.collection.update_one({}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+
+    queue._running = True
+    task = asyncio.create_task(queue._maintenance())
+    try:
+        await wait_for_status(queue, "queued")
+    finally:
+        queue._running = False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    job = await queue.collection.find_one({})
+    assert "owner" not in job
+    assert queue.pending == 1
@@ -0,0 +1,80 @@
+import pytest
+import pytest_asyncio
+
+from catalog_cache import CatalogCache
+from departures import local_day_bounds
+from occupancy import OccupancyRequestError, compute_occupancy
+
+# 2024-03-04 is a Monday
+START, END = "2024-03-04", "2024-03-05"
+
+
+@pytest_asyncio.fixture
+async def route_id(db):
+    """One route served by two vehicles, so two daily departure slots"""
+    await db.vehicles.insert_many([
+        {"company": "Giant Ibis", "total_seats": 40},
+        {"company": "Mekong Express", "total_seats": 20},
+    ])
+    return str((await db.routes.insert_one({"origin": "Phnom Penh", "destination": "Siem Reap"})).inserted_id)
+
+
+async def book(db, route_id: str, slot: int, date: str, seats: int, status: str = "paid"):
+    await db.bookings.insert_one({
+        "route_id": f"{route_id}-{slot}", "date": date, "status": status,
+        "departure_at": local_day_bounds(date)[0], "seats": list(range(1, seats + 1))
+    })
+
+
+@pytest.mark.asyncio
+async def test_load_factor_per_departure_and_heatmap(db, route_id):
+    await book(db, route_id, 1, START, 30)
+    await book(db, route_id, 1, END, 10)
+    await book(db, route_id, 2, START, 5, status="confirmed")
+    # Not holding seats, or outside the range
+    await book(db, route_id, 1, START, 8, status="cancelled")
+    await book(db, route_id, 2, "2024-03-06", 20)
+
+    result = await compute_occupancy(db, CatalogCache(), START, END)
+
+    assert result["departures_scheduled"] == 4
+    assert result["seats_offered"] == 2 * (40 + 20)
+    assert result["seats_sold"] == 45
+    assert result["load_factor"] == round(45 / 120, 4)
+
+    by_departure = {item["route_schedule_id"]: item for item in result["by_departure"]}
+    first = by_departure[f"{route_id}-1"]
+    assert (first["seats_sold"], first["seats_offered"], first["load_factor"]) == (40, 80, 0.5)
+    assert first["low_load_days"] == 1
+    assert first["route_name"] == "Phnom Penh → Siem Reap"
+    assert by_departure[f"{route_id}-2"]["operator"] == "Mekong Express"
+    # Emptiest departures first
+    assert result["by_departure"][0]["route_schedule_id"] == f"{route_id}-2"
+
+    heatmap = result["heatmap"]
+    assert heatmap["columns"] == ["06:00", "08:30"]
+    assert heatmap["load_factor"][0] == [0.75, 0.25]
+    assert heatmap["load_factor"][1] == [0.25, 0.0]
+    assert heatmap["load_factor"][2] == [0.0, 0.0]
+    assert result["by_weekday"]["Mon"]["seats_sold"] == 35
+    assert result["by_route"][route_id]["load_factor"] == round(45 / 120, 4)
+
+
+@pytest.mark.asyncio
+async def test_route_filter_ignores_other_routes(db, route_id):
+    other = str((await db.routes.insert_one({"origin": "Kampot", "destination": "Kep"})).inserted_id)
+    await book(db, route_id, 1, START, 12)
+    await db.bookings.insert_one({"route_id": f"{other}-1", "date": START, "status": "paid",
+                                  "departure_at": local_day_bounds(START)[0], "seats": [1, 2]})
+
+    result = await compute_occupancy(db, CatalogCache(), START, START, route_id=route_id)
+    assert result["seats_sold"] == 12
+    assert set(result["by_route"]) == {route_id}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("start, end", [("2024-03-05", "2024-03-04"), ("03/04/2024", "2024-03-05"),
+                                        ("2023-01-01", "2024-03-05")])
+async def test_invalid_ranges_are_rejected(db, start, end):
+    with pytest.raises(OccupancyRequestError):
+        await compute_occupancy(db, CatalogCache(), start, end)
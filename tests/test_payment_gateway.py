@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from payment_gateway import GatewayClient, GatewayError, GatewayResult, GatewayUnavailable, PaymentGateway, SimulatedGateway
+
+
+class ScriptedGateway(PaymentGateway):
+    """Charges once per idempotency key; each call first plays the next scripted outcome"""
+
+    name = "scripted"
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.keys = []
+        self.charges = {}
+
+    async def charge(self, amount, currency, payment_method, reference, idempotency_key):
+        self.keys.append(idempotency_key)
+        if idempotency_key not in self.charges:
+            self.charges[idempotency_key] = GatewayResult(True, f"txn_{len(self.charges) + 1}", "Approved", self.name)
+        step = self.script.pop(0) if self.script else None
+        if step == "error":
+            raise GatewayError("provider error")
+        if step == "hang":
+            # The charge landed, but the response never arrives in time
+            await asyncio.sleep(10)
+        return self.charges[idempotency_key]
+
+
+def client(gateway, **kwargs) -> GatewayClient:
+    return GatewayClient(gateway, **{"timeout": 0.05, "budget": 1.0, "backoff": 0.0, **kwargs})
+
+
+@pytest.mark.asyncio
+async def test_retries_reuse_the_idempotency_key():
+    gateway = ScriptedGateway("error", "error")
+    result = await client(gateway).charge(30.0, "card", "BK1", "booking-1-0")
+
+    assert result.approved
+    assert gateway.keys == ["booking-1-0"] * 3
+    assert len(gateway.charges) == 1
+
+
+@pytest.mark.asyncio
+async def test_timed_out_charge_is_returned_not_repeated():
+    gateway = ScriptedGateway("hang")
+    result = await client(gateway).charge(30.0, "card", "BK1", "booking-1-0")
+
+    assert result.transaction_id == "txn_1"
+    assert len(gateway.charges) == 1
+
+
+@pytest.mark.asyncio
+async def test_exhausted_retries_raise_unavailable():
+    gateway = ScriptedGateway("error", "error", "error")
+    with pytest.raises(GatewayUnavailable):
+        await client(gateway, max_attempts=3).charge(30.0, "card", "BK1", "booking-1-0")
+    assert len(gateway.keys) == 3
+
+
+@pytest.mark.asyncio
+async def test_budget_caps_total_time():
+    gateway = ScriptedGateway(*["hang"] * 10)
+    with pytest.raises(GatewayUnavailable):
+        await client(gateway, max_attempts=10, timeout=0.05, budget=0.12).charge(30.0, "card", "BK1", "booking-1-0")
+    assert len(gateway.keys) <= 3
+
+
+@pytest.mark.asyncio
+async def test_decline_is_final_and_replayed_for_the_same_key():
+    gateway = SimulatedGateway(latency_ms=0, jitter_ms=0, decline_rate=1.0, seed=1)
+    gateway_client = client(gateway)
+    first = await gateway_client.charge(30.0, "card", "BK1", "booking-1-0")
+    gateway.decline_rate = 0.0
+    replay = await gateway_client.charge(30.0, "card", "BK1", "booking-1-0")
+    retry = await gateway_client.charge(30.0, "card", "BK1", "booking-1-1")
+
+    assert not first.approved
+    assert replay is first
+    assert retry.approved
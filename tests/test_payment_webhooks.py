@@ -0,0 +1,107 @@
+import hmac
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from payment_webhooks import (
+    PAYMENT_SUCCEEDED, SIGNATURE_TOLERANCE_SECONDS, InvalidSignature, _apply_succeeded, verify_signature
+)
+
+SECRET = "whsec_test"
+BODY = b'{"id": "evt_1", "type": "payment.succeeded"}'
+NOW = 1_700_000_000
+
+
+def sign(body: bytes, timestamp: int, secret: str = SECRET) -> str:
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+@pytest.fixture(autouse=True)
+def webhook_secret(monkeypatch):
+    monkeypatch.setenv("PAYMENT_WEBHOOK_SECRET_ACME", SECRET)
+
+
+def test_accepts_valid_signature():
+    verify_signature("acme", BODY, sign(BODY, NOW), now=NOW)
+
+
+def test_accepts_timestamp_within_tolerance():
+    verify_signature("acme", BODY, sign(BODY, NOW - SIGNATURE_TOLERANCE_SECONDS), now=NOW)
+
+
+def test_rejects_tampered_body():
+    with pytest.raises(InvalidSignature, match="mismatch"):
+        verify_signature("acme", BODY + b" ", sign(BODY, NOW), now=NOW)
+
+
+def test_rejects_wrong_secret():
+    with pytest.raises(InvalidSignature, match="mismatch"):
+        verify_signature("acme", BODY, sign(BODY, NOW, secret="other"), now=NOW)
+
+
+def test_rejects_stale_timestamp():
+    with pytest.raises(InvalidSignature, match="tolerance"):
+        verify_signature("acme", BODY, sign(BODY, NOW - SIGNATURE_TOLERANCE_SECONDS - 1), now=NOW)
+
+
+@pytest.mark.parametrize("header", [None, "", "v1=abc", "t=notanumber,v1=abc", "t=1700000000"])
+def test_rejects_missing_or_malformed_header(header):
+    with pytest.raises(InvalidSignature):
+        verify_signature("acme", BODY, header, now=NOW)
+
+
+def test_rejects_provider_without_secret():
+    with pytest.raises(InvalidSignature, match="No webhook secret"):
+        verify_signature("unknown", BODY, sign(BODY, NOW), now=NOW)
+
+
+def succeeded(booking_id, transaction_id="txn_1"):
+    return {"provider": "acme", "event_id": "evt_1", "type": PAYMENT_SUCCEEDED,
+            "data": {"booking_id": str(booking_id), "transaction_id": transaction_id, "amount": 30.0}}
+
+
+async def insert_pending(db, expires_in: timedelta) -> ObjectId:
+    booking_id = ObjectId()
+    await db.bookings.insert_one({"_id": booking_id, "user_id": "u1", "status": "pending", "seats": [3, 4],
+                                  "total_price": 30.0, "expires_at": datetime.utcnow() + expires_in})
+    return booking_id
+
+
+@pytest.mark.asyncio
+async def test_succeeded_pays_live_hold(db):
+    booking_id = await insert_pending(db, timedelta(minutes=5))
+    await _apply_succeeded(db, booking_id, succeeded(booking_id))
+
+    booking = await db.bookings.find_one({"_id": booking_id})
+    assert booking["status"] == "paid"
+    assert "expires_at" not in booking
+    payment = await db.payments.find_one({"booking_id": str(booking_id)})
+    assert payment["status"] == "completed"
+    assert await db.booking_events.count_documents({"type": "booking.paid"}) == 1
+
+
+@pytest.mark.asyncio
+async def test_succeeded_after_hold_lapsed_needs_refund(db):
+    # Expired but not yet swept: the seats are already free for other customers
+    booking_id = await insert_pending(db, timedelta(minutes=-1))
+    await _apply_succeeded(db, booking_id, succeeded(booking_id))
+
+    booking = await db.bookings.find_one({"_id": booking_id})
+    assert booking["status"] == "pending"
+    assert "expires_at" in booking
+    payment = await db.payments.find_one({"booking_id": str(booking_id)})
+    assert payment["status"] == "refund_pending"
+    assert await db.booking_events.count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_succeeded_redelivery_is_ignored(db):
+    booking_id = await insert_pending(db, timedelta(minutes=5))
+    await _apply_succeeded(db, booking_id, succeeded(booking_id))
+    await _apply_succeeded(db, booking_id, succeeded(booking_id))
+
+    assert await db.payments.count_documents({}) == 1
+    assert await db.booking_events.count_documents({}) == 1
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import pricing
+from pricing import PRICE_CEILING, PRICE_FLOOR, PricingEngine, price_departures, round_fare
+
+
+def departures(base=20.0, capacity=40, taken=0, recent=0, days_out=7, weekday=0):
+    return price_departures(np.array([base]), np.array([capacity]), np.array([taken]), np.array([recent]),
+                            np.array([days_out]), np.array([weekday]))
+
+
+def test_round_fare_rounds_to_half_dollar():
+    assert round_fare(np.array([20.0, 20.0]), np.array([1.01, 1.02])).tolist() == [20.0, 20.5]
+
+
+def test_round_fare_clamps_to_floor_and_ceiling():
+    fares = round_fare(np.array([20.0, 20.0]), np.array([0.1, 9.0]))
+    assert fares.tolist() == [20.0 * PRICE_FLOOR, 20.0 * PRICE_CEILING]
+
+
+def test_neutral_departure_sells_near_base():
+    # Half full, selling at the 14-day pace, a week out on a Monday
+    quote = departures(capacity=28, taken=14, recent=4)
+    assert quote["load"][0] == pytest.approx(0.5)
+    for factor in ("load_factor", "velocity_factor", "days_out_factor", "weekday_factor"):
+        assert quote[factor][0] == pytest.approx(1.0)
+    assert quote["price"][0] == 20.0
+
+
+def test_fuller_and_faster_departures_cost_more():
+    quiet = departures(taken=4)["price"][0]
+    busy = departures(taken=36, recent=20)["price"][0]
+    assert busy > quiet
+
+
+def test_last_minute_costs_more_than_far_out():
+    assert departures(days_out=0)["price"][0] > departures(days_out=60)["price"][0]
+
+
+def test_zero_capacity_does_not_divide_by_zero():
+    quote = departures(capacity=0, taken=0)
+    assert quote["load"][0] == 0.0
+    assert np.isfinite(quote["price"][0])
+
+
+def test_prices_stay_within_bounds():
+    quote = departures(capacity=10, taken=10, recent=100, days_out=0, weekday=4)
+    assert quote["price"][0] == 20.0 * PRICE_CEILING
+
+
+@pytest.fixture
+def engine():
+    return PricingEngine(db=None, secret="test-secret")
+
+
+def test_price_token_round_trip(engine):
+    token = engine.price_token("route-1-0", "2024-03-05", 21.5)
+    assert engine.quoted_price(token, "route-1-0", "2024-03-05") == 21.5
+
+
+def test_price_token_is_bound_to_departure(engine):
+    token = engine.price_token("route-1-0", "2024-03-05", 21.5)
+    assert engine.quoted_price(token, "route-1-1", "2024-03-05") is None
+    assert engine.quoted_price(token, "route-1-0", "2024-03-06") is None
+
+
+def test_price_token_rejects_tampering(engine):
+    price, expires, signature = engine.price_token("route-1-0", "2024-03-05", 21.5).split(":")
+    assert engine.quoted_price(f"1.00:{expires}:{signature}", "route-1-0", "2024-03-05") is None
+    assert engine.quoted_price("garbage", "route-1-0", "2024-03-05") is None
+    other = PricingEngine(db=None, secret="other-secret")
+    assert other.quoted_price(f"{price}:{expires}:{signature}", "route-1-0", "2024-03-05") is None
+
+
+def test_price_token_expires(engine, monkeypatch):
+    token = engine.price_token("route-1-0", "2024-03-05", 21.5)
+    now = pricing.time.time()
+    monkeypatch.setattr(pricing.time, "time", lambda: now + pricing.QUOTE_TTL_SECONDS + 1)
+    assert engine.quoted_price(token, "route-1-0", "2024-03-05") is None
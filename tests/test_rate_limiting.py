@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+import rate_limiting
+from rate_limiting import KEY_IP, KEY_USER, MemoryBackend, RateLimiter, RatePolicy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiting.time, "monotonic", clock)
+    return clock
+
+
+def take(backend, key="k", rate=2.0, burst=3, cost=1.0):
+    return asyncio.run(backend.take(key, rate, burst, cost))
+
+
+def test_bucket_starts_full_and_drains_to_burst(clock):
+    backend = MemoryBackend(shards=2)
+    assert [take(backend)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = take(backend)
+    assert not allowed
+    # One token short at 2 tokens/s
+    assert retry_after == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_rate(clock):
+    backend = MemoryBackend(shards=2)
+    for _ in range(3):
+        take(backend)
+    clock.now += 0.5
+    assert take(backend)[0]
+    assert not take(backend)[0]
+
+
+def test_refill_is_capped_at_burst(clock):
+    backend = MemoryBackend(shards=2)
+    take(backend)
+    clock.now += 3600
+    assert [take(backend)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_rejected_attempts_do_not_spend_tokens(clock):
+    backend = MemoryBackend(shards=2)
+    for _ in range(3):
+        take(backend)
+    for _ in range(5):
+        take(backend)
+    clock.now += 0.5
+    assert take(backend)[0]
+
+
+def test_keys_are_independent(clock):
+    backend = MemoryBackend(shards=2)
+    for _ in range(3):
+        take(backend, key="a")
+    assert not take(backend, key="a")[0]
+    assert take(backend, key="b")[0]
+
+
+def test_lru_bound_per_shard(clock):
+    backend = MemoryBackend(shards=1, max_keys=2)
+    for key in ("a", "b", "c"):
+        take(backend, key=key)
+    assert list(backend.shards[0]) == ["b", "c"]
+
+
+def test_limiter_applies_matching_policies_only(clock):
+    limiter = RateLimiter(MemoryBackend(shards=2), policies=[
+        RatePolicy("login-ip", "POST", "/api/auth/login", KEY_IP, rate=1, burst=1),
+        RatePolicy("search-user", "POST", "/api/search", KEY_USER, rate=1, burst=1),
+    ])
+    check = lambda method, path, user=None: asyncio.run(limiter.check(method, path, "10.0.0.1", lambda: user))
+
+    assert check("POST", "/api/auth/login") is None
+    assert check("POST", "/api/auth/login") == pytest.approx(1.0)
+    assert check("GET", "/api/auth/login") is None
+    # User-keyed policies skip anonymous requests
+    assert check("POST", "/api/search") is None
+    assert check("POST", "/api/search") is None
+    assert check("POST", "/api/search", user="u1") is None
+    assert check("POST", "/api/search", user="u1") is not None
+    assert limiter.rejected == {"login-ip": 1, "search-user": 1}
+
+
+def test_limiter_identifies_user_only_for_per_user_policies(clock):
+    limiter = RateLimiter(MemoryBackend(shards=2), policies=[
+        RatePolicy("search-ip", "POST", "/api/search", KEY_IP, rate=1, burst=5),
+        RatePolicy("search-user", "POST", "/api/search", KEY_USER, rate=1, burst=5),
+        RatePolicy("search-user-global", "POST", "/api/search", KEY_USER, rate=1, burst=5),
+    ])
+    calls = []
+
+    def identify():
+        calls.append(1)
+        return "u1"
+
+    asyncio.run(limiter.check("GET", "/api/health", "10.0.0.1", identify))
+    asyncio.run(limiter.check("POST", "/api/auth/login", "10.0.0.1", identify))
+    assert calls == []
+    asyncio.run(limiter.check("POST", "/api/search", "10.0.0.1", identify))
+    assert calls == [1]
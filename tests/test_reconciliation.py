@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from booking_events import BOOKING_PAID, append_event
+from reconciliation import compare, merge_join, run_reconciliation
+
+
+def payment(status: str = "completed", amount: float = 30.0, transaction_id: str = "txn_1") -> dict:
+    return {"_id": ObjectId(), "status": status, "amount": amount, "transaction_id": transaction_id}
+
+
+def kinds(issues) -> list:
+    return sorted(kind for kind, _ in issues)
+
+
+def test_consistent_paid_booking_has_no_issues():
+    booking = {"status": "paid", "total_price": 30.0, "transaction_id": "txn_1"}
+    assert compare("b1", booking, [payment(), payment("failed", transaction_id="txn_0")]) == []
+
+
+def test_compare_detects_each_kind():
+    assert kinds(compare("b1", {"status": "paid", "total_price": 30.0}, [])) == ["missing_payment"]
+    assert kinds(compare("b1", {"status": "cancelled", "total_price": 30.0}, [payment()])) == ["status_mismatch"]
+    assert kinds(compare("b1", {"status": "paid", "total_price": 30.0}, [payment(), payment()])) == \
+        ["amount_mismatch", "duplicate_payment"]
+    assert kinds(compare("b1", {"status": "paid", "total_price": 45.0}, [payment()])) == ["amount_mismatch"]
+    assert kinds(compare("b1", {"status": "paid", "total_price": 30.0, "transaction_id": "txn_9"}, [payment()])) == \
+        ["transaction_mismatch"]
+    assert kinds(compare("b1", None, [payment()])) == ["orphan_payment"]
+
+
+def test_refunded_and_unpaid_bookings_are_not_flagged():
+    assert compare("b1", {"status": "refunded", "refund_status": "completed", "total_price": 30.0}, [payment()]) == []
+    assert compare("b1", {"status": "pending", "total_price": 30.0}, [payment("failed")]) == []
+    assert compare("b1", None, [payment("failed")]) == []
+
+
+async def items(pairs):
+    for pair in pairs:
+        yield pair
+
+
+@pytest.mark.asyncio
+async def test_merge_join_pairs_sorted_streams():
+    bookings = items([("a", {"n": 1}), ("c", {"n": 3}), ("d", {"n": 4})])
+    payments = items([("b", ["pb"]), ("c", ["pc"]), ("e", ["pe"])])
+    joined = [row async for row in merge_join(bookings, payments)]
+    assert joined == [
+        ("a", {"n": 1}, []),
+        ("b", None, ["pb"]),
+        ("c", {"n": 3}, ["pc"]),
+        ("d", {"n": 4}, []),
+        ("e", None, ["pe"]),
+    ]
+
+
+async def insert_paid_booking(db, total_price: float = 30.0, paid: float = 30.0, created_at: datetime = None) -> str:
+    booking_id = (await db.bookings.insert_one({"status": "paid", "total_price": total_price, "transaction_id": "txn_1"})).inserted_id
+    await db.payments.insert_one({"booking_id": str(booking_id), "amount": paid, "status": "completed",
+                                  "transaction_id": "txn_1", "created_at": created_at or datetime.utcnow()})
+    return str(booking_id)
+
+
+@pytest.mark.asyncio
+async def test_full_run_records_mismatches(db):
+    await insert_paid_booking(db)
+    short = await insert_paid_booking(db, paid=20.0)
+    unpaid = str((await db.bookings.insert_one({"status": "paid", "total_price": 15.0})).inserted_id)
+
+    summary = await run_reconciliation(db)
+
+    assert summary["mode"] == "full"
+    assert summary["checked"] == 3
+    assert summary["mismatches"] == {"amount_mismatch": 1, "missing_payment": 1}
+    mismatches = await db.reconciliation_mismatches.find({}, {"_id": 0, "booking_id": 1, "kind": 1}).to_list(None)
+    assert sorted((m["booking_id"], m["kind"]) for m in mismatches) == sorted(
+        [(short, "amount_mismatch"), (unpaid, "missing_payment")])
+
+
+@pytest.mark.asyncio
+async def test_incremental_run_rechecks_only_changed_bookings(db):
+    await insert_paid_booking(db, paid=20.0, created_at=datetime.utcnow() - timedelta(days=1))
+    await run_reconciliation(db)
+
+    # Changed since the last run: one booking through the event log, one through a new payment
+    evented = await insert_paid_booking(db, created_at=datetime.utcnow() - timedelta(days=1))
+    await append_event(db, BOOKING_PAID, evented)
+    late_payment = await insert_paid_booking(db, paid=10.0)
+
+    summary = await run_reconciliation(db)
+
+    assert summary["mode"] == "incremental"
+    assert summary["checked"] == 2
+    assert summary["mismatches"] == {"amount_mismatch": 1}
+    mismatch = await db.reconciliation_mismatches.find_one({"run_id": ObjectId(summary["run_id"])})
+    assert mismatch["booking_id"] == late_payment
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from trends import _bucket_axis, _bucket_starts
+
+
+def hours(*values):
+    return np.array(values, dtype="datetime64[h]")
+
+
+def test_hour_buckets_are_unchanged():
+    local = hours("2024-03-05T07", "2024-03-05T23")
+    assert (_bucket_starts(local, "hour") == local).all()
+
+
+def test_day_buckets_floor_to_midnight():
+    starts = _bucket_starts(hours("2024-03-05T00", "2024-03-05T23", "2024-03-06T01"), "day")
+    assert (starts == hours("2024-03-05T00", "2024-03-05T00", "2024-03-06T00")).all()
+
+
+@pytest.mark.parametrize("local", ["2024-03-04T00", "2024-03-06T12", "2024-03-10T23"])
+def test_week_buckets_start_on_monday(local):
+    # 2024-03-04 was a Monday and 2024-03-10 the following Sunday
+    assert _bucket_starts(hours(local), "week")[0] == np.datetime64("2024-03-04T00", "h")
+
+
+def test_week_bucket_crosses_month_and_year():
+    starts = _bucket_starts(hours("2025-01-01T09", "1970-01-01T00"), "week")
+    assert (starts == hours("2024-12-30T00", "1969-12-29T00")).all()
+
+
+def test_month_buckets_start_on_the_first():
+    starts = _bucket_starts(hours("2024-02-29T23", "2024-03-01T00", "2024-12-31T23"), "month")
+    assert (starts == hours("2024-02-01T00", "2024-03-01T00", "2024-12-01T00")).all()
+
+
+def test_hour_axis_is_inclusive():
+    axis = _bucket_axis(datetime(2024, 3, 5, 22, 30), datetime(2024, 3, 6, 1, 0), "hour")
+    assert (axis == hours("2024-03-05T22", "2024-03-05T23", "2024-03-06T00", "2024-03-06T01")).all()
+
+
+def test_day_axis_single_day():
+    axis = _bucket_axis(datetime(2024, 3, 5, 1), datetime(2024, 3, 5, 23), "day")
+    assert (axis == hours("2024-03-05T00")).all()
+
+
+def test_week_axis_aligns_both_ends_to_monday():
+    axis = _bucket_axis(datetime(2024, 3, 6), datetime(2024, 3, 18, 12), "week")
+    assert (axis == hours("2024-03-04T00", "2024-03-11T00", "2024-03-18T00")).all()
+
+
+def test_month_axis_steps_calendar_months():
+    axis = _bucket_axis(datetime(2024, 1, 31), datetime(2024, 4, 1), "month")
+    assert (axis == hours("2024-01-01T00", "2024-02-01T00", "2024-03-01T00", "2024-04-01T00")).all()